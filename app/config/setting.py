@@ -13,5 +13,98 @@ class Settings(BaseSettings):
     DO_SPACES_REGION: str = "nyc3"
     DO_SPACES_BUCKET: str
     DO_SPACES_ENDPOINT: str = "https://nyc3.digitaloceanspaces.com"
+    DO_SPACES_MAX_POOL_CONNECTIONS: int = 20  # Connessioni del client S3 condiviso
+    DO_SPACES_MULTIPART_THRESHOLD: int = 8 * 1024 * 1024  # Byte oltre i quali usare il multipart
+    DO_SPACES_MULTIPART_CHUNKSIZE: int = 8 * 1024 * 1024  # Dimensione di ogni parte (min. 5 MB)
+    DO_SPACES_MAX_CONCURRENCY: int = 4  # Parti caricate in parallelo
+
+    # HTTP client configuration (pool di connessioni keep-alive condiviso)
+    HTTP_POOL_CONNECTIONS: int = 10  # Numero di host con pool dedicato
+    HTTP_POOL_MAXSIZE: int = 20  # Connessioni keep-alive per host
+    HTTP_CONNECT_TIMEOUT: float = 5.0  # Secondi
+    HTTP_READ_TIMEOUT: float = 60.0  # Secondi
+    HTTP2_ENABLED: bool = True  # Usato dal client asincrono se 'h2' è installato
+
+    # Upstream rate limit configuration (token bucket e richieste in corso per upstream; 0: nessun limite)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_MAX_WAIT: float = 30.0  # Secondi di attesa massima di un posto (anche dopo un 429)
+    RATE_LIMIT_AUTHORIZATION_PER_SECOND: float = 5.0  # AUTHORIZATION_API /token
+    RATE_LIMIT_AUTHORIZATION_MAX_IN_FLIGHT: int = 10
+    RATE_LIMIT_CERTIFICATES_PER_SECOND: float = 10.0  # GET /certificates
+    RATE_LIMIT_CERTIFICATES_MAX_IN_FLIGHT: int = 20
+    RATE_LIMIT_SMSP_PER_SECOND: float = 2.0  # /authenticators/{id}/SMSP (challenge e authorize)
+    RATE_LIMIT_SMSP_MAX_IN_FLIGHT: int = 5
+    RATE_LIMIT_SIGN_PER_SECOND: float = 5.0  # /certificates/{id}/sign e firma del digest
+    RATE_LIMIT_SIGN_MAX_IN_FLIGHT: int = 8
+    RATE_LIMIT_SPACES_PER_SECOND: float = 20.0  # Upload su DigitalOcean Spaces
+    RATE_LIMIT_SPACES_MAX_IN_FLIGHT: int = 16
+
+    # Token cache configuration
+    TOKEN_CACHE_ENABLED: bool = True
+    TOKEN_REFRESH_MARGIN: int = 60  # Secondi prima di expiresIn in cui rinnovare il token
+    TOKEN_CACHE_MAX_ENTRIES: int = 1024  # Utenti mantenuti in cache (i meno recenti vengono rimossi)
+
+    # PDF download configuration
+    PDF_MAX_DOWNLOAD_BYTES: int = 50 * 1024 * 1024  # Dimensione massima di un documento
+    PDF_SPOOL_THRESHOLD: int = 5 * 1024 * 1024  # Oltre questa soglia il download passa su disco
+    PDF_DOWNLOAD_CONNECT_TIMEOUT: float = 5.0  # Secondi
+    PDF_DOWNLOAD_READ_TIMEOUT: float = 30.0  # Secondi tra un blocco e il successivo
+
+    # Remote PDF configuration (lettura parziale con HTTP Range)
+    REMOTE_PDF_RANGE_ENABLED: bool = True
+    REMOTE_PDF_MIN_BYTES: int = 8 * 1024 * 1024  # Sotto questa dimensione conviene il download completo
+    REMOTE_PDF_BLOCK_SIZE: int = 256 * 1024  # Byte per blocco letto (e per richiesta Range minima)
+    REMOTE_PDF_CACHE_BLOCKS: int = 64  # Blocchi tenuti in memoria per documento (LRU)
+
+    # Document cache configuration (download e risultati di analisi)
+    DOCUMENT_CACHE_ENABLED: bool = True
+    DOCUMENT_CACHE_DIR: str = ""  # Vuoto: sottodirectory della directory temporanea di sistema
+    DOCUMENT_CACHE_MAX_BYTES: int = 512 * 1024 * 1024  # Byte massimi su disco
+    DOCUMENT_CACHE_MEMORY_BYTES: int = 64 * 1024 * 1024  # Byte massimi in memoria
+
+    # PDF analysis configuration (analisi delle pagine su pool di processi)
+    ANALYSIS_PROCESS_WORKERS: int = 0  # Processi (0: numero di CPU; 1: analisi sempre in processo)
+    ANALYSIS_PARALLEL_MIN_PAGES: int = 40  # Sotto questa soglia l'analisi resta in processo
+    ANALYSIS_PAGES_PER_TASK: int = 20  # Pagine per task inviato ai processi
+    ANALYSIS_POOL_TIMEOUT: float = 30.0  # Secondi di attesa dei processi, oltre a quelli per pagina
+    ANALYSIS_POOL_TIMEOUT_PER_PAGE: float = 2.0  # Secondi per pagina: oltre il totale l'analisi torna in processo
+    ANALYSIS_PRIORITY_MAX_PAGES: int = 10  # scan_strategy='priority': pagine massime analizzate
+    ANALYSIS_PRIORITY_TIME_BUDGET: float = 10.0  # scan_strategy='priority': secondi massimi
+    ANALYSIS_PRIORITY_LAST_PAGES: int = 2  # Ultime pagine analizzate per prime
+    ANALYSIS_LINE_MIN_LENGTH: float = 60.0  # scan_strategy='geometry': lunghezza minima delle linee (punti)
+
+    # Certificate cache configuration
+    CERTIFICATE_CACHE_TTL: int = 300  # Secondi
+    CERTIFICATE_CACHE_MAX_ENTRIES: int = 1024
+
+    # SAT session configuration (authorize_smsp: un'autorizzazione SMSP per più firme)
+    SAT_SIGNATURES_NUMBER: int = 100  # signaturesNumber richiesti a Infocert per ogni SAT
+    SAT_SESSION_TTL: int = 3600  # Secondi di validità di un SAT registrato dopo authorize_smsp
+    SAT_SESSION_MAX_ENTRIES: int = 1024
+
+    # Signature stamp configuration (talloncino visibile)
+    SIGNATURE_IMAGE_PATH: str = ""  # PNG del talloncino (vuoto: app/assets/signature_stamp.png)
+    SIGN_MAX_VISIBLE_FIELDS: int = 50  # Oltre queste pagine un solo talloncino sull'ultima (0: nessun limite)
+
+    # Hash signing configuration (signing_mode='hash': al servizio di firma viaggia solo il digest)
+    SIGN_HASH_ENDPOINT: str = "/certificates/{certificate_id}/sign-hash"  # Relativo a SIGNATURE_API
+    SIGN_HASH_SIGNER: str = "remote"  # 'local': firmatario locale di prova, senza chiamate a Infocert
+    SIGN_HASH_ALLOW_LOCAL_SIGNER: bool = False  # Solo test/sviluppo: senza questo flag SIGN_HASH_SIGNER=local viene rifiutato
+    SIGN_HASH_LOCAL_KEY: str = ""  # Chiave del firmatario locale (vuoto: chiave e certificato autofirmato generati)
+    SIGN_HASH_LOCAL_CERT: str = ""  # Certificato del firmatario locale
+    SIGN_HASH_SIGNATURE_BYTES: int = 16 * 1024  # Byte riservati alla firma CMS nel PDF
+
+    # Signing job queue configuration (submit_signing_job)
+    SIGN_JOB_WORKERS: int = 4  # Job di firma eseguiti contemporaneamente
+    SIGN_JOB_MAX_QUEUED: int = 100  # Job in attesa oltre i quali i nuovi invii vengono rifiutati
+    SIGN_JOB_RESULT_TTL: int = 3600  # Secondi per cui lo stato di un job concluso resta consultabile
+
+    # Batch signing configuration
+    SIGN_BATCH_MAX_DOCUMENTS: int = 100  # Pari a SAT_SIGNATURES_NUMBER
+    SIGN_BATCH_DOCUMENTS_PER_REQUEST: int = 10  # Documenti in padesSignatures per richiesta di firma
+    SIGN_BATCH_CONCURRENCY: int = 8  # Download/upload in parallelo
+    SIGN_BATCH_JOURNAL_ENABLED: bool = True  # Giornale delle fasi per riprendere un batch interrotto (batch_id)
+    SIGN_BATCH_JOURNAL_DIR: str = ""  # Directory privata (contiene PDF firmati); vuoto: directory temporanea di sistema
+    SIGN_BATCH_JOURNAL_TTL: int = 7 * 24 * 3600  # Secondi dopo i quali un batch non più aggiornato viene dimenticato
 
 settings = Settings()
\ No newline at end of file
@@ -1,27 +1,44 @@
 from fastmcp import FastMCP  # type: ignore
-from typing import Annotated, Dict, Union, Optional
+from typing import Annotated, Dict, Union, Optional, BinaryIO, Tuple
 from pydantic import Field, BaseModel
 from typing import List
 import base64
-import requests
-from requests.exceptions import RequestException
-import boto3
+import sqlite3
+import time
+import uuid
+import anyio
+from httpx import HTTPError, HTTPStatusError
 from botocore.exceptions import ClientError
 from datetime import datetime
 from urllib.parse import urlparse, urlunparse, unquote
 from app.config.setting import settings
-from pyhanko.pdf_utils.reader import PdfFileReader
+from app.services.http_client import async_http_client
+from app.services.rate_limit import (
+    AUTHORIZATION, CERTIFICATES, SIGN, SMSP, SPACES, UpstreamBusyError, upstream_slot, upstream_stats
+)
+from app.services.storage import get_spaces_client, get_transfer_config
+from app.services.token_cache import TokenCache
+from app.services.certificate_cache import CertificateCache
+from app.services.sat_session import SatSession, SatSessionError, SatSessionRegistry
+from app.services.dn_parser import parse_dn
+from app.services.download import download_pdf, DocumentTooLargeError
+from app.services.document_cache import document_cache
+from app.services.sign_request import (
+    StreamingSignBody, build_signature_fields, limit_visible_pages, load_signature_image
+)
+from app.services.sign_response import SignResponseParser
+from app.services.pdf_document import FieldWidget, PageBox, PdfDocument
+from app.services.keyword_scan import is_confident_signature_page, scan_pdf_pages, scan_pdf_pages_priority
+from app.services.page_analysis import page_analysis_pool
+from app.services.line_detection import detect_signature_lines
+from app.services.remote_pdf import RemotePdfFile, open_remote_pdf
+from app.services.job_queue import JobQueue, JobQueueFullError
+from app.services.batch_journal import SIGNED, UPLOADED, BatchMismatchError, batch_journal, batch_owner
+from app.services.hash_signing import (
+    HashSigningError, RemoteHashSigner, finish_hash_signature, local_hash_signer, prepare_hash_signature,
+    uses_local_hash_signer
+)
 from io import BytesIO
-try:
-    from PyPDF2 import PdfReader
-    PYPDF2_AVAILABLE = True
-except ImportError:
-    PYPDF2_AVAILABLE = False
-try:
-    import pdfplumber
-    PDFPLUMBER_AVAILABLE = True
-except ImportError:
-    PDFPLUMBER_AVAILABLE = False
 
 # MCP server configuration with additional options
 mcp = FastMCP(
@@ -33,7 +50,7 @@ mcp = FastMCP(
     retry_delay=5
 )
 
-def get_access_token(username: str, password: str) -> dict:
+async def get_access_token(username: str, password: str) -> dict:
     url = settings.AUTHORIZATION_API + "/token"
     headers = {
         "Accept": "application/json",
@@ -46,63 +63,79 @@ def get_access_token(username: str, password: str) -> dict:
         "username": username,
         "password": password
     }
-    response = requests.post(url, headers=headers, data=data)
+    response = await async_http_client.post(url, headers=headers, data=data, upstream=AUTHORIZATION)
+    response.raise_for_status()
+    return response.json()
+
+
+async def refresh_access_token(refresh_token: str) -> dict:
+    url = settings.AUTHORIZATION_API + "/token"
+    headers = {
+        "Accept": "application/json",
+        "Content-Type": "application/x-www-form-urlencoded"
+    }
+    data = {
+        "grant_type": "refresh_token",
+        "client_id": settings.CLIENT_ID,
+        "client_secret": settings.CLIENT_SECRET,
+        "refresh_token": refresh_token
+    }
+    response = await async_http_client.post(url, headers=headers, data=data, upstream=AUTHORIZATION)
     response.raise_for_status()
     return response.json()
 
 
-def upload_to_digitalocean_spaces(file_content: bytes, filename: str) -> dict:
+# Cache dei token per utente: evita un grant password ad ogni sessione
+token_cache = TokenCache(
+    password_grant=get_access_token,
+    refresh_grant=refresh_access_token,
+    refresh_margin=settings.TOKEN_REFRESH_MARGIN,
+    max_entries=settings.TOKEN_CACHE_MAX_ENTRIES
+)
+
+
+def upload_to_digitalocean_spaces(file_content: Union[bytes, BinaryIO], filename: str) -> dict:
     """
     Carica un file su DigitalOcean Spaces e genera un URL firmato con durata di 60 minuti.
     
+    I file sopra DO_SPACES_MULTIPART_THRESHOLD vengono caricati in streaming con
+    upload multipart (parti da DO_SPACES_MULTIPART_CHUNKSIZE, DO_SPACES_MAX_CONCURRENCY
+    in parallelo); quelli più piccoli con un singolo PutObject.
+    
     Args:
-        file_content (bytes): Contenuto del file da caricare
+        file_content (bytes | file-like): Contenuto del file da caricare (bytes o stream binario leggibile)
         filename (str): Nome del file
         
     Returns:
-        dict: Risultato del caricamento con URL firmato del file o errore
+        dict: Risultato del caricamento con URL firmato e chiave (spaces_key) del file o errore
     """
     try:
-        # Configura il client S3 per DigitalOcean Spaces
-        session = boto3.session.Session()
-        client = session.client(
-            's3',
-            region_name=settings.DO_SPACES_REGION,
-            endpoint_url=settings.DO_SPACES_ENDPOINT,
-            aws_access_key_id=settings.DO_SPACES_ACCESS_KEY,
-            aws_secret_access_key=settings.DO_SPACES_SECRET_KEY
-        )
+        # Client S3 condiviso per DigitalOcean Spaces
+        client = get_spaces_client()
         
-        # Genera un nome file univoco con timestamp
+        # Genera un nome file univoco con timestamp (e suffisso casuale per upload concorrenti)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        unique_filename = f"signed_documents/{timestamp}_{filename}"
-        
-        # Carica il file
-        client.put_object(
-            Bucket=settings.DO_SPACES_BUCKET,
-            Key=unique_filename,
-            Body=file_content,
-            ContentType='application/pdf',
-            ACL='private'  # File privato per sicurezza
-        )
+        unique_filename = f"signed_documents/{timestamp}_{uuid.uuid4().hex[:8]}_{filename}"
         
-        # Genera URL firmato con durata di 60 minuti (3600 secondi)
-        signed_url = client.generate_presigned_url(
-            'get_object',
-            Params={
-                'Bucket': settings.DO_SPACES_BUCKET,
-                'Key': unique_filename
+        # Carica il file (multipart in streaming sopra soglia)
+        fileobj = BytesIO(file_content) if isinstance(file_content, (bytes, bytearray)) else file_content
+        client.upload_fileobj(
+            fileobj,
+            settings.DO_SPACES_BUCKET,
+            unique_filename,
+            ExtraArgs={
+                'ContentType': 'application/pdf',
+                'ACL': 'private'  # File privato per sicurezza
             },
-            ExpiresIn=3600  # 60 minuti
+            Config=get_transfer_config()
         )
         
         # Genera anche l'URL pubblico (per riferimento)
         public_url = f"{settings.DO_SPACES_ENDPOINT}/{settings.DO_SPACES_BUCKET}/{unique_filename}"
         
         return {
-            "success": True,
-            "signed_url": signed_url,  
-            "expires_in": 3600,
+            **presign_spaces_document(unique_filename),
+            "spaces_key": unique_filename
         }
         
     except ClientError as e:
@@ -116,6 +149,36 @@ def upload_to_digitalocean_spaces(file_content: bytes, filename: str) -> dict:
             "error": f"Upload error: {str(e)}"
         }
 
+def presign_spaces_document(key: str) -> dict:
+    """
+    Genera l'URL firmato (60 minuti) di un documento già caricato su DigitalOcean Spaces.
+    
+    Args:
+        key (str): Chiave dell'oggetto nel bucket
+        
+    Returns:
+        dict: success, signed_url ed expires_in
+    """
+    signed_url = get_spaces_client().generate_presigned_url(
+        'get_object',
+        Params={
+            'Bucket': settings.DO_SPACES_BUCKET,
+            'Key': key
+        },
+        ExpiresIn=3600  # 60 minuti
+    )
+    return {
+        "success": True,
+        "signed_url": signed_url,
+        "expires_in": 3600,
+    }
+
+# Immagine (PNG base64) del talloncino di firma visibile, letta una sola volta all'avvio
+SIGNATURE_IMAGE_BASE64 = load_signature_image(settings.SIGNATURE_IMAGE_PATH)
+# Stessa immagine in binario per il talloncino composto localmente (signing_mode='hash')
+SIGNATURE_IMAGE_PNG = base64.b64decode(SIGNATURE_IMAGE_BASE64)
+
+
 def get_signature_position(
     position: str = "bottom-right",
     page_width: int = 595,  # A4 standard width in points
@@ -211,6 +274,83 @@ def get_signature_position(
     return positions.get(position, positions["bottom-right"])
 
 
+def _place_on_page(position: str, page_box: PageBox) -> Dict[str, int]:
+    """
+    Talloncino di una geometria di pagina, in spazio utente PDF.
+
+    La posizione si riferisce alla pagina come viene visualizzata: il talloncino viene
+    calcolato sulle dimensioni visibili (larghezza e altezza scambiate con /Rotate 90 e
+    270) e poi riportato nello spazio utente con la rotazione inversa, a partire
+    dall'origine del CropBox.
+    """
+    left, bottom, right, top = page_box.crop_box
+    width, height = right - left, top - bottom
+    rotate = page_box.rotate if page_box.rotate in (90, 180, 270) else 0
+    visible_width, visible_height = (height, width) if rotate in (90, 270) else (width, height)
+    visible = get_signature_position(position, int(visible_width), int(visible_height))
+
+    def to_user_space(u: float, v: float) -> Tuple[float, float]:
+        # /Rotate ruota la pagina visualizzata in senso orario
+        if rotate == 90:
+            return width - v, u
+        if rotate == 180:
+            return width - u, height - v
+        if rotate == 270:
+            return v, height - u
+        return u, v
+
+    x0, y0 = to_user_space(visible["llx"], visible["lly"])
+    x1, y1 = to_user_space(visible["urx"], visible["ury"])
+    return {
+        "llx": round(left + min(x0, x1)),
+        "lly": round(bottom + min(y0, y1)),
+        "urx": round(left + max(x0, x1)),
+        "ury": round(bottom + max(y0, y1))
+    }
+
+
+def get_signature_positions(
+    position: str,
+    page_boxes: List[PageBox],
+    custom_coords: Optional[Dict[str, int]] = None
+) -> List[Dict[str, int]]:
+    """
+    Coordinate del talloncino per ogni pagina di `page_boxes`, in un'unica passata.
+
+    Ogni geometria distinta (CropBox e /Rotate) viene calcolata una sola volta con
+    _place_on_page e condivisa da tutte le pagine uguali: un documento di migliaia di
+    pagine ha in genere una o due geometrie, quindi il costo è quello di una lettura
+    della tabella. Le coordinate 'custom' sono già in spazio utente e valgono per tutte le pagine.
+
+    Args:
+        position (str): Posizione predefinita, come in get_signature_position
+        page_boxes (list): Geometria delle pagine da firmare (PdfDocument.page_box)
+        custom_coords (dict): Coordinate personalizzate quando position='custom'
+
+    Returns:
+        list: Coordinate {'llx', 'lly', 'urx', 'ury'} nello stesso ordine di page_boxes
+    """
+    if position == "custom" and custom_coords:
+        coords = get_signature_position(position, custom_coords=custom_coords)
+        return [coords] * len(page_boxes)
+    placements: Dict[PageBox, Dict[str, int]] = {}
+    for page_box in page_boxes:
+        if page_box not in placements:
+            placements[page_box] = _place_on_page(position, page_box)
+    return [placements[page_box] for page_box in page_boxes]
+
+
+# Attributi del DN restituiti in subject_info: (attributo, chiave)
+SUBJECT_INFO_FIELDS = (
+    ("GIVENNAME", "given_name"),
+    ("SURNAME", "surname"),
+    ("CN", "common_name"),
+    ("DNQ", "dnq"),
+    ("SERIALNUMBER", "serial_number"),
+    ("C", "country"),
+)
+
+
 def transform_certificates(certificates_data: list) -> dict:
     """
     Trasforma i dati dei certificati ricevuti dall'API Infocert.
@@ -229,60 +369,18 @@ def transform_certificates(certificates_data: list) -> dict:
         transformed_certificates = []
         
         for cert in certificates_data:
-            # Estrai l'ID dal campo subject DNQ se presente
-            certificate_id = None
-            if "subject" in cert:
-                subject_str = cert["subject"]
-                import re
-                
-                # Cerca l'ID nel DNQ (formato: DNQ=2024501530362, ...)
-                dnq_match = re.search(r'DNQ=([^,]+)', subject_str)
-                if dnq_match:
-                    certificate_id = dnq_match.group(1)
+            # Analizza il subject in una sola passata (risultato memorizzato per subject)
+            attributes = parse_dn(cert["subject"]) if "subject" in cert else {}
             
-            # Se non trovato nel DNQ, prova a estrarre dal CN
-            if not certificate_id and "subject" in cert:
-                subject_str = cert["subject"]
-                import re
-                cn_match = re.search(r'CN=([^,]+)', subject_str)
-                if cn_match:
-                    certificate_id = cn_match.group(1)
+            # Estrai l'ID dal DNQ (formato: DNQ=2024501530362, ...), altrimenti dal CN
+            certificate_id = attributes.get("DNQ") or attributes.get("CN")
             
-            # Estrai i campi dal subject del certificato (stringa)
-            subject_info = {}
-            if "subject" in cert:
-                subject_str = cert["subject"]
-                import re
-                
-                # Estrai GIVENNAME
-                givenname_match = re.search(r'GIVENNAME=([^,]+)', subject_str)
-                if givenname_match:
-                    subject_info["given_name"] = givenname_match.group(1)
-                
-                # Estrai SURNAME
-                surname_match = re.search(r'SURNAME=([^,]+)', subject_str)
-                if surname_match:
-                    subject_info["surname"] = surname_match.group(1)
-                
-                # Estrai CN (Common Name)
-                cn_match = re.search(r'CN=([^,]+)', subject_str)
-                if cn_match:
-                    subject_info["common_name"] = cn_match.group(1)
-                
-                # Estrai DNQ
-                dnq_match = re.search(r'DNQ=([^,]+)', subject_str)
-                if dnq_match:
-                    subject_info["dnq"] = dnq_match.group(1)
-                
-                # Estrai SERIALNUMBER
-                serial_match = re.search(r'SERIALNUMBER=([^,]+)', subject_str)
-                if serial_match:
-                    subject_info["serial_number"] = serial_match.group(1)
-                
-                # Estrai C (Country)
-                country_match = re.search(r'C=([^,]+)', subject_str)
-                if country_match:
-                    subject_info["country"] = country_match.group(1)
+            # Campi estratti dal subject del certificato
+            subject_info = {
+                key: attributes[attribute]
+                for attribute, key in SUBJECT_INFO_FIELDS
+                if attribute in attributes
+            }
             
             transformed_cert = {
                 "certificateId": certificate_id or "Non disponibile",
@@ -308,12 +406,60 @@ def transform_certificates(certificates_data: list) -> dict:
         }
 
 
+async def fetch_first_certificate(access_token: str) -> dict:
+    """
+    Recupera i certificati dell'utente da Infocert e restituisce il primo, trasformato.
+    
+    Args:
+        access_token (str): Token di accesso valido
+        
+    Returns:
+        dict: Primo certificato nel formato di transform_certificates
+    """
+    url = f"{settings.SIGNATURE_API}/certificates"
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "tenant": settings.TENANT
+    }
+    
+    response = await async_http_client.get(url, headers=headers, upstream=CERTIFICATES)
+    response.raise_for_status()
+    result = response.json()
+    
+    list_certificates = transform_certificates(result)
+    return list_certificates["certificates"][0]
+
+
+# Cache dei certificati per token, condivisa da get_certificates e sign_document
+certificate_cache = CertificateCache(
+    ttl=settings.CERTIFICATE_CACHE_TTL,
+    max_entries=settings.CERTIFICATE_CACHE_MAX_ENTRIES
+)
+
+
+def _invalidate_access_token(error: HTTPError, access_token: str) -> None:
+    """
+    Token rifiutato da Infocert (401/403): il certificato e il token in cache
+    non vanno più riusati, il prossimo auth_token rifà il grant password.
+    """
+    if isinstance(error, HTTPStatusError) and error.response.status_code in (401, 403):
+        certificate_cache.invalidate(access_token)
+        token_cache.invalidate_token(access_token)
+
+
+# SAT ottenuti da authorize_smsp, con firme residue e scadenza, per certificato e transazione
+sat_sessions = SatSessionRegistry(
+    ttl=settings.SAT_SESSION_TTL,
+    max_entries=settings.SAT_SESSION_MAX_ENTRIES
+)
+
+
 @mcp.tool(
     name="auth_token",
     description="Autentica l'utente con i servizi Infocert e ottiene un token di accesso valido per utilizzare le API di firma digitale. Questo tool è il primo passo obbligatorio per accedere a tutti gli altri servizi di firma.",
     tags=["auth", "services"]
 )
-def auth_token(
+async def auth_token(
     username: Annotated[str, Field(description="Username per l'accesso ai servizi Infocert (email o nome utente)")],
     password: Annotated[str, Field(description="Password per l'accesso ai servizi Infocert")]
 ) -> dict:
@@ -323,6 +469,8 @@ def auth_token(
     Questo tool effettua una richiesta OAuth2 con grant_type=password per ottenere
     un token di accesso che permetterà di utilizzare tutti gli altri servizi di firma digitale.
     Il token ha una durata limitata e può essere rinnovato usando il refresh_token.
+    Se TOKEN_CACHE_ENABLED è attivo, il token dell'utente viene riusato finché è valido
+    e rinnovato automaticamente dal server poco prima della scadenza.
     
     Args:
         username (str): Username per l'accesso ai servizi Infocert
@@ -338,7 +486,10 @@ def auth_token(
             - content: Messaggio di errore dettagliato
     """
     try:
-        result = get_access_token(username, password)
+        if settings.TOKEN_CACHE_ENABLED:
+            return await token_cache.get_token(username, password)
+        
+        result = await get_access_token(username, password)
     
         return {
             "access_token": result["accessToken"],
@@ -346,7 +497,7 @@ def auth_token(
             "expires_in": result["expiresIn"],
             "scope": result["scope"]
         }
-    except RequestException as e:
+    except HTTPError as e:
         return {
             "type": "error",
             "content": f"Error during Services token request: {str(e)}"
@@ -362,7 +513,7 @@ def auth_token(
     description="Recupera il primo certificato digitale disponibile per l'utente autenticato. Il certificato contiene informazioni dettagliate incluso l'ID univoco necessario per le operazioni di firma.",
     tags=["certificates", "services"]
 )
-def get_certificates(
+async def get_certificates(
     access_token: Annotated[str, Field(description="Token di accesso ottenuto dal tool auth_token")]
 ) -> dict:
     """
@@ -372,6 +523,8 @@ def get_certificates(
     dell'utente, inclusi i dettagli del certificato e l'ID univoco necessario per
     le operazioni di firma. I certificati vengono automaticamente processati per
     estrarre l'ID dal campo subject DNQ.
+    Il certificato viene memorizzato per CERTIFICATE_CACHE_TTL secondi e riusato
+    da sign_document con lo stesso access token.
     
     Args:
         access_token (str): Token di accesso valido ottenuto da auth_token
@@ -395,21 +548,13 @@ def get_certificates(
             - content: Messaggio di errore dettagliato
     """
     try:
+        certificate = await fetch_first_certificate(access_token)
+        # Memorizza il certificato: sign_document lo riusa senza una nuova chiamata
+        certificate_cache.put(access_token, certificate)
+        return certificate
 
-        url = f"{settings.SIGNATURE_API}/certificates"
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "tenant": settings.TENANT
-        }
-        
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        result = response.json()
-        
-        list_certificates = transform_certificates(result)
-        return list_certificates["certificates"][0]
-
-    except RequestException as e:
+    except HTTPError as e:
+        _invalidate_access_token(e, access_token)
         return {
             "type": "error",
             "content": f"Error retrieving certificates: {str(e)}"
@@ -426,7 +571,7 @@ def get_certificates(
     description="Invia una richiesta di autenticazione SMS per la firma digitale. Questo tool invia un OTP (One-Time Password) via SMS al numero di telefono associato al certificato per verificare l'identità dell'utente prima della firma.",
     tags=["auth", "services", "smsp"]
 )
-def request_smsp_challenge(
+async def request_smsp_challenge(
     access_token: Annotated[str, Field(description="Token di accesso ottenuto dal tool auth_token")]
 ) -> dict:
     """
@@ -457,13 +602,14 @@ def request_smsp_challenge(
             "Content-Type": "application/json"
         }
         
-        response = requests.post(url, headers=headers, json={})
+        response = await async_http_client.post(url, headers=headers, json={}, upstream=SMSP)
         response.raise_for_status()
         result = response.json()
         
         return result
 
-    except RequestException as e:
+    except HTTPError as e:
+        _invalidate_access_token(e, access_token)
         return {
             "type": "error",
             "content": f"Error requesting SMSP challenge: {str(e)}"
@@ -479,7 +625,7 @@ def request_smsp_challenge(
     description="Autorizza una richiesta di firma digitale utilizzando il codice OTP ricevuto via SMS. Questo tool completa il processo di autenticazione a due fattori e restituisce un token SAT necessario per la firma.",
     tags=["auth", "services", "smsp"]
 )
-def authorize_smsp(
+async def authorize_smsp(
     access_token: Annotated[str, Field(description="Token di accesso ottenuto dal tool auth_token")],
     certificate_id: Annotated[str, Field(description="ID del certificato digitale ottenuto da get_certificates")],
     transactionId: Annotated[str, Field(description="ID della transazione ottenuto da request_smsp_challenge")],
@@ -494,6 +640,10 @@ def authorize_smsp(
     è corretta, restituisce un token SAT (Signature Authorization Token) che
     deve essere utilizzato nel tool sign_document per firmare il documento.
     
+    Il SAT vale per SAT_SIGNATURES_NUMBER firme e viene registrato lato server per
+    certificato e transazione: sign_document e sign_documents_batch lo riusano (anche
+    con infocert_sat vuoto) finché restano firme e non scade, senza un nuovo OTP.
+    
     Args:
         access_token (str): Token di accesso valido ottenuto da auth_token
         certificate_id (str): ID del certificato digitale da utilizzare
@@ -504,6 +654,7 @@ def authorize_smsp(
     Returns:
         dict: Risposta di autorizzazione contenente:
             - Infocert-SAT: Token di autorizzazione per la firma
+            - sat_session: signatures_total, signatures_remaining, expires_in (secondi)
             - type: "error" se si verifica un errore
             - content: Messaggio di errore dettagliato
     """
@@ -517,19 +668,21 @@ def authorize_smsp(
         }
         
         payload = {
-            "signaturesNumber": 100,
+            "signaturesNumber": settings.SAT_SIGNATURES_NUMBER,
             "transactionId": transactionId,
             "otp": otp,
             "pin": pin
         }
         
-        response = requests.post(url, headers=headers, json=payload)
+        response = await async_http_client.post(url, headers=headers, json=payload, upstream=SMSP)
         response.raise_for_status()
         result = response.json()
         
-        return {"Infocert-SAT": result["sat"]}
+        session = sat_sessions.register(certificate_id, transactionId, result["sat"], settings.SAT_SIGNATURES_NUMBER)
+        return {"Infocert-SAT": result["sat"], "sat_session": session.to_dict()}
 
-    except RequestException as e:
+    except HTTPError as e:
+        _invalidate_access_token(e, access_token)
         return {
             "type": "error",
             "content": f"Error during SMSP authorization: {str(e)}"
@@ -540,13 +693,239 @@ def authorize_smsp(
             "content": f"Error parsing SMSP authorization response: {str(e)}"
         }
 
+
+@mcp.tool(
+    name="get_sat_session",
+    description="Restituisce le firme residue e la scadenza del SAT registrato da authorize_smsp per certificato e transazione, per decidere se serve una nuova autorizzazione SMSP.",
+    tags=["auth", "signature"]
+)
+async def get_sat_session(
+    certificate_id: Annotated[str, Field(description="ID del certificato digitale usato in authorize_smsp")],
+    transaction_id: Annotated[str, Field(description="ID della transazione usato in authorize_smsp")]
+) -> dict:
+    """
+    Budget residuo del SAT registrato.
+    
+    Returns:
+        dict: signatures_total, signatures_remaining, expires_in (secondi); type='error' se
+              non c'è un SAT valido registrato (serve request_smsp_challenge + authorize_smsp)
+    """
+    session = sat_sessions.get(certificate_id, transaction_id)
+    if session is None:
+        return {
+            "type": "error",
+            "content": "Nessun SAT valido registrato per certificato e transazione: rifare request_smsp_challenge e authorize_smsp"
+        }
+    return session.to_dict()
+
+def _collect_signature_hints(
+    document: PdfDocument,
+    result: dict,
+    scan_strategy: str = "full",
+    max_pages: Optional[int] = None,
+    time_budget: Optional[float] = None
+) -> None:
+    """
+    Esegue le fasi di analisi del PDF (campi AcroForm, keyword con pdfplumber)
+    e aggiorna `result` sul posto. Funzione bloccante: va eseguita in un thread.
+    
+    Args:
+        document (PdfDocument): Documento scaricato, aperto una sola volta
+        result (dict): Risultato di analyze_pdf_signature_fields da completare
+        scan_strategy (str): 'full' (tutte le pagine), 'priority' (pagine più probabili
+                             prima, con arresto al primo blocco firma affidabile) o
+                             'geometry' (solo linee disegnate, senza estrazione del testo)
+        max_pages (int): Pagine massime per 'priority' (default ANALYSIS_PRIORITY_MAX_PAGES)
+        time_budget (float): Secondi massimi per 'priority' (default ANALYSIS_PRIORITY_TIME_BUDGET)
+    """
+    started = time.monotonic()
+    result["total_pages"] = document.page_count
+    
+    # FASE 1: Cerca campi AcroForm (anche annidati in /Kids)
+    for field in document.acroform_fields:
+        # Cerca signature fields
+        if field.field_type == "Sig" or "signature" in field.name.lower() or "firma" in field.name.lower():
+            # Pagina e /Rect dall'indice dei widget, costruito una volta per documento
+            widget = document.field_widget(field.name)
+            result["has_acroform_fields"] = True
+            result["acroform_fields"].append({
+                "name": field.name,
+                "type": "AcroForm Signature Field",
+                "page": widget.page if widget else None,
+                "coords": _field_coords(widget) if widget else None,
+                "description": f"Campo firma interattivo: {field.name}"
+                               + (f" (pagina {widget.page})" if widget else "")
+            })
+    if document.errors:
+        result["analysis_status"] = f"partial (PDF error: {'; '.join(document.errors)})"
+    
+    # FASE 2: Cerca parole chiave con pdfplumber (stesso parser del documento)
+    # Layout di ogni pagina calcolato una sola volta; keyword e pattern di linea
+    # cercati insieme in un'unica passata (Aho-Corasick)
+    pdf = document.plumber
+    if pdf is not None and scan_strategy == "geometry":
+        # Solo operatori grafici dei content stream: nessun layout del testo
+        try:
+            result["line_candidates"].extend(
+                detect_signature_lines(document, settings.ANALYSIS_LINE_MIN_LENGTH)
+            )
+            result["scanned_pages"] = list(range(1, document.page_count + 1))
+        except Exception as e:
+            result["analysis_status"] = f"partial (line detection error: {str(e)})"
+    elif pdf is not None and scan_strategy == "priority":
+        if any(field.field_type == "Sig" for field in document.acroform_fields):
+            # Campo /Sig già presente: nessuna pagina da analizzare
+            return
+        try:
+            hints, scanned_pages = scan_pdf_pages_priority(
+                document.plumber_page,
+                document.page_count,
+                max_pages or settings.ANALYSIS_PRIORITY_MAX_PAGES,
+                started + (time_budget or settings.ANALYSIS_PRIORITY_TIME_BUDGET),
+                settings.ANALYSIS_PRIORITY_LAST_PAGES
+            )
+            result["text_hints"].extend(hints)
+            result["scanned_pages"] = scanned_pages
+        except Exception as e:
+            result["analysis_status"] = f"partial (pdfplumber error: {str(e)})"
+    elif pdf is not None:
+        try:
+            if page_analysis_pool.should_parallelize(document.page_count):
+                # Documenti grandi: intervalli di pagine analizzati in processi separati
+                result["text_hints"].extend(page_analysis_pool.scan(document))
+            else:
+                result["text_hints"].extend(scan_pdf_pages(pdf))
+            result["scanned_pages"] = list(range(1, document.page_count + 1))
+        except Exception as e:
+            result["analysis_status"] = f"partial (pdfplumber error: {str(e)})"
+
+
+# Risultato delle fasi 1 e 2 conservato in document_cache per SHA-256 del contenuto
+# (versione nel nome: i risultati salvati con un formato precedente non vengono riusati)
+SIGNATURE_HINTS_RESULT = "signature_hints.v2"
+SIGNATURE_LINES_RESULT = "signature_lines.v2"
+SIGNATURE_PRIORITY_RESULT = "signature_hints_priority.v1"
+SIGNATURE_HINTS_FIELDS = (
+    "total_pages", "has_acroform_fields", "acroform_fields", "text_hints", "line_candidates",
+    "scanned_pages", "analysis_status"
+)
+# Strategia -> risultato in cache ('priority' riusa anche un'analisi 'full' già in cache)
+SCAN_STRATEGIES = {
+    "full": SIGNATURE_HINTS_RESULT,
+    "priority": SIGNATURE_PRIORITY_RESULT,
+    "geometry": SIGNATURE_LINES_RESULT,
+}
+
+
+def _priority_settled(result: dict) -> bool:
+    """
+    True se l'analisi 'priority' si è fermata su un campo /Sig o su una pagina con un
+    blocco firma affidabile, e non per esaurimento del budget: in quel caso ogni
+    richiesta con max_pages sufficiente a coprire le pagine analizzate darebbe lo
+    stesso risultato.
+    """
+    scanned_pages = result["scanned_pages"]
+    if not scanned_pages:
+        # Nessuna pagina analizzata con esito 'success': campo /Sig già presente
+        return result["has_acroform_fields"]
+    last_page = scanned_pages[-1]
+    return is_confident_signature_page([hint for hint in result["text_hints"] if hint["page"] == last_page])
+
+
+def _get_cached_result(document: PdfDocument, result_name: str) -> Optional[dict]:
+    try:
+        return document_cache.get_result(document.sha256, result_name)
+    except OSError as e:
+        # La cache serve solo a velocizzare: senza disco l'analisi viene ripetuta
+        print(f"Warning: cache dei risultati non disponibile: {str(e)}")
+        return None
+
+
+def _analyze_document(
+    document: PdfDocument,
+    result: dict,
+    scan_strategy: str = "full",
+    max_pages: Optional[int] = None,
+    time_budget: Optional[float] = None
+) -> None:
+    """
+    Fasi 1 e 2 dell'analisi, con i risultati riusati per documenti dallo stesso contenuto.
+    Un'analisi completa in cache vale anche per scan_strategy='priority'. Le analisi
+    'priority' vengono memorizzate a parte solo se si sono fermate su un blocco firma
+    (_priority_settled) e riusate se max_pages copre le pagine analizzate; quelle
+    interrotte dal budget di pagine o di tempo vengono ripetute.
+    Funzione bloccante: va eseguita in un thread.
+    """
+    if document_cache is None:
+        _collect_signature_hints(document, result, scan_strategy, max_pages, time_budget)
+        return
+    
+    result_name = SCAN_STRATEGIES[scan_strategy]
+    if scan_strategy == "priority":
+        cached = _get_cached_result(document, SIGNATURE_HINTS_RESULT)
+        if cached is not None:
+            result.update(cached)
+            result["scan_strategy"] = "full"
+            return
+    cached = _get_cached_result(document, result_name)
+    page_limit = max(1, max_pages or settings.ANALYSIS_PRIORITY_MAX_PAGES)
+    if cached is not None and (scan_strategy != "priority" or len(cached["scanned_pages"]) <= page_limit):
+        result.update(cached)
+        return
+    
+    _collect_signature_hints(document, result, scan_strategy, max_pages, time_budget)
+    # Le analisi parziali (errori di parsing) vengono ripetute alla richiesta successiva
+    if result["analysis_status"] == "success" and (scan_strategy != "priority" or _priority_settled(result)):
+        try:
+            document_cache.put_result(
+                document.sha256, result_name, {key: result[key] for key in SIGNATURE_HINTS_FIELDS}
+            )
+        except OSError as e:
+            print(f"Warning: cache dei risultati non disponibile: {str(e)}")
+
+
+def _new_analysis_result(scan_strategy: str) -> dict:
+    return {
+        "total_pages": 0,
+        "has_acroform_fields": False,
+        "acroform_fields": [],
+        "text_hints": [],
+        "line_candidates": [],
+        "scanned_pages": [],
+        "scan_strategy": scan_strategy,
+        "recommendation": "",
+        "suggested_positions": [
+            "bottom-right", "bottom-left", "bottom-center",
+            "top-right", "top-left", "top-center", "center"
+        ],
+        "analysis_status": "success"
+    }
+
+
+async def _open_remote_pdf(link_pdf: str, scan_strategy: str) -> Optional[RemotePdfFile]:
+    """
+    Documento in lettura parziale (HTTP Range) per scan_strategy='priority', che legge
+    solo struttura e poche pagine ('full' e 'geometry' leggono tutte le pagine: conviene
+    il download completo). None se l'origine non lo consente, se il documento è piccolo
+    o se è già in document_cache (la GET condizionale costa meno).
+    """
+    if not settings.REMOTE_PDF_RANGE_ENABLED or scan_strategy != "priority":
+        return None
+    if document_cache is not None and await anyio.to_thread.run_sync(document_cache.lookup, link_pdf) is not None:
+        return None
+    return await anyio.to_thread.run_sync(open_remote_pdf, link_pdf)
+
+
 @mcp.tool(
     name="analyze_pdf_signature_fields",
     description="Analizza un documento PDF per trovare suggerimenti su dove posizionare la firma digitale. Cerca campi AcroForm esistenti e parole chiave come 'Firma', 'Signature', 'Sottoscritto'.",
     tags=["pdf", "analysis", "signature"]
 )
-def analyze_pdf_signature_fields(
-    link_pdf: Annotated[str, Field(description="URL del documento PDF da analizzare")]
+async def analyze_pdf_signature_fields(
+    link_pdf: Annotated[str, Field(description="URL del documento PDF da analizzare")],
+    scan_strategy: Annotated[str, Field(description="'full' analizza tutte le pagine; 'priority' analizza prima le ultime pagine e la prima, fermandosi al primo blocco firma affidabile o a un campo firma AcroForm; 'geometry' cerca solo le linee di firma disegnate, senza estrarre il testo, e restituisce coordinate pronte per signature_position='custom' (default: 'full')")] = "full",
+    max_pages: Annotated[Optional[int], Field(description="Solo per scan_strategy='priority': numero massimo di pagine da analizzare")] = None,
+    time_budget: Annotated[Optional[float], Field(description="Solo per scan_strategy='priority': tempo massimo di analisi in secondi")] = None,
 ) -> dict:
     """
     Analizza un PDF per trovare suggerimenti sul posizionamento della firma.
@@ -556,137 +935,85 @@ def analyze_pdf_signature_fields(
     2. Parole chiave testuali: "Firma", "Signature", "Sottoscritto", "Firmatario"
     3. Pattern di linee: "______", ".....", "-----"
     
+    Con scan_strategy='priority' le pagine vengono visitate nell'ordine ultime pagine,
+    prima pagina, poi le altre, e l'analisi si ferma al primo blocco firma affidabile
+    (es. 'Firma:' o keyword con linea da compilare), a un campo /Sig o al budget.
+    Con scan_strategy='geometry' al posto delle keyword vengono cercate le linee
+    disegnate (segmenti e rettangoli sottili) leggendo solo la grafica delle pagine.
+    
     Args:
         link_pdf: URL del PDF da analizzare
+        scan_strategy: 'full', 'priority' o 'geometry'
+        max_pages: Pagine massime per 'priority' (default ANALYSIS_PRIORITY_MAX_PAGES)
+        time_budget: Secondi massimi per 'priority' (default ANALYSIS_PRIORITY_TIME_BUDGET)
         
     Returns:
         dict con:
         - total_pages: numero totale di pagine
         - has_acroform_fields: bool, se ha campi firma standard
         - acroform_fields: lista di campi AcroForm trovati
-        - text_hints: lista di suggerimenti testuali trovati
+        - text_hints: lista di suggerimenti testuali trovati (in ordine di visita)
+        - line_candidates: linee di firma disegnate (solo 'geometry'), con `coords`
+          utilizzabili come custom_coords
+        - scanned_pages: pagine effettivamente analizzate, in ordine di visita
+        - scan_strategy: strategia usata
+        - remote_read: solo se il PDF è stato letto con HTTP Range, dimensione del
+          documento, richieste e byte effettivamente scaricati
         - recommendation: suggerimento finale per l'utente
         - suggested_positions: posizioni disponibili per firmare
     """
-    result = {
-        "total_pages": 0,
-        "has_acroform_fields": False,
-        "acroform_fields": [],
-        "text_hints": [],
-        "recommendation": "",
-        "suggested_positions": [
-            "bottom-right", "bottom-left", "bottom-center",
-            "top-right", "top-left", "top-center", "center"
-        ],
-        "analysis_status": "success"
-    }
+    if scan_strategy not in SCAN_STRATEGIES:
+        return {
+            "analysis_status": "error",
+            "error": f"scan_strategy non valida: '{scan_strategy}' (valori ammessi: {', '.join(SCAN_STRATEGIES)})",
+            "recommendation": f"Ripeti l'analisi con scan_strategy tra: {', '.join(SCAN_STRATEGIES)}.",
+            "suggested_positions": ["bottom-right", "bottom-left", "bottom-center", "top-right", "top-left", "top-center", "center"]
+        }
+    
+    result = _new_analysis_result(scan_strategy)
     
     try:
-        # Scarica il PDF
-        response = requests.get(link_pdf, timeout=30)
-        response.raise_for_status()
-        pdf_bytes = BytesIO(response.content)
-        
-        # FASE 1: Cerca campi AcroForm con PyPDF2
-        if PYPDF2_AVAILABLE:
-            try:
-                pdf_reader = PdfReader(pdf_bytes)
-                result["total_pages"] = len(pdf_reader.pages)
-                
-                # Cerca campi AcroForm
-                if "/AcroForm" in pdf_reader.trailer.get("/Root", {}):
-                    acro_form = pdf_reader.trailer["/Root"]["/AcroForm"]
-                    if "/Fields" in acro_form:
-                        fields = acro_form["/Fields"]
-                        for field_ref in fields:
-                            field_obj = field_ref.get_object()
-                            field_type = field_obj.get("/FT", "")
-                            field_name = field_obj.get("/T", "")
-                            
-                            # Cerca signature fields
-                            if field_type == "/Sig" or "signature" in str(field_name).lower() or "firma" in str(field_name).lower():
-                                result["has_acroform_fields"] = True
-                                result["acroform_fields"].append({
-                                    "name": str(field_name),
-                                    "type": "AcroForm Signature Field",
-                                    "description": f"Campo firma interattivo: {field_name}"
-                                })
-            except Exception as e:
-                result["analysis_status"] = f"partial (PyPDF2 error: {str(e)})"
+        # Documenti grandi su origini con Range: solo trailer, xref e oggetti necessari
+        remote = await _open_remote_pdf(link_pdf, scan_strategy)
+        if remote is not None:
+            # Senza il contenuto completo non c'è SHA-256: niente document_cache (come per ogni analisi 'priority')
+            with remote, PdfDocument(remote) as document:
+                await anyio.to_thread.run_sync(
+                    _collect_signature_hints, document, result, scan_strategy, max_pages, time_budget
+                )
+            if remote.failure is not None:
+                # Errore di rete o documento cambiato: i parser lo riportano come PDF illeggibile
+                print(f"Warning: Lettura parziale interrotta: {str(remote.failure)}. Download completo.")
+                result = _new_analysis_result(scan_strategy)
+                remote = None
+            else:
+                result["remote_read"] = remote.stats()
         
-        # FASE 2: Cerca parole chiave con pdfplumber
-        if PDFPLUMBER_AVAILABLE:
-            try:
-                pdf_bytes.seek(0)
-                keywords = ["firma", "signature", "sottoscritto", "firmatario", "sign here", "sign:", "firma:"]
-                line_patterns = ["_____", ".....", "-----"]
-                
-                with pdfplumber.open(pdf_bytes) as pdf:
-                    if result["total_pages"] == 0:
-                        result["total_pages"] = len(pdf.pages)
-                    
-                    for page_num, page in enumerate(pdf.pages, start=1):
-                        text = page.extract_text()
-                        if not text:
-                            continue
-                        
-                        text_lower = text.lower()
-                        
-                        # Cerca keywords
-                        for keyword in keywords:
-                            if keyword in text_lower:
-                                # Trova posizione nel testo
-                                words = page.extract_words()
-                                for word in words:
-                                    if keyword in word["text"].lower():
-                                        # Determina posizione approssimativa
-                                        page_height = page.height
-                                        y_position = word["top"]
-                                        
-                                        # Classifica posizione (top/middle/bottom)
-                                        if y_position < page_height / 3:
-                                            position = "top"
-                                        elif y_position > 2 * page_height / 3:
-                                            position = "bottom"
-                                        else:
-                                            position = "middle"
-                                        
-                                        result["text_hints"].append({
-                                            "keyword": keyword,
-                                            "page": page_num,
-                                            "text": word["text"],
-                                            "position": position,
-                                            "description": f"Trovato '{word['text']}' a pagina {page_num} ({position})"
-                                        })
-                                        break  # Una keyword per pagina è sufficiente
-                        
-                        # Cerca pattern di linee
-                        for pattern in line_patterns:
-                            if pattern in text:
-                                result["text_hints"].append({
-                                    "keyword": "line_pattern",
-                                    "page": page_num,
-                                    "text": pattern,
-                                    "position": "unknown",
-                                    "description": f"Trovato pattern linea '{pattern}' a pagina {page_num}"
-                                })
-                                break
-            except Exception as e:
-                result["analysis_status"] = f"partial (pdfplumber error: {str(e)})"
+        if remote is None:
+            # Scarica il PDF in streaming (file temporaneo, su disco oltre soglia)
+            with await download_pdf(link_pdf) as pdf_stream, PdfDocument(pdf_stream) as document:
+                # FASE 1 e 2 sono CPU-bound: girano in un thread per non bloccare l'event loop
+                await anyio.to_thread.run_sync(
+                    _analyze_document, document, result, scan_strategy, max_pages, time_budget
+                )
         
         # FASE 3: Genera raccomandazione
         if result["has_acroform_fields"]:
             first_field = result["acroform_fields"][0]
-            result["recommendation"] = f"✅ Trovato campo firma predefinito: '{first_field['name']}'. Consiglio di usarlo per una firma standard."
+            field_page = f" a pagina {first_field['page']}" if first_field.get("page") else ""
+            result["recommendation"] = f"✅ Trovato campo firma predefinito: '{first_field['name']}'{field_page}. Consiglio di usarlo per una firma standard (use_existing_field='{first_field['name']}')."
         elif result["text_hints"]:
             first_hint = result["text_hints"][0]
             result["recommendation"] = f"💡 Trovato '{first_hint['keyword']}' a pagina {first_hint['page']} ({first_hint['position']}). Suggerisco di firmare su quella pagina in posizione '{first_hint['position']}-right' o '{first_hint['position']}-left'."
+        elif result["line_candidates"]:
+            first_line = result["line_candidates"][0]
+            result["recommendation"] = f"📏 Trovata una linea di firma a pagina {first_line['page']} ({first_line['position']}). Suggerisco di firmare su quella pagina con signature_position='custom' e custom_coords={first_line['coords']}."
         else:
             result["recommendation"] = f"📄 Nessun campo firma trovato nel documento ({result['total_pages']} pagine). Suggerisco di chiedere all'utente dove preferisce firmare. Posizioni disponibili: {', '.join(result['suggested_positions'])}."
         
         return result
         
-    except RequestException as e:
+    except (HTTPError, DocumentTooLargeError) as e:
         return {
             "analysis_status": "error",
             "error": f"Errore nel download del PDF: {str(e)}",
@@ -701,22 +1028,266 @@ def analyze_pdf_signature_fields(
             "suggested_positions": ["bottom-right", "bottom-left", "bottom-center", "top-right", "top-left", "top-center", "center"]
         }
 
+
+def _page_count(document: PdfDocument) -> int:
+    """
+    Numero di pagine del documento (parsing bloccante: va eseguita in un thread).
+    Se il documento è già stato analizzato, riusa il conteggio in cache.
+    """
+    if document_cache is not None:
+        try:
+            cached = document_cache.get_result(document.sha256, SIGNATURE_HINTS_RESULT)
+        except OSError:
+            cached = None
+        if cached is not None:
+            return cached["total_pages"]
+    return document.page_count
+
+
+async def _visible_text_for(access_token: str) -> str:
+    """Testo visibile del talloncino, con il nome del titolare del certificato."""
+    certificate = await certificate_cache.get_or_fetch(access_token, fetch_first_certificate)
+    name_certificate = certificate["subject_info"]["common_name"]
+    data_time = datetime.now().strftime("%d/%m/%Y %H:%M")
+    return f".\nFirmato da {name_certificate} \nin data {data_time}"
+
+
+def _attach_name_from_url(link_pdf: str) -> str:
+    """Estrae il nome del file dall'URL, senza parametri di query."""
+    parsed = urlparse(link_pdf)
+    url_no_query = urlunparse(parsed._replace(query=""))
+    clean_url = url_no_query.split('?')[0] 
+    attach_name = clean_url.split('/')[-1]
+    attach_name = unquote(attach_name)
+    
+    if not attach_name:
+        attach_name = "documento.pdf"
+    return attach_name
+
+
+def _signature_pages_for(page_signature: str, total_pages: int) -> List[int]:
+    """Pagine su cui apporre la firma in base all'opzione scelta."""
+    if page_signature == "tutte_le_pagine":
+        # Default: firma su tutte le pagine
+        return list(range(1, total_pages + 1))
+    elif page_signature == "prima_pagina":
+        return [1]
+    elif page_signature == "ultima_pagina":
+        return [total_pages]
+    else:
+        # Se viene passato un valore non valido, usa il default
+        return list(range(1, total_pages + 1))
+
+
+def _sat_session_for(certificate_id: str, transaction_id: str, infocert_sat: str) -> Tuple[str, Optional[SatSession]]:
+    """
+    SAT da usare per la firma e relativa sessione registrata da authorize_smsp.
+    Con infocert_sat vuoto viene usato il SAT registrato; un SAT passato ma non
+    registrato (es. ottenuto prima di un riavvio) viene usato senza conteggio.
+    
+    Raises:
+        SatSessionError: infocert_sat vuoto e nessun SAT valido registrato
+    """
+    session = sat_sessions.get(certificate_id, transaction_id, infocert_sat)
+    if session is not None:
+        return session.sat, session
+    if not infocert_sat:
+        raise SatSessionError(
+            "Nessun SAT valido registrato per certificato e transazione: rifare request_smsp_challenge e authorize_smsp"
+        )
+    return infocert_sat, None
+
+
+def _sign_headers(access_token: str, infocert_sat: str, transaction_id: str) -> dict:
+    return {
+        "tenant": settings.TENANT,
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json",
+        "Infocert-SAT": infocert_sat,
+        "Transaction-Id": transaction_id
+    }
+
+
+def _field_coords(widget: FieldWidget) -> Dict[str, int]:
+    """Coordinate del talloncino uguali al /Rect del widget del campo AcroForm."""
+    llx, lly, urx, ury = widget.rect
+    return {"llx": round(llx), "lly": round(lly), "urx": round(urx), "ury": round(ury)}
+
+
+def _signature_placements(
+    document: PdfDocument,
+    signature_pages: List[int],
+    signature_position: str,
+    custom_coords: Optional[Dict[str, int]],
+    existing_field: Optional[FieldWidget]
+) -> List[Dict[str, int]]:
+    """
+    Coordinate del talloncino per ogni pagina di `signature_pages`: campo AcroForm
+    esistente oppure posizione calcolata sulla geometria reale di ogni pagina
+    (parsing bloccante: va eseguita in un thread).
+    """
+    if existing_field is not None:
+        # Talloncino esattamente sul rettangolo del campo firma predefinito
+        return [_field_coords(existing_field)] * len(signature_pages)
+    if signature_position == "custom" and custom_coords:
+        # Coordinate esplicite: la geometria delle pagine non serve
+        return [get_signature_position(signature_position, custom_coords=custom_coords)] * len(signature_pages)
+    page_boxes = [document.page_box(page_num) for page_num in signature_pages]
+    return get_signature_positions(signature_position, page_boxes, custom_coords)
+
+
+class FieldNotFoundError(Exception):
+    """Il campo indicato in use_existing_field non esiste o non ha un widget su una pagina."""
+
+
+def _existing_field(document: PdfDocument, field_name: Optional[str]) -> Optional[FieldWidget]:
+    """
+    Widget del campo `use_existing_field` (parsing bloccante: va eseguita in un thread).
+    
+    Raises:
+        FieldNotFoundError: Campo assente o senza posizione nel documento
+    """
+    if not field_name:
+        return None
+    widget = document.field_widget(field_name)
+    if widget is None:
+        available = ", ".join(document.field_widgets) or "nessuno"
+        raise FieldNotFoundError(f"Campo '{field_name}' non trovato nel documento (campi disponibili: {available})")
+    return widget
+
+
+def _build_pades_signature(document_content: Union[str, dict], attach_name: str, request_id: str, signature_fields: list) -> dict:
+    """Voce di padesSignatures per un documento (contenuto base64 o segnaposto di StreamingSignBody)."""
+    return {
+        "signatureLevel": "BASELINE-B",
+        "requestId": request_id,
+        "document": {
+            "content": document_content,
+            "contentType": "application/pdf",
+            "attachName": attach_name
+        },
+        "packaging": "ENVELOPED",
+        "isVisible": True,
+        "signatureFields": signature_fields
+    }
+
+
+async def _send_sign_request(url: str, headers: dict, body: StreamingSignBody) -> Tuple[dict, SignResponseParser]:
+    """
+    Invia la richiesta di firma e legge la risposta a blocchi.
+    
+    I documenti firmati vengono decodificati in file temporanei man mano che arrivano
+    (vedi SignResponseParser.signed_document) invece di tenere in memoria il JSON
+    completo, la stringa base64 e i byte decodificati.
+    
+    Returns:
+        tuple: (JSON della risposta senza i contenuti firmati, parser con i documenti firmati)
+    """
+    parser = SignResponseParser()
+    async with async_http_client.stream(
+        "POST", url, headers={**headers, **body.headers()}, content=body, upstream=SIGN
+    ) as response:
+        response.raise_for_status()
+        try:
+            async for chunk in response.aiter_bytes():
+                parser.feed(chunk)
+        except BaseException:
+            parser.discard()
+            raise
+    return parser.close(), parser
+
+
+# Modalità di firma: documento intero a Infocert oppure solo il digest (PDF assemblato localmente)
+SIGNING_MODES = ("pades", "hash")
+
+
+def _existing_field_name(document: PdfDocument, widget: FieldWidget) -> Optional[str]:
+    """Nome completo del campo AcroForm a cui appartiene il widget."""
+    return next((name for name, widgets in document.field_widgets.items() if widget in widgets), None)
+
+
+async def _upload_signed_pdf(signed_pdf: BinaryIO, attach_name: str) -> dict:
+    """Upload su Spaces (in un thread) entro i limiti dell'upstream SPACES; stesso risultato di upload_to_digitalocean_spaces."""
+    try:
+        async with upstream_slot(SPACES):
+            return await anyio.to_thread.run_sync(upload_to_digitalocean_spaces, signed_pdf, attach_name)
+    except UpstreamBusyError as e:
+        return {
+            "success": False,
+            "error": f"Upload error: {str(e)}"
+        }
+
+
+async def _sign_document_hash(
+    document: PdfDocument,
+    pdf_stream: BinaryIO,
+    certificate_id: str,
+    headers: dict,
+    pin: str,
+    request_id: str,
+    signature_pages: List[int],
+    placements: List[Dict[str, int]],
+    visible_text: str,
+    existing_field: Optional[FieldWidget],
+    local_signer: bool = False,
+    sat_session: Optional[SatSession] = None
+) -> BinaryIO:
+    """
+    Firma con signing_mode='hash': campo, talloncino e segnaposto vengono aggiunti
+    localmente da pyHanko, al firmatario viene inviato solo il digest e la firma CMS
+    restituita viene inserita nel documento. Una firma ha un solo talloncino: viene
+    usata l'ultima delle pagine richieste (o il campo esistente). Con `local_signer` il digest
+    viene firmato dal firmatario locale di prova (vedi uses_local_hash_signer). La firma
+    del SAT registrato viene scalata all'invio del digest e restituita se la chiamata fallisce.
+
+    Returns:
+        BinaryIO: PDF firmato, posizionato all'inizio (da chiudere dopo l'upload)
+    """
+    field_name = None
+    if existing_field is not None:
+        field_name = await anyio.to_thread.run_sync(_existing_field_name, document, existing_field)
+    prepared = await prepare_hash_signature(
+        pdf_stream, signature_pages[-1], placements[-1], visible_text, SIGNATURE_IMAGE_PNG, field_name
+    )
+    try:
+        if local_signer:
+            # Firmatario di prova: la chiave viene creata (o letta) al primo utilizzo
+            signer = await anyio.to_thread.run_sync(local_hash_signer)
+        else:
+            url = settings.SIGNATURE_API + settings.SIGN_HASH_ENDPOINT.format(certificate_id=certificate_id)
+            signer = RemoteHashSigner(url, headers, pin, request_id)
+        if sat_session is not None:
+            sat_sessions.consume(sat_session)
+        try:
+            signature_cms = await signer.sign_digest(prepared.digest)
+        except BaseException:
+            # Nessuna firma ottenuta: il SAT non è stato usato
+            if sat_session is not None:
+                sat_sessions.refund(sat_session)
+            raise
+        return await finish_hash_signature(prepared, signature_cms)
+    except BaseException:
+        prepared.close()
+        raise
+
+
 @mcp.tool(
     name="sign_document",
     description="Firma digitalmente un documento PDF utilizzando il servizio Infocert. Questo tool scarica il documento dal link fornito, lo firma con il certificato specificato, converte il risultato in PDF e lo carica automaticamente su DigitalOcean Spaces.",
     tags=["signature", "services", "storage"]
 )
-def sign_document(
+async def sign_document(
     certificate_id: Annotated[str, Field(description="ID del certificato digitale ottenuto da get_certificates")],
     access_token: Annotated[str, Field(description="Token di accesso ottenuto dal tool auth_token")],
-    infocert_sat: Annotated[str, Field(description="Token SAT ottenuto dal tool authorize_smsp")],
+    infocert_sat: Annotated[str, Field(description="Token SAT ottenuto dal tool authorize_smsp (stringa vuota: SAT registrato da authorize_smsp per certificate_id e transaction_id)")],
     transaction_id: Annotated[str, Field(description="ID della transazione ottenuto da request_smsp_challenge")],
     pin: Annotated[str, Field(description="PIN del certificato digitale (password di protezione)")],
     link_pdf: Annotated[str, Field(description="URL del documento PDF da firmare (deve essere accessibile pubblicamente)")],
     page_signature: Annotated[str, Field(description="Pagina dove posizionare la firma: 'prima_pagina', 'ultima_pagina', o 'tutte_le_pagine' (default: 'ultima_pagina')", default="ultima_pagina")] = "tutte_le_pagine",
     signature_position: Annotated[str, Field(description="Posizione del talloncino: 'bottom-right', 'bottom-left', 'bottom-center', 'top-right', 'top-left', 'top-center', 'center', 'custom' (default: 'bottom-right')", default="bottom-right")] = "bottom-right",
     custom_coords: Annotated[Optional[Dict[str, int]], Field(description="Coordinate personalizzate se signature_position='custom': {'llx': int, 'lly': int, 'urx': int, 'ury': int}")] = None,
-    use_existing_field: Annotated[Optional[str], Field(description="Nome del campo AcroForm da usare per la firma (se il PDF ha campi firma predefiniti). Se specificato, ignora signature_position e custom_coords.")] = None,
+    use_existing_field: Annotated[Optional[str], Field(description="Nome del campo AcroForm da usare per la firma (se il PDF ha campi firma predefiniti). Se specificato, il talloncino viene posto sul rettangolo del campo, nella sua pagina, ignorando page_signature, signature_position e custom_coords.")] = None,
+    signing_mode: Annotated[str, Field(description="'pades' (default): il PDF viene inviato a Infocert e restituito firmato; 'hash': il PDF viene preparato localmente e al servizio di firma viene inviato solo il digest (un solo talloncino, sull'ultima pagina richiesta)")] = "pades",
 ) -> dict:
     """
     Firma digitalmente un documento PDF utilizzando il servizio Infocert.
@@ -734,17 +1305,25 @@ def sign_document(
     Args:
         certificate_id (str): ID del certificato digitale da utilizzare
         access_token (str): Token di accesso valido ottenuto da auth_token
-        infocert_sat (str): Token di autorizzazione ottenuto da authorize_smsp
+        infocert_sat (str): Token di autorizzazione ottenuto da authorize_smsp; se vuoto viene usato
+                            il SAT registrato da authorize_smsp per certificato e transazione
         transaction_id (str): ID della transazione ottenuto da request_smsp_challenge
         pin (str): PIN di protezione del certificato digitale
         link_pdf (str): URL pubblico del documento PDF da firmare
-        page_signature (str): Pagina dove posizionare la firma: 'prima_pagina', 'ultima_pagina', o 'tutte_le_pagine' (default: 'tutte_le_pagine')
+        page_signature (str): Pagina dove posizionare la firma: 'prima_pagina', 'ultima_pagina', o 'tutte_le_pagine' (default: 'tutte_le_pagine').
+                              Con 'tutte_le_pagine' oltre SIGN_MAX_VISIBLE_FIELDS pagine il talloncino è uno solo, sull'ultima pagina.
         signature_position (str): Posizione del talloncino: 'bottom-right' (default), 'bottom-left', 'bottom-center', 
                                   'top-right', 'top-left', 'top-center', 'center', 'custom'
         custom_coords (dict): Coordinate personalizzate quando signature_position='custom': 
                               {'llx': int, 'lly': int, 'urx': int, 'ury': int}
         use_existing_field (str): Nome del campo AcroForm esistente da usare (opzionale). Se specificato, 
-                                  ignora signature_position e custom_coords e usa il campo predefinito del PDF.
+                                  il talloncino usa pagina e /Rect del campo predefinito del PDF e
+                                  ignora page_signature, signature_position e custom_coords.
+                                  Basta anche l'ultimo componente del nome ('cliente' per 'firme.cliente').
+        signing_mode (str): 'pades' (default) invia il documento intero a Infocert e riceve il PDF firmato;
+                            'hash' aggiunge localmente campo e talloncino (pyHanko), invia solo il digest
+                            e inserisce nel PDF la firma CMS restituita. Con 'hash' il talloncino è uno solo,
+                            sull'ultima delle pagine richieste o sul campo use_existing_field.
         
     Returns:
         dict: Risposta della firma contenente:
@@ -762,172 +1341,583 @@ def sign_document(
             - total_pages: Numero totale di pagine del documento PDF (aggiunto automaticamente)
             - signature_pages: Array con i numeri delle pagine dove sono state posizionate le firme (aggiunto automaticamente)
             - page_signature_option: Opzione scelta per il posizionamento della firma (aggiunto automaticamente)
+            - sat_session: Firme residue e scadenza del SAT, se registrato da authorize_smsp
+            - test_signature: True se il digest è stato firmato dal firmatario locale di prova
             - type: "error" se si verifica un errore
             - content: Messaggio di errore dettagliato
     """
+    if signing_mode not in SIGNING_MODES:
+        return {
+            "type": "error",
+            "content": f"signing_mode non valida: '{signing_mode}' (valori ammessi: {', '.join(SIGNING_MODES)})"
+        }
+
     try:
+        # Firmatario locale di prova: rifiutato prima di scaricare il documento se non consentito
+        local_signer = signing_mode == "hash" and uses_local_hash_signer()
+    except HashSigningError as e:
+        return {
+            "type": "error",
+            "content": f"Error during hash signing: {str(e)}"
+        }
+
+    try:
+        # SAT registrato da authorize_smsp: verifica del budget prima di scaricare il documento
+        infocert_sat, sat_session = _sat_session_for(certificate_id, transaction_id, infocert_sat)
+        if sat_session is not None:
+            sat_sessions.check(sat_session)
+        
         ####### LIST 
-        certificate = get_certificates(access_token)
-        name_certificate = certificate["subject_info"]["common_name"]
-        data_time = datetime.now().strftime("%d/%m/%Y %H:%M")
-        visible_text = f".\nFirmato da {name_certificate} \nin data {data_time}"
+        # Riusa il certificato già letto da get_certificates (cache con TTL per token)
+        visible_text = await _visible_text_for(access_token)
         ####### LISTA DEI CERTIFICATI #######
 
-        # Scarica il PDF dal link fornito
-        pdf_response = requests.get(link_pdf)
-        pdf_response.raise_for_status()
-        
-        # Rimuovi i parametri di query dall'URL e estrai il nome del file
-        parsed = urlparse(link_pdf)
-        url_no_query = urlunparse(parsed._replace(query=""))
-        clean_url = url_no_query.split('?')[0] 
-        attach_name = clean_url.split('/')[-1]
-        attach_name = unquote(attach_name)
-        
-        if not attach_name:
-            attach_name = "documento.pdf"
+        # Scarica il PDF dal link fornito (streaming con limite di dimensione)
+        with await download_pdf(link_pdf) as pdf_stream, PdfDocument(pdf_stream) as document:
+            # Rimuovi i parametri di query dall'URL e estrai il nome del file
+            attach_name = _attach_name_from_url(link_pdf)
+                
+            # Conta le pagine del PDF (parsing CPU-bound in un thread)
+            total_pages = await anyio.to_thread.run_sync(_page_count, document)
+            existing_field = await anyio.to_thread.run_sync(_existing_field, document, use_existing_field)
             
-        # Conta le pagine del PDF
-        from io import BytesIO
-        pdf_stream = BytesIO(pdf_response.content)
-        try:
-            # Usa strict=False per gestire PDF con strutture xref non standard
-            pdf_reader = PdfFileReader(pdf_stream, strict=False)
-            # Accedi al catalogo del documento per ottenere il numero di pagine
-            root = pdf_reader.root
-            pages = root['/Pages']
-            total_pages = pages['/Count']
-        except Exception as e:
-            # Se la lettura fallisce, prova con un approccio alternativo
-            # Usa PyPDF2 come fallback se disponibile
-            try:
-                import PyPDF2
-                pdf_stream.seek(0)  # Reset stream position
-                pdf_reader_fallback = PyPDF2.PdfReader(pdf_stream, strict=False)
-                total_pages = len(pdf_reader_fallback.pages)
-            except ImportError:
-                # Se PyPDF2 non è disponibile, usa un valore di default
-                # e lascia che l'API di firma gestisca il documento
-                total_pages = 1
-                # Log dell'errore per debug
-                print(f"Warning: Impossibile contare le pagine del PDF: {str(e)}. Usando default: 1 pagina.")
-            except Exception as e2:
-                # Se anche il fallback fallisce, usa un valore di default
-                total_pages = 1
-                print(f"Warning: Impossibile contare le pagine del PDF: {str(e2)}. Usando default: 1 pagina.")
-        
-        # Determina le pagine per la firma basato sull'opzione scelta
-        if page_signature == "tutte_le_pagine":
-            # Default: firma su tutte le pagine
-            signature_pages = list(range(1, total_pages + 1))
-        elif page_signature == "prima_pagina":
-            signature_pages = [1]
-        elif page_signature == "ultima_pagina":
-            signature_pages = [total_pages]
-        else:
-            # Se viene passato un valore non valido, usa il default
-            signature_pages = list(range(1, total_pages + 1))
-        
-        # Converti il contenuto in base64
-        content_base64 = base64.b64encode(pdf_response.content).decode('utf-8')
-        url = f"{settings.SIGNATURE_API}/certificates/{certificate_id}/sign"
-        headers = {
-            "tenant": settings.TENANT,
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json",
-            "Infocert-SAT": infocert_sat,
-            "Transaction-Id": transaction_id
-        }
-
-        # Gestione campo AcroForm esistente vs posizione custom
-        if use_existing_field:
-            # Usa campo AcroForm esistente - Le coordinate verranno gestite dal campo stesso
-            # Per ora usiamo coordinate standard, in futuro si possono estrarre dal PDF
-            coords = {
-                "llx": 0,
-                "lly": 0, 
-                "urx": 0,
-                "ury": 0,
-                "use_acroform": True,
-                "field_name": use_existing_field
-            }
-        else:
-            # Calcola le coordinate del talloncino di firma
-            coords = get_signature_position(
-                position=signature_position,
-                page_width=595,  # A4 standard
-                page_height=842,  # A4 standard
-                custom_coords=custom_coords
+            # Determina le pagine per la firma: la pagina del campo esistente oppure l'opzione scelta
+            signature_pages = (
+                [existing_field.page] if existing_field else _signature_pages_for(page_signature, total_pages)
             )
-            coords["use_acroform"] = False
-        
-        # Crea l'array signatureFields dinamico per ogni pagina
-        signature_fields = []
-        for page_num in signature_pages:
-            signature_fields.append({
-                "position": {
-                    "page": page_num,
-                    "llx": coords["llx"],
-                    "lly": coords["lly"],
-                    "urx": coords["urx"],
-                    "ury": coords["ury"]
-                },
-                "signatureImage": "iVBORw0KGgoAAAANSUhEUgAAAPEAAABaCAYAAABpELAkAAAACXBIWXMAAAsTAAALEwEAmpwYAAAAAXNSR0IArs4c6QAAAARnQU1BAACxjwv8YQUAAA2vSURBVHgB7Z09bNzIFcffkJKwiXM+5vKBLTedgANyUnQ5bKl0KlW6VOlyLZ2BS6cuAXy2VR1cqnTpUl22FBLbqwtwwHa35QKJFUo+JytpOcx7MyT3g+SSWq1syfv/ATpL3FlyyOOb9+a9N/OIAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAKZBFbbY/bFCZ29rdHbhkXKqRGGVnLBDj9YOCIwiz+rdfz2ic35OukoBVSkMK/T0y2cEwDWxUNjirb9BoV4xv4faHtNOl+ad3ZZH76hmhLWvPFpQbfJ9IkdvjrRTyicArpFiIQYDdv65TNRfJ609OtWV5LhDXXq0ekSN1goB8J65PiGONVVIHr/0PXqydjj6OZuePb9K56zJXG5zxzmk3VWfvmmx6R7WSbHZLijVY23XpcBt0t7qZK0m5zw9XqFQ1ZLvW3xynA716Sj3HMOm8AV1Uu0afD/6fJP7U+GfwfEw7LFl8pyugjyrM7c6MmURM1yQ+9fcf9H0Wf0Cc8/VhTh++R99bk3sr1vrFAT1EU2lnKNB+7+xoN29z8LmJccC/nm3dETbr7ZYqGsjM/UwlBPwPJyPP/zheXKd8T6cHK/zOev2euF4CxlIaqwx1+nrfzTp2z82zVERTBVuGIEf7o+runzOfdr9XS85ZsxkVUldW6kmPS0pWOPPSth5zc9Cyxw6ul89+h25f8Vz6yBc5v77uc8AzC0OTUPIAiEC9+DlN/zyf8Maqj74jAVGZbzsMb4nn3mp40HvHv+3Rvl4po0IwjDy99v/bPGLXqcyaEcEed38LlotVF0a70/IQn3yr/XkbxmYsvomg9O4hTFOyM/iwet7/Lwa5lnZ+xy+VoXK41H/bMsMPgBETCfE9qWvTRTW6c5Z3Oadvzxy5O2bDSN0l0EE+WE0f91bbbKgtVNtlFtnwatbM1qvZ5zFZwuiSUUoFlIVLlO5+ytGzreoyw1YYC64WY4tmV8qt2v/NYKZfvG10YjWPJf587lOO5NCOqSQ59iiaUUIXTajw7F2fTaj4/N8evLCmPjp67GpHaxnRuJcp0lPZjQ/lfslnrMvuD5d8PzfDXrsA+iZ/jhmABntV0AyKCDEBwxXF2Lj2KGrv8xyntB9lswvzXw1uJ/S9qEevNAXwUpKwIyJuzp4wa0j6AVtiwnK04CkHWu0Bg8Ce6sd2v1Tj3/fz7xelrUh1xBv9DT3SGPhubufPRuZe4/TaKXDVgAMMaUQs9ZQwSFri+7svKVq1HMsv++02ikNOox4occJKC1c1mstJvNo+0UtGq2TXK/Rek5Kb9FkfPrEK68FQ/YuO/pF7rPKE+DYu98PlwmACUwnxIpf5MdftmmWhE478zphTnvj5c4wtxeXevRnjufG4Rpxwg17nofph7WRv0UrN1rNyITNRjsvJmrOcRRr36JnFYfGBuEl9pZHXurinDow59ycObGXYZJLfDkP8XI7On086N03ISsh1DSRLFNZHF07r5dznGUdI+izwoTG/r3JAmy1bVF/AchgWu/0+0E75TVeefwobn3AWjJtFkvWVb63u2aztmbE6THPwZ3J5zPzaADyub1pl57fY4/ypBY2Bhx7fM8vuvTb3/gFTiRvoikt6P4mt3t2ZV+ASdHU4/HpHi0sHo301+eQmoJjC+Rze4VYPMoPXvYyTOID9vgeXWreGuNyOClUk+O5Nu67xabws6muEeNQRmiMvfOPvhgdHLZfzTIWDz5Cis1plTVXZY/peObUh8BxsxxGddZe2X2TPktsOQtjRqssT3iWxvXYFL6XOlrJaZuZYaXTx7LytalkJhqYW4o1cV8WD4wdE20k87ntV/ale7K2Tx8CCSelNZqYxA168LptcqAFSQWV+PLJm6rR3BITHnZQ5ZnRNnbN8WNdz0jrrNGDv2/Q068G8+pexrMSHA5bybOSa3/yyygn2/FTgizpoP2FI+NzP5Xwl8nMQoolmEixJvb8vPCITb0M1eVSHmeJCGJWyqQgqY6SLik/NtY8SBN19GifbTJFWlhkcYNox6dr7ART6UUHkpr5cGj5odGkHENPEz0rdpj5vr22Q+l2kg4qA9Ap/0i2GAQYlKBYiGXuKWmMeYhW3v2ACfmSMpklYJMZeITLLm4IlCw3TJvLkr758IfBoKAL8qnjAeQX/iHRlJluocI8GSSUCzGJJpokyO8mrj66XmSQefyHZyYJo4xQiInsRNryMosbRMv2guepkI8MYrIyKZ73GjN94SA3NGQSOqJ+a2efJvZZMuPC9FplM3DeAJ8EuBGU906LIDdah6xJlsldsC9sqFlLB12643WSdibtMWVSDl5UCQ353ov0Bbysl74TCecA180Wjj2Ty3xk8qFF2zlOxS6L5GtL0oiNOY8vqvdS5xckvPPdWlq4vvuqa1Izw0wz10vu88kXh9yuze1q/IS9pB9983lnqM/y957p80K0gULczvPaZu4smWmZzwsAAAAAAAAAAAAAAAAAAAAAAAAAAABw67h5OziZdEJZSuj1rrReF4A5oVzapSxw6JFHf53h/lJZyFK8kzd1u9ro2KYkAgAmUizEplSLqat0vUL14NUGaaontoHKXNIHABijWIjVe1j2ZjaKj0qTaN0k79eHMKUpKsAWla2ZZrN6MBeUEGLniELdvdbC4o6OtmwNu7QXVSwERD/59WipZIeIIMQgk2Ihfrx6/cvg7BI82TPr+gYKAD5Sbsa+07L2FwAwFeW90++WKrkFvqVw9p2fD/Z0ttUKq4lwLrKG/cvvZ1f2Ra7Z86upa/wvuFxtqHjOGQ4t3JcNBJZ46lDGEz/tfcrzNG7CKfaunvT/AswlxUK809pk7/QKqXOZk42a1uKQOj1u2D/OZYeKitl07jyqPqijsiRnmsxuj26lXJV7eVHP3GqmQEjN4JM364nDbfgaYlfsvDyiwG1OFBC7u6WUT6mNHI/rPp1rMntaO3y/WXWUpApEeLHB7bzM+yQ6zC0+vvP6Pj/PKi2aHUXsPHekFlPQTl1TNiOUou62RhPfd6/DR/cJAJrl5vFvgyprsk32hFXM9jxu5AgLZGM4I9S2yv3uj3u5nmcdLA9CWkYwdkc+l03txNGjVLRXlts22lOxJgz6tpC37B3t8PXstrRpQbYCvEXJTpISytJts32Pw9eVrYd0UOMPWMNW0t83fbhYN7/HFRvCqGaUqZ1s7nWDY94V+jbDSReGg6mD1eTryWAitZhct5P6jjLfqZn7Nu0UPPcgYXZCrFmAlZK9rJ6nio7Jxuyi+ex+1StEOZvuxdrVbmbnp84Rb2onm/Z9+qvm2GBwYNqoYIPPYwU1q0rDQIDtxnffrWVbBiLsTz7P74OEwrI86dvfc6isv2G2n2208guwBXyeYGivLrNjp/wsZfWHzXynWaoUDZg7ZifEIoC9YD9TKGQTu21Te6iW7PaYCWtFzSZslgaNN3cfLyI+fp1Gy49qDHupAWPn5XKyyZ1aPMgVYHuuyX3YW2tmfk82yfuapxUi7Lb9PmXjRZvTH5LnFcXF/WgjQABSzM47LS+27AaZh8Sa7b/5e1Qr87KmhceWXrHfCwr2dTaaL8n2Wh77dBCPfnxJR5vdW9r2wVk6nNi2n8R0axO3lj3T+6aUKjQruAIzLKgWTBYKl+ecesr6u/1kX2u/nEdXS19qlNoU3hTx5rtWHbosQa9m/pX56LhzLvbQS5ukUHj0mRwnyqgeIYPeGjzM4MrMToidn01XzaAMg32ey11DQkTn0YAhnu7dSPA1WwHiHAqmqLwgYSQZhBSbwKKVhwX29HgwRYgLhYuprNxiywSAKzI7Ib5zfntMQvdKxctF4943v40LrHjkL4xwdgotBteBCQ1mwu2oTywJGBJdGQ7PTOIiqAyWSg9VllAmNFPJqeBQ3IeEKIRWVmABuEZuhxAnNZIdz8w/ix1BsUNrLBwTlRPVUTLKZZAFIE6kee+yB333CwguuBHcjNzpIu6eWm+vxJnjpXl5SHw3VDXbfmxNclxOVDKgGpes5Oj53aRI2k/9FXqflLVAwFxyO4RYKgjGYSMpJZongKKl3fAe5YWjpJyomb+Gtt1lKgtKH1zXhpYkkUPSP6+b/pAFctlBB8wNt8OcFiQJxKEtFkD2MIdb9PBVm+elbZ7h2hf9VC+zl1gEK85nbtLeWGVDEcTt75smo8rkIR/fp4etpsmSih1zsg1Rv19jQa3R3c+ej5jjMgic3l2JrrFBOy+rtLTUpr7rm+/LwgQ6r5r0S4fn0I/WDugqSIH3k0/EH1Cx98x9dSXTrGyoDcwDt0eI5aWVfOg4bTKgOgW6Tudj7YymVZISmZ2QYcuOVqJsKj6P3hTJpdPhRpGBYk33QaaUDAKmD5IjzvNqydM+u2Chvoi+PzT97hsn2tWE2F7vgJT0MeprwL8tmiy0q50bfDSU2NmDR/2QTdncuGY87/QmO5vENHSGFkZc6hoRg3q+KyxIK8ZJFacvSq51oCTJ44ieFmgpyZJqtI5o0ambxQ42flyJBoCemUtLX+547Zw+7JsUTnKXbWJHGMeJ+T5UlxZYM1/o7OSXcKHLQsmfl4xV21RSfm60bpdL8lTgAgsgAAAAAAAAAAAAAAAAAAAAAABT83+Zcj5uf0fY7AAAAABJRU5ErkJggg==",
-                "avoidGraphicLayers": True,
-                "visibleText": visible_text,
-                "fontSize": 4
-            })
+            # Oltre SIGN_MAX_VISIBLE_FIELDS pagine un solo talloncino (la firma copre comunque tutto il documento)
+            signature_pages = limit_visible_pages(signature_pages, settings.SIGN_MAX_VISIBLE_FIELDS)
+            
+            url = f"{settings.SIGNATURE_API}/certificates/{certificate_id}/sign"
+            headers = _sign_headers(access_token, infocert_sat, transaction_id)
 
-        body = {
-            "applicationId": "trusty",
-            "pin": pin,
-            "padesSignatures": [
-                {
-                    "signatureLevel": "BASELINE-B",
-                    "requestId": transaction_id,
-                    "document": {
-                        "content": content_base64,
-                        "contentType": "application/pdf",
-                        "attachName": attach_name
-                    },
-                    "packaging": "ENVELOPED",
-                    "isVisible": True,
-                    "signatureFields": signature_fields
-                }
-            ]
-        }
+            # Crea l'array signatureFields dinamico per ogni pagina (geometria letta in un thread)
+            placements = await anyio.to_thread.run_sync(
+                _signature_placements, document, signature_pages, signature_position, custom_coords, existing_field
+            )
 
-        response = requests.post(url, headers=headers, json=body)
+            if signing_mode == "hash":
+                # Al servizio di firma viaggia solo il digest: il PDF firmato viene assemblato qui
+                signed_pdf = await _sign_document_hash(
+                    document, pdf_stream, certificate_id, headers, pin, transaction_id,
+                    signature_pages, placements, visible_text, existing_field, local_signer, sat_session
+                )
+                with signed_pdf:
+                    upload_info = await _upload_signed_pdf(signed_pdf, attach_name)
+                if local_signer:
+                    # Firma con il certificato di prova: nessun valore legale
+                    upload_info["test_signature"] = True
+                if sat_session is not None:
+                    upload_info["sat_session"] = sat_session.to_dict()
+                return upload_info
+
+            if sat_session is not None:
+                sat_sessions.consume(sat_session)
+
+            signature_fields = build_signature_fields(
+                signature_pages, placements, visible_text, SIGNATURE_IMAGE_BASE64
+            )
+
+            # Il contenuto viene codificato in base64 dal file temporaneo durante l'invio
+            body = StreamingSignBody({
+                "applicationId": "trusty",
+                "pin": pin,
+                "padesSignatures": [
+                    _build_pades_signature(
+                        StreamingSignBody.placeholder(0), attach_name, transaction_id, signature_fields
+                    )
+                ]
+            }, [pdf_stream])
+
+            result, signed_documents = await _send_sign_request(url, headers, body)
 
-        response.raise_for_status()
-        result = response.json()
         upload_info={}
 
         # Estrai il documento firmato in base64 dalla risposta
         if "signatureResult" in result and len(result["signatureResult"]) > 0:
             signature_result = result["signatureResult"][0]
             if "signedDocument" in signature_result and "content" in signature_result["signedDocument"]:
-                signed_document_base64 = signature_result["signedDocument"]["content"]
                 signed_document_name = signature_result["signedDocument"].get("attachName", attach_name)
                 
-                # Converti da base64 a bytes
-                signed_document_bytes = base64.b64decode(signed_document_base64)
-                
-                # Carica il PDF firmato su DigitalOcean Spaces
-                upload_result = upload_to_digitalocean_spaces(signed_document_bytes, attach_name)
-                
-                # Aggiungi le informazioni di caricamento al risultato
-                upload_info = upload_result
-             
+                # PDF firmato già decodificato dal base64 durante la lettura della risposta
+                signed_pdf = signed_documents.signed_document(0)
+                if signed_pdf is not None:
+                    with signed_pdf:
+                        # Carica il PDF firmato su DigitalOcean Spaces (multipart oltre la soglia)
+                        upload_result = await _upload_signed_pdf(signed_pdf, attach_name)
+                    
+                    # Aggiungi le informazioni di caricamento al risultato
+                    upload_info = upload_result
+        
+        signed_documents.discard()
+        if sat_session is not None:
+            upload_info["sat_session"] = sat_session.to_dict()
         return upload_info
 
-    except RequestException as e:
+    except HTTPError as e:
+        _invalidate_access_token(e, access_token)
         return {
             "type": "error",
             "content": f"Error during document signing: {str(e)}"
         }
+    except DocumentTooLargeError as e:
+        return {
+            "type": "error",
+            "content": f"Error downloading document: {str(e)}"
+        }
+    except FieldNotFoundError as e:
+        return {
+            "type": "error",
+            "content": f"Error with use_existing_field: {str(e)}"
+        }
+    except HashSigningError as e:
+        return {
+            "type": "error",
+            "content": f"Error during hash signing: {str(e)}"
+        }
+    except SatSessionError as e:
+        return {
+            "type": "error",
+            "content": str(e)
+        }
     except ValueError as e:
         return {
             "type": "error",
             "content": f"Error parsing signature response: {str(e)}"
         }
+
+
+class BatchDocument(BaseModel):
+    """Documento da firmare in sign_documents_batch, con le proprie opzioni di posizionamento."""
+    link_pdf: str = Field(description="URL del documento PDF da firmare")
+    page_signature: str = Field(default="tutte_le_pagine", description="'prima_pagina', 'ultima_pagina' o 'tutte_le_pagine'")
+    signature_position: str = Field(default="bottom-right", description="Posizione del talloncino (come in sign_document)")
+    custom_coords: Optional[Dict[str, int]] = Field(default=None, description="Coordinate se signature_position='custom'")
+    use_existing_field: Optional[str] = Field(default=None, description="Nome del campo AcroForm da usare")
+
+
+@mcp.tool(
+    name="sign_documents_batch",
+    description="Firma digitalmente più documenti PDF con un'unica autorizzazione SAT. Scarica i documenti in parallelo, li invia a Infocert nel minor numero di richieste di firma possibile, carica i PDF firmati su DigitalOcean Spaces e restituisce il risultato per ogni documento.",
+    tags=["signature", "services", "storage", "batch"]
+)
+async def sign_documents_batch(
+    certificate_id: Annotated[str, Field(description="ID del certificato digitale ottenuto da get_certificates")],
+    access_token: Annotated[str, Field(description="Token di accesso ottenuto dal tool auth_token")],
+    infocert_sat: Annotated[str, Field(description="Token SAT ottenuto dal tool authorize_smsp (stringa vuota: SAT registrato da authorize_smsp per certificate_id e transaction_id)")],
+    transaction_id: Annotated[str, Field(description="ID della transazione ottenuto da request_smsp_challenge")],
+    pin: Annotated[str, Field(description="PIN del certificato digitale (password di protezione)")],
+    documents: Annotated[List[BatchDocument], Field(description="Documenti da firmare, ognuno con link_pdf e opzioni di pagina/posizione")],
+    batch_id: Annotated[Optional[str], Field(description="ID di un batch interrotto da riprendere (stessi documenti); se omesso ne viene generato uno nuovo")] = None,
+) -> dict:
+    """
+    Firma più documenti PDF con lo stesso SAT (authorize_smsp autorizza fino a 100 firme).
+    
+    Il flusso è lo stesso di sign_document, ma:
+    1. I documenti vengono scaricati in parallelo (SIGN_BATCH_CONCURRENCY)
+    2. Vengono inviati a /certificates/{id}/sign raggruppati in padesSignatures
+       (al massimo SIGN_BATCH_DOCUMENTS_PER_REQUEST documenti per richiesta)
+    3. I PDF firmati vengono caricati su DigitalOcean Spaces in parallelo
+    
+    Il certificato (per il testo visibile) viene letto una sola volta per tutto il batch.
+    
+    Le fasi concluse di ogni documento vengono registrate nel giornale del batch
+    (batch_journal): rieseguendo il batch con lo stesso batch_id dopo un'interruzione,
+    i documenti già caricati non vengono rifirmati e quelli già firmati vengono solo caricati.
+    Un batch può essere ripreso solo con lo stesso certificate_id che lo ha avviato.
+    
+    Args:
+        certificate_id (str): ID del certificato digitale da utilizzare
+        access_token (str): Token di accesso valido ottenuto da auth_token
+        infocert_sat (str): Token di autorizzazione ottenuto da authorize_smsp (vuoto: SAT registrato)
+        transaction_id (str): ID della transazione ottenuto da request_smsp_challenge
+        pin (str): PIN di protezione del certificato digitale
+        documents (list): Documenti da firmare (link_pdf, page_signature, signature_position,
+                          custom_coords, use_existing_field)
+        batch_id (str): ID del batch da riprendere (opzionale)
+        
+    Returns:
+        dict: Riepilogo del batch contenente:
+            - batch_id: ID del batch, da riusare per riprendere il batch se interrotto
+            - total_documents: Numero di documenti richiesti
+            - signed: Numero di documenti firmati e caricati
+            - failed: Numero di documenti con errore
+            - sat_session: Firme residue e scadenza del SAT, se registrato da authorize_smsp
+            - results: Array (nello stesso ordine di documents) con per ogni documento:
+                - link_pdf, success, signed_url, expires_in, spaces_key, total_pages, signature_pages
+                - resumed: "uploaded" o "signed" se il documento è stato ripreso dal giornale
+                - error: Messaggio di errore se il documento non è stato firmato
+            - type: "error" se si verifica un errore generale
+            - content: Messaggio di errore dettagliato
+    """
+    if not documents:
+        return {"type": "error", "content": "Nessun documento da firmare"}
+    if len(documents) > settings.SIGN_BATCH_MAX_DOCUMENTS:
+        return {
+            "type": "error",
+            "content": f"Troppi documenti nel batch: {len(documents)} (massimo {settings.SIGN_BATCH_MAX_DOCUMENTS})"
+        }
+    
+    try:
+        visible_text = await _visible_text_for(access_token)
+    except HTTPError as e:
+        _invalidate_access_token(e, access_token)
+        return {
+            "type": "error",
+            "content": f"Error during document signing: {str(e)}"
+        }
+    
+    batch_id = batch_id or uuid.uuid4().hex
+    journal_entries = {}
+    journal = batch_journal
+    if journal is not None:
+        try:
+            journal_entries = await anyio.to_thread.run_sync(
+                journal.start, batch_id, [document.link_pdf for document in documents], batch_owner(certificate_id)
+            )
+        except BatchMismatchError as e:
+            return {"type": "error", "content": str(e)}
+        except (sqlite3.Error, OSError) as e:
+            # Giornale non disponibile: il batch prosegue senza possibilità di ripresa
+            print(f"Warning: giornale del batch non disponibile: {str(e)}")
+            journal = None
+    
+    async def record(update, *args) -> None:
+        """Aggiorna il giornale; un errore su un documento non interrompe il batch (il documento non sarà riprendibile)."""
+        try:
+            await anyio.to_thread.run_sync(update, batch_id, *args)
+        except (sqlite3.Error, OSError) as e:
+            print(f"Warning: aggiornamento del giornale del batch non riuscito: {str(e)}")
+    
+    # Il SAT registrato deve coprire tutti i documenti ancora da firmare (una firma per documento)
+    try:
+        infocert_sat, sat_session = _sat_session_for(certificate_id, transaction_id, infocert_sat)
+        if sat_session is not None:
+            to_sign = len(documents) - sum(
+                1 for entry in journal_entries.values() if entry.stage in (SIGNED, UPLOADED)
+            )
+            if to_sign:
+                sat_sessions.check(sat_session, to_sign)
+    except SatSessionError as e:
+        return {"type": "error", "content": str(e)}
+    
+    results: List[dict] = [{"link_pdf": document.link_pdf, "success": False} for document in documents]
+    limiter = anyio.Semaphore(settings.SIGN_BATCH_CONCURRENCY)
+    # PDF firmati in attesa di upload, con il nome del file allegato
+    signed_documents: Dict[int, BinaryIO] = {}
+    attach_names: Dict[int, str] = {}
+    
+    # Ripresa: documenti già caricati o già firmati in un'esecuzione precedente del batch
+    resumed = set()
+    for index, entry in journal_entries.items():
+        if entry.stage == UPLOADED:
+            try:
+                presigned = await anyio.to_thread.run_sync(presign_spaces_document, entry.spaces_key)
+            except Exception as e:
+                results[index]["error"] = f"Upload error: {str(e)}"
+            else:
+                results[index].update({**presigned, "spaces_key": entry.spaces_key})
+        elif entry.stage == SIGNED and entry.signed_path:
+            try:
+                signed_documents[index] = open(entry.signed_path, "rb")
+            except OSError:
+                # PDF conservato non più disponibile: il documento riparte dal download
+                continue
+            attach_names[index] = _attach_name_from_url(documents[index].link_pdf)
+        else:
+            continue
+        resumed.add(index)
+        results[index].update({
+            "total_pages": entry.total_pages,
+            "signature_pages": entry.signature_pages,
+            "resumed": entry.stage
+        })
+    
+    # FASE 1: download e preparazione dei documenti in parallelo
+    prepared: Dict[int, dict] = {}
+    
+    def exclude(index: int, error: str) -> None:
+        """Documento escluso dal batch: errore nel risultato e file temporaneo chiuso subito."""
+        results[index]["error"] = error
+        item = prepared.pop(index, None)
+        if item is not None:
+            item["pdf_document"].close()
+            item["stream"].close()
+    
+    async def prepare(index: int, document: BatchDocument) -> None:
+        async with limiter:
+            try:
+                pdf_stream = await download_pdf(document.link_pdf)
+            except Exception as e:
+                # HTTPError, DocumentTooLargeError o altro: gli altri download del task group proseguono
+                results[index]["error"] = f"Errore nel download del PDF: {str(e)}"
+                return
+            # Il file temporaneo resta aperto fino all'invio della richiesta di firma
+            pdf_document = PdfDocument(pdf_stream)
+            prepared[index] = {"stream": pdf_stream, "pdf_document": pdf_document}
+            try:
+                total_pages = await anyio.to_thread.run_sync(_page_count, pdf_document)
+                existing_field = await anyio.to_thread.run_sync(
+                    _existing_field, pdf_document, document.use_existing_field
+                )
+                signature_pages = limit_visible_pages(
+                    [existing_field.page] if existing_field else _signature_pages_for(document.page_signature, total_pages),
+                    settings.SIGN_MAX_VISIBLE_FIELDS
+                )
+                placements = await anyio.to_thread.run_sync(
+                    _signature_placements, pdf_document, signature_pages,
+                    document.signature_position, document.custom_coords, existing_field
+                )
+            except FieldNotFoundError as e:
+                exclude(index, str(e))
+                return
+            except Exception as e:
+                # PDF malformato (pdfminer/pyHanko) o altro errore: solo questo documento fallisce
+                exclude(index, f"Errore nella lettura del PDF: {str(e)}")
+                return
+            
+            attach_names[index] = _attach_name_from_url(document.link_pdf)
+            results[index].update({"total_pages": total_pages, "signature_pages": signature_pages})
+            if journal is not None:
+                await record(journal.mark_downloaded, index, total_pages, signature_pages)
+            prepared[index].update({
+                "request_id": f"{transaction_id}-{index}",
+                "signature_fields": build_signature_fields(
+                    signature_pages, placements, visible_text, SIGNATURE_IMAGE_BASE64
+                )
+            })
+    
+    url = f"{settings.SIGNATURE_API}/certificates/{certificate_id}/sign"
+    headers = _sign_headers(access_token, infocert_sat, transaction_id)
+    
+    async def sign_chunk(chunk: List[int]) -> None:
+        if sat_session is not None:
+            try:
+                sat_sessions.consume(sat_session, len(chunk))
+            except SatSessionError as e:
+                for index in chunk:
+                    results[index]["error"] = str(e)
+                return
+        # Corpo in streaming: i documenti vengono codificati in base64 durante l'invio
+        body = StreamingSignBody({
+            "applicationId": "trusty",
+            "pin": pin,
+            "padesSignatures": [
+                _build_pades_signature(
+                    StreamingSignBody.placeholder(position),
+                    attach_names[index],
+                    prepared[index]["request_id"],
+                    prepared[index]["signature_fields"]
+                )
+                for position, index in enumerate(chunk)
+            ]
+        }, [prepared[index]["stream"] for index in chunk])
+        try:
+            result, parser = await _send_sign_request(url, headers, body)
+        except HTTPError as e:
+            _invalidate_access_token(e, access_token)
+            for index in chunk:
+                results[index]["error"] = f"Error during document signing: {str(e)}"
+            return
+        except ValueError as e:
+            for index in chunk:
+                results[index]["error"] = f"Error parsing signature response: {str(e)}"
+            return
+        
+        by_request_id = {
+            signature_result.get("requestId"): response_position
+            for response_position, signature_result in enumerate(result.get("signatureResult", []))
+        }
+        for position, index in enumerate(chunk):
+            response_position = by_request_id.get(prepared[index]["request_id"])
+            if response_position is None and len(by_request_id) == len(chunk):
+                # Risposta senza requestId riconoscibili: stesso ordine della richiesta
+                response_position = position
+            signature_result = result["signatureResult"][response_position] if response_position is not None else None
+            signed_pdf = parser.signed_document(response_position) if response_position is not None else None
+            if signature_result is None or signature_result.get("isOk") is False or signed_pdf is None:
+                if signed_pdf is not None:
+                    signed_pdf.close()
+                results[index]["error"] = "Documento non firmato da Infocert"
+                continue
+            signed_documents[index] = signed_pdf
+        parser.discard()
+        if journal is not None:
+            # Il PDF firmato viene conservato su disco prima di passare all'upload
+            for index in chunk:
+                if index in signed_documents:
+                    await record(journal.mark_signed, index, signed_documents[index])
+    
+    try:
+        async with anyio.create_task_group() as task_group:
+            for index, document in enumerate(documents):
+                if index not in resumed:
+                    task_group.start_soon(prepare, index, document)
+        
+        # FASE 2: firma, con più documenti per richiesta
+        indexes = sorted(prepared)
+        chunk_size = max(1, settings.SIGN_BATCH_DOCUMENTS_PER_REQUEST)
+        chunks = [indexes[i:i + chunk_size] for i in range(0, len(indexes), chunk_size)]
+        async with anyio.create_task_group() as task_group:
+            for chunk in chunks:
+                task_group.start_soon(sign_chunk, chunk)
+    finally:
+        for item in prepared.values():
+            item["pdf_document"].close()
+            item["stream"].close()
+    
+    # FASE 3: caricamento dei PDF firmati in parallelo
+    async def upload(index: int) -> None:
+        async with limiter:
+            with signed_documents.pop(index) as signed_pdf:
+                upload_result = await _upload_signed_pdf(signed_pdf, attach_names[index])
+        if upload_result.get("success"):
+            results[index].update(upload_result)
+            if journal is not None:
+                await record(journal.mark_uploaded, index, upload_result["spaces_key"])
+        else:
+            results[index]["error"] = upload_result.get("error", "Upload error")
+    
+    async with anyio.create_task_group() as task_group:
+        for index in list(signed_documents):
+            task_group.start_soon(upload, index)
+    
+    signed = sum(1 for result in results if result["success"])
+    summary = {
+        "batch_id": batch_id,
+        "total_documents": len(documents),
+        "signed": signed,
+        "failed": len(documents) - signed,
+        "results": results
+    }
+    if sat_session is not None:
+        summary["sat_session"] = sat_session.to_dict()
+    return summary
+
+
+# Coda dei job di firma in background (submit_signing_job): un job riuscito ha caricato il PDF firmato
+signing_jobs = JobQueue(
+    workers=settings.SIGN_JOB_WORKERS,
+    max_queued=settings.SIGN_JOB_MAX_QUEUED,
+    result_ttl=settings.SIGN_JOB_RESULT_TTL,
+    failed=lambda result: not result.get("success")
+)
+
+
+@mcp.tool(
+    name="submit_signing_job",
+    description="Accoda la firma di un documento PDF (stessi parametri di sign_document) e restituisce subito l'id del job. Lo stato e il risultato si leggono con get_signing_job. Se la coda è piena il job viene rifiutato: riprovare più tardi.",
+    tags=["signature", "services", "storage", "jobs"]
+)
+async def submit_signing_job(
+    certificate_id: Annotated[str, Field(description="ID del certificato digitale ottenuto da get_certificates")],
+    access_token: Annotated[str, Field(description="Token di accesso ottenuto dal tool auth_token")],
+    infocert_sat: Annotated[str, Field(description="Token SAT ottenuto dal tool authorize_smsp (stringa vuota: SAT registrato da authorize_smsp per certificate_id e transaction_id)")],
+    transaction_id: Annotated[str, Field(description="ID della transazione ottenuto da request_smsp_challenge")],
+    pin: Annotated[str, Field(description="PIN del certificato digitale (password di protezione)")],
+    link_pdf: Annotated[str, Field(description="URL del documento PDF da firmare (deve essere accessibile pubblicamente)")],
+    page_signature: Annotated[str, Field(description="Come in sign_document: 'prima_pagina', 'ultima_pagina' o 'tutte_le_pagine'")] = "tutte_le_pagine",
+    signature_position: Annotated[str, Field(description="Come in sign_document (default: 'bottom-right')")] = "bottom-right",
+    custom_coords: Annotated[Optional[Dict[str, int]], Field(description="Coordinate se signature_position='custom': {'llx': int, 'lly': int, 'urx': int, 'ury': int}")] = None,
+    use_existing_field: Annotated[Optional[str], Field(description="Nome del campo AcroForm da usare per la firma")] = None,
+    signing_mode: Annotated[str, Field(description="Come in sign_document: 'pades' (default) o 'hash'")] = "pades",
+) -> dict:
+    """
+    Accoda la firma di un documento: la pipeline di sign_document (download, firma,
+    upload) viene eseguita da uno dei SIGN_JOB_WORKERS worker.
+    
+    Returns:
+        dict: job_id, status ('queued') e queue_position; con la coda piena
+              (SIGN_JOB_MAX_QUEUED job in attesa) type='error' e retry_after_seconds
+    """
+    async def run() -> dict:
+        return await sign_document(
+            certificate_id, access_token, infocert_sat, transaction_id, pin, link_pdf,
+            page_signature, signature_position, custom_coords, use_existing_field, signing_mode
+        )
+    
+    try:
+        job = signing_jobs.submit(run, description=f"Firma di {_attach_name_from_url(link_pdf)}")
+    except JobQueueFullError as e:
+        return {
+            "type": "error",
+            "content": str(e),
+            "queued_jobs": signing_jobs.queued,
+            "retry_after_seconds": 30
+        }
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "queue_position": signing_jobs.position(job)
+    }
+
+
+@mcp.tool(
+    name="get_signing_job",
+    description="Restituisce lo stato di un job di firma (queued, running, succeeded, failed, cancelled) e, quando è concluso, il risultato di sign_document.",
+    tags=["signature", "jobs"]
+)
+async def get_signing_job(
+    job_id: Annotated[str, Field(description="ID del job restituito da submit_signing_job")]
+) -> dict:
+    """
+    Stato di un job di firma.
+    
+    Returns:
+        dict: job_id, description, status, queue_position, created_at/started_at/finished_at
+              (timestamp Unix), result (risposta di sign_document) ed error
+    """
+    job = signing_jobs.get(job_id)
+    if job is None:
+        return {
+            "type": "error",
+            "content": f"Job '{job_id}' non trovato (inesistente o concluso da più di {settings.SIGN_JOB_RESULT_TTL} secondi)"
+        }
+    return {**job.to_dict(), "queue_position": signing_jobs.position(job)}
+
+
+@mcp.tool(
+    name="cancel_signing_job",
+    description="Annulla un job di firma in attesa o in esecuzione. Un job già inviato a Infocert potrebbe essere stato firmato comunque.",
+    tags=["signature", "jobs"]
+)
+async def cancel_signing_job(
+    job_id: Annotated[str, Field(description="ID del job restituito da submit_signing_job")]
+) -> dict:
+    """
+    Annulla un job. I job in attesa non vengono eseguiti; per quelli in esecuzione
+    la pipeline viene interrotta e i file temporanei chiusi, ma se la richiesta di
+    firma era già partita il documento potrebbe risultare firmato (senza upload).
+    
+    Returns:
+        dict: Stato del job dopo l'annullamento (come get_signing_job)
+    """
+    job = signing_jobs.cancel(job_id)
+    if job is None:
+        return {
+            "type": "error",
+            "content": f"Job '{job_id}' non trovato"
+        }
+    return job.to_dict()
+
+
+@mcp.tool(
+    name="get_upstream_metrics",
+    description="Restituisce lo stato dei limitatori verso Infocert e Spaces (richieste in coda, in corso, risposte 429, attese scadute), la profondità della coda dei job di firma e i contatori della cache dei documenti (hit, miss, rivalidazioni, evizioni).",
+    tags=["metrics"]
+)
+async def get_upstream_metrics() -> dict:
+    """
+    Metriche dei limitatori per upstream (authorization, certificates, smsp, sign, spaces).
+    
+    Returns:
+        dict: upstreams (per ognuno waiting = profondità della coda, in_flight, max_in_flight,
+              rate, paused_for, throttled = 429 ricevuti, rejected = attese oltre RATE_LIMIT_MAX_WAIT)
+              signing_jobs (queued, running) e document_cache (hit/miss di documenti e risultati,
+              rivalidazioni 304, evizioni, occupazione; None se la cache è disattivata)
+    """
+    return {
+        "upstreams": upstream_stats(),
+        "signing_jobs": {"queued": signing_jobs.queued, "running": signing_jobs.running},
+        "document_cache": await anyio.to_thread.run_sync(document_cache.stats) if document_cache is not None else None
+    }
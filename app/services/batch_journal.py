@@ -0,0 +1,254 @@
+"""
+Giornale locale dei batch di firma, per riprendere un batch interrotto.
+
+Ogni documento di sign_documents_batch attraversa tre fasi: scaricato, firmato da
+Infocert, caricato su Spaces. Se il processo si riavvia a metà, senza traccia delle
+fasi concluse il batch ripartirebbe da capo, consumando di nuovo le firme del SAT
+(signaturesNumber) e le chiamate a Infocert. Il giornale registra la fase di ogni
+documento in un database SQLite in modalità WAL (ogni aggiornamento è una piccola
+transazione durevole anche in caso di crash) e conserva su disco il PDF firmato
+finché non è stato caricato. Rieseguendo il batch con lo stesso batch_id:
+- i documenti già caricati restituiscono il risultato registrato (nuovo URL firmato)
+- quelli già firmati vengono solo caricati, dal PDF conservato
+- gli altri ripartono dal download
+Il batch è legato al certificato che lo ha avviato (hash SHA-256 di certificate_id):
+lo stesso batch_id con un altro certificato non viene ripreso.
+"""
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, List, Optional
+
+from app.config.setting import settings
+from app.services.private_dir import ensure_private_directory
+
+# Fasi di un documento, in ordine
+PENDING = "pending"
+DOWNLOADED = "downloaded"
+SIGNED = "signed"
+UPLOADED = "uploaded"
+
+_COPY_CHUNK_SIZE = 1024 * 1024
+# Intervallo minimo tra due pulizie dei batch scaduti (secondi)
+PURGE_INTERVAL = 15 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batch_documents (
+    batch_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    link_pdf TEXT NOT NULL,
+    owner TEXT,
+    stage TEXT NOT NULL,
+    total_pages INTEGER,
+    signature_pages TEXT,
+    signed_path TEXT,
+    spaces_key TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (batch_id, position)
+)
+"""
+
+
+class BatchMismatchError(Exception):
+    """Il batch_id è già registrato con documenti diversi o da un altro certificato."""
+
+
+def batch_owner(certificate_id: str) -> str:
+    """Proprietario di un batch: hash del certificato (non conservato in chiaro)."""
+    return hashlib.sha256(certificate_id.encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class JournalEntry:
+    """Stato registrato di un documento del batch."""
+    position: int
+    link_pdf: str
+    stage: str
+    total_pages: Optional[int] = None
+    signature_pages: Optional[List[int]] = None
+    signed_path: Optional[str] = None
+    spaces_key: Optional[str] = None
+
+
+class BatchJournal:
+    """
+    Giornale SQLite (WAL) delle fasi dei documenti di ogni batch.
+
+    Args:
+        directory (str): Directory del database e dei PDF firmati in attesa di upload
+                         (creata con permessi 0700; se esiste deve appartenere all'utente del processo)
+        ttl (int): Secondi dopo l'ultimo aggiornamento oltre i quali un batch viene dimenticato
+    """
+
+    def __init__(self, directory: str, ttl: int = 7 * 24 * 3600):
+        self._directory = directory
+        self._files = os.path.join(directory, "signed")
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._next_purge = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Connessione condivisa, aperta al primo utilizzo (da chiamare con il lock).
+        I batch scaduti vengono rimossi all'apertura e poi al più ogni PURGE_INTERVAL
+        secondi, così un server in esecuzione da giorni rispetta comunque il TTL.
+        """
+        if self._connection is None:
+            # I PDF firmati conservati sono leggibili solo dall'utente del processo
+            ensure_private_directory(self._directory)
+            ensure_private_directory(self._files)
+            connection = sqlite3.connect(
+                os.path.join(self._directory, "journal.sqlite3"),
+                isolation_level=None,  # autocommit: ogni aggiornamento è una transazione
+                check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Con WAL, NORMAL resta consistente dopo un crash del processo
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(_SCHEMA)
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(batch_documents)")}
+            if "owner" not in columns:
+                # Giornale creato prima del controllo del proprietario
+                connection.execute("ALTER TABLE batch_documents ADD COLUMN owner TEXT")
+            self._connection = connection
+        now = time.time()
+        if now >= self._next_purge:
+            self._next_purge = now + PURGE_INTERVAL
+            self._purge()
+        return self._connection
+
+    def start(self, batch_id: str, links: List[str], owner: str) -> Dict[int, JournalEntry]:
+        """
+        Registra i documenti del batch (se nuovo) e restituisce lo stato di ciascuno.
+
+        Args:
+            batch_id (str): ID del batch
+            links (list): link_pdf dei documenti, in ordine
+            owner (str): Proprietario del batch (batch_owner del certificato)
+
+        Raises:
+            BatchMismatchError: batch_id già usato con documenti diversi o da un altro proprietario
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            rows = connection.execute(
+                "SELECT position, link_pdf, stage, total_pages, signature_pages, signed_path, spaces_key, owner "
+                "FROM batch_documents WHERE batch_id = ? ORDER BY position",
+                (batch_id,)
+            ).fetchall()
+            if rows and (
+                [row[1] for row in rows] != list(links)
+                or not all(row[7] and hmac.compare_digest(row[7], owner) for row in rows)
+            ):
+                raise BatchMismatchError(f"Il batch '{batch_id}' è già registrato con documenti o certificato diversi")
+            if not rows:
+                connection.executemany(
+                    "INSERT INTO batch_documents (batch_id, position, link_pdf, owner, stage, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(batch_id, position, link, owner, PENDING, now) for position, link in enumerate(links)]
+                )
+                return {position: JournalEntry(position, link, PENDING) for position, link in enumerate(links)}
+        return {
+            row[0]: JournalEntry(
+                position=row[0],
+                link_pdf=row[1],
+                stage=row[2],
+                total_pages=row[3],
+                signature_pages=json.loads(row[4]) if row[4] else None,
+                signed_path=row[5],
+                spaces_key=row[6]
+            )
+            for row in rows
+        }
+
+    def _update(self, batch_id: str, position: int, **values) -> None:
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        with self._lock:
+            self._connect().execute(
+                f"UPDATE batch_documents SET {assignments}, updated_at = ? WHERE batch_id = ? AND position = ?",
+                (*values.values(), time.time(), batch_id, position)
+            )
+
+    def mark_downloaded(self, batch_id: str, position: int, total_pages: int, signature_pages: List[int]) -> None:
+        self._update(
+            batch_id, position,
+            stage=DOWNLOADED, total_pages=total_pages, signature_pages=json.dumps(signature_pages)
+        )
+
+    def mark_signed(self, batch_id: str, position: int, signed_pdf: BinaryIO) -> str:
+        """
+        Conserva su disco il PDF firmato (scritto e sincronizzato prima di cambiare fase)
+        e lo stream viene riportato all'inizio. Operazione bloccante: va eseguita in un thread.
+
+        Returns:
+            str: Percorso del PDF conservato
+        """
+        # Nome casuale: batch_id arriva dal client e non va usato in un percorso
+        path = os.path.join(self._files, f"{uuid.uuid4().hex}.pdf")
+        signed_pdf.seek(0)
+        handle, temp_path = tempfile.mkstemp(dir=self._files, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as target:
+                shutil.copyfileobj(signed_pdf, target, _COPY_CHUNK_SIZE)
+                target.flush()
+                os.fsync(target.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        finally:
+            signed_pdf.seek(0)
+        try:
+            self._update(batch_id, position, stage=SIGNED, signed_path=path)
+        except BaseException:
+            # Non registrato: la copia non sarebbe mai usata né rimossa
+            os.remove(path)
+            raise
+        return path
+
+    def mark_uploaded(self, batch_id: str, position: int, spaces_key: str) -> None:
+        """Registra la chiave su Spaces e rimuove il PDF conservato, non più necessario."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT signed_path FROM batch_documents WHERE batch_id = ? AND position = ?",
+                (batch_id, position)
+            ).fetchone()
+        self._update(batch_id, position, stage=UPLOADED, spaces_key=spaces_key, signed_path=None)
+        if row and row[0] and os.path.exists(row[0]):
+            os.remove(row[0])
+
+    def _purge(self) -> None:
+        """Dimentica i batch non aggiornati da più di ttl secondi (da chiamare con il lock)."""
+        limit = time.time() - self._ttl
+        expired = self._connection.execute(
+            "SELECT batch_id FROM batch_documents GROUP BY batch_id HAVING MAX(updated_at) < ?", (limit,)
+        ).fetchall()
+        for (batch_id,) in expired:
+            paths = self._connection.execute(
+                "SELECT signed_path FROM batch_documents WHERE batch_id = ? AND signed_path IS NOT NULL", (batch_id,)
+            ).fetchall()
+            for (path,) in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            self._connection.execute("DELETE FROM batch_documents WHERE batch_id = ?", (batch_id,))
+
+
+def _default_directory() -> str:
+    return settings.SIGN_BATCH_JOURNAL_DIR or os.path.join(tempfile.gettempdir(), "signature-mcp-journal")
+
+
+batch_journal: Optional[BatchJournal] = BatchJournal(
+    directory=_default_directory(),
+    ttl=settings.SIGN_BATCH_JOURNAL_TTL
+) if settings.SIGN_BATCH_JOURNAL_ENABLED else None
@@ -0,0 +1,97 @@
+"""
+Cache con TTL dei certificati restituiti da `/certificates`.
+
+La chiave è l'hash SHA-256 dell'access token (il token non viene conservato in chiaro):
+il certificato letto dal tool get_certificates viene riusato da sign_document per
+lo stesso token, evitando un round-trip e il parsing del DN ad ogni firma.
+"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+
+class CertificateCache:
+    """
+    Cache LRU con scadenza dei certificati per access token.
+
+    Args:
+        ttl (int): Durata di validità di una voce in secondi
+        max_entries (int): Numero massimo di voci mantenute (le meno recenti vengono rimosse)
+    """
+
+    def __init__(self, ttl: int = 300, max_entries: int = 1024):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def _key(access_token: str) -> str:
+        return hashlib.sha256(access_token.encode("utf-8")).hexdigest()
+
+    def get(self, access_token: str) -> Optional[dict]:
+        """Restituisce il certificato in cache per il token, se presente e non scaduto."""
+        key = self._key(access_token)
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, certificate = item
+        if expires_at <= time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return certificate
+
+    def put(self, access_token: str, certificate: dict) -> None:
+        """Memorizza il certificato per il token."""
+        key = self._key(access_token)
+        self._entries[key] = (time.monotonic() + self._ttl, certificate)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            old_key, _ = self._entries.popitem(last=False)
+            self._locks.pop(old_key, None)
+
+    def invalidate(self, access_token: Optional[str] = None) -> None:
+        """Rimuove il certificato del token indicato, oppure svuota la cache se il token è None."""
+        if access_token is None:
+            self._entries.clear()
+            self._locks.clear()
+            return
+        key = self._key(access_token)
+        self._entries.pop(key, None)
+        self._locks.pop(key, None)
+
+    async def get_or_fetch(self, access_token: str, fetch: Callable[[str], Awaitable[dict]]) -> dict:
+        """
+        Restituisce il certificato dalla cache o lo recupera con `fetch`.
+        Le richieste concorrenti per lo stesso token attendono un'unica chiamata.
+
+        Args:
+            access_token (str): Token di accesso Infocert
+            fetch: Coroutine (access_token) -> certificato
+
+        Returns:
+            dict: Certificato (formato di get_certificates)
+        """
+        certificate = self.get(access_token)
+        if certificate is not None:
+            return certificate
+
+        key = self._key(access_token)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        try:
+            async with lock:
+                certificate = self.get(access_token)
+                if certificate is not None:
+                    return certificate
+                certificate = await fetch(access_token)
+                self.put(access_token, certificate)
+                return certificate
+        finally:
+            # Il lock serve solo mentre un fetch è in corso: i chiamanti in attesa hanno già il riferimento
+            if not lock.locked() and self._locks.get(key) is lock:
+                del self._locks[key]
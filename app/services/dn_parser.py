@@ -0,0 +1,124 @@
+"""
+Parser dei Distinguished Name (RFC 4514) usati nel campo `subject` dei certificati.
+
+Il DN viene letto in una sola passata con una regex compilata ancorata all'inizio
+di ogni RDN, quindi un attributo come `C=` non può mai corrispondere all'interno
+di `CN=` o `DC=`. Gestisce separatori `,` `;` `+`, valori tra virgolette ed escape
+(`\\,` `\\+` `\\"` `\\\\` e coppie esadecimali `\\C3\\A8`); un RDN malformato viene
+saltato fino al separatore successivo senza perdere gli attributi seguenti. I risultati sono
+memorizzati: i tenant con migliaia di certificati ripetono spesso gli stessi subject.
+"""
+import re
+from functools import lru_cache
+from typing import Dict
+
+DN_CACHE_SIZE = 4096
+
+# Un attributo `tipo=valore` seguito dal separatore (o dalla fine della stringa).
+# Il valore usa la forma "unrolled" ([^...]*(?:\\.[^...]*)*) per non alternare carattere per carattere.
+_DN_ATTRIBUTE = re.compile(r'''
+    \s*
+    ([A-Za-z][A-Za-z0-9-]*|[0-9]+(?:\.[0-9]+)*)          # tipo: descr oppure OID numerico
+    \s*=\s*
+    ("[^"\\]*(?:\\.[^"\\]*)*"|[^,;+\\]*(?:\\.[^,;+\\]*)*)  # valore quotato o con escape
+    \s*
+    (?:[,;+]|$)
+''', re.VERBOSE | re.DOTALL)
+
+# Forma semplice (nessun escape, virgolette, '+' o ';'): basta un findall
+_DN_SIMPLE_ATTRIBUTE = re.compile(r'\s*([A-Za-z][A-Za-z0-9-]*|[0-9]+(?:\.[0-9]+)*)\s*=([^,]*)(?:,|$)')
+
+_DN_ESCAPE = re.compile(r'\\([0-9A-Fa-f]{2}|.)', re.DOTALL)
+
+
+def _unescape(value: str) -> str:
+    """Risolve gli escape RFC 4514; le coppie esadecimali sono byte UTF-8."""
+    if value.startswith('"') and value.endswith('"') and len(value) >= 2:
+        value = value[1:-1]
+    if '\\' not in value:
+        return value
+
+    buffer = bytearray()
+    position = 0
+    for match in _DN_ESCAPE.finditer(value):
+        buffer += value[position:match.start()].encode('utf-8')
+        escaped = match.group(1)
+        if len(escaped) == 2:
+            buffer.append(int(escaped, 16))
+        else:
+            buffer += escaped.encode('utf-8')
+        position = match.end()
+    buffer += value[position:].encode('utf-8')
+    return buffer.decode('utf-8', errors='replace')
+
+
+@lru_cache(maxsize=DN_CACHE_SIZE)
+def _parse_dn_cached(dn: str) -> Dict[str, str]:
+    if '\\' not in dn and '"' not in dn and '+' not in dn and ';' not in dn:
+        matches = list(_DN_SIMPLE_ATTRIBUTE.finditer(dn))
+        # Ogni segmento separato da virgola deve essere un attributo valido (match contigui)
+        if len(matches) == dn.count(',') + 1 and sum(len(match.group(0)) for match in matches) == len(dn):
+            attributes: Dict[str, str] = {}
+            for match in matches:
+                attribute_type, value = match.groups()
+                attributes.setdefault(attribute_type.upper(), value.strip())
+            return attributes
+    return _parse_dn_full(dn)
+
+
+def _skip_segment(dn: str, position: int) -> int:
+    """Posizione dopo il prossimo separatore `,` o `;` non escaped e fuori dalle virgolette."""
+    quoted = False
+    index = position
+    while index < len(dn):
+        char = dn[index]
+        if char == '\\':
+            index += 2
+            continue
+        if char == '"':
+            quoted = not quoted
+        elif char in ',;' and not quoted:
+            return index + 1
+        index += 1
+    return len(dn)
+
+
+def _parse_dn_full(dn: str) -> Dict[str, str]:
+    attributes: Dict[str, str] = {}
+    position = 0
+    while position < len(dn):
+        match = _DN_ATTRIBUTE.match(dn, position)
+        if match is None or match.end() == position:
+            # RDN malformato (es. "CN=Rossi, Mario" o ",,"): si salta solo quel segmento
+            position = _skip_segment(dn, position)
+            continue
+        position = match.end()
+        attribute_type, value = match.groups()
+        if value[-1:] == ' ' and value[-2:] != '\\ ':
+            # Gli spazi finali non escaped non fanno parte del valore
+            value = value.rstrip()
+        if '\\' in value or value[:1] == '"':
+            value = _unescape(value)
+        attributes.setdefault(attribute_type.upper(), value)
+    return attributes
+
+
+def parse_dn(dn: str) -> Dict[str, str]:
+    """
+    Estrae tutti gli attributi di un DN in una sola passata.
+
+    Le chiavi sono i tipi di attributo in maiuscolo (es. 'CN', 'DNQ', 'GIVENNAME');
+    se un attributo compare più volte viene mantenuta la prima occorrenza.
+
+    Args:
+        dn (str): Distinguished Name, es. "CN=Mario Rossi,DNQ=2024501530362,C=IT"
+
+    Returns:
+        dict: Attributi del DN {tipo: valore} (copia, modificabile dal chiamante)
+    """
+    return dict(_parse_dn_cached(dn))
+
+
+def clear_dn_cache() -> None:
+    """Svuota la cache dei DN già analizzati."""
+    _parse_dn_cached.cache_clear()
@@ -0,0 +1,352 @@
+"""
+Cache locale dei documenti scaricati e dei risultati di analisi.
+
+Il flusso tipico è analyze_pdf_signature_fields(link) seguito da sign_document(link):
+senza cache ogni documento viene scaricato e analizzato due volte, e i modelli più
+usati vengono rianalizzati di continuo. La cache ha due livelli:
+- disco: documenti e risultati in DOCUMENT_CACHE_DIR, con limite totale in byte (LRU)
+- memoria: copia dei documenti piccoli e dei risultati usati più di recente (LRU)
+
+I documenti sono indirizzati per contenuto (SHA-256); l'URL punta all'ultima versione
+scaricata insieme a ETag/Last-Modified, usati per rivalidare con una GET condizionale.
+I risultati di parsing/analisi sono indicizzati per SHA-256 del contenuto, quindi
+lo stesso modello servito da URL diversi viene analizzato una sola volta.
+
+La directory (anche quella di default, nella directory temporanea di sistema) viene
+creata con permessi 0700 e i file con mkstemp (0600): i documenti da firmare non
+sono leggibili dagli altri utenti dell'host.
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from app.config.setting import settings
+from app.services.private_dir import ensure_private_directory
+
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class CachedDownload:
+    """Ultima versione scaricata di un URL, con i validatori HTTP della risposta."""
+    sha256: str
+    size: int
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Header per la GET condizionale (risposta 304 se il documento non è cambiato)."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class DocumentCache:
+    """
+    Cache LRU su disco e in memoria di documenti (per URL e SHA-256) e risultati (per SHA-256).
+
+    Thread-safe: i documenti vengono scritti da un thread (anyio.to_thread) mentre
+    l'event loop legge l'indice.
+
+    Args:
+        directory (str): Directory della cache su disco (creata al primo utilizzo, permessi 0700)
+        max_disk_bytes (int): Byte massimi su disco (documenti + risultati)
+        max_memory_bytes (int): Byte massimi in memoria
+        max_urls (int): Numero massimo di URL indicizzati
+    """
+
+    def __init__(self, directory: str, max_disk_bytes: int, max_memory_bytes: int, max_urls: int = 4096):
+        self._directory = directory
+        self._max_disk_bytes = max_disk_bytes
+        self._max_memory_bytes = max_memory_bytes
+        self._max_urls = max_urls
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._urls: "OrderedDict[str, CachedDownload]" = OrderedDict()
+        # Nome file relativo -> dimensione, dal meno al più recente
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        # Nome file relativo -> (bytes o risultato, dimensione)
+        self._memory: "OrderedDict[str, Tuple[object, int]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._counters: Counter = Counter()
+
+    @staticmethod
+    def _document_name(sha256: str) -> str:
+        return os.path.join("documents", f"{sha256}.pdf")
+
+    @staticmethod
+    def _result_name(sha256: str, name: str) -> str:
+        return os.path.join("results", f"{sha256}.{name}.json")
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self._directory, name)
+
+    def _ensure_loaded(self) -> None:
+        """Crea la directory e indicizza i file rimasti da esecuzioni precedenti (chiamata con il lock)."""
+        if self._loaded:
+            return
+        existing = []
+        # Se la directory non è utilizzabile (OSError) il controllo viene ripetuto alla chiamata successiva
+        ensure_private_directory(self._directory)
+        for folder in ("documents", "results"):
+            ensure_private_directory(self._path(folder))
+            for entry in os.scandir(self._path(folder)):
+                if entry.name.endswith(".tmp"):
+                    # Scrittura interrotta
+                    os.remove(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    existing.append((stat.st_mtime, os.path.join(folder, entry.name), stat.st_size))
+        for _, name, size in sorted(existing):
+            self._disk[name] = size
+            self._disk_bytes += size
+        self._loaded = True
+        self._evict_disk()
+
+    # Livello in memoria
+
+    def _memory_get(self, name: str):
+        item = self._memory.get(name)
+        if item is None:
+            return None
+        self._memory.move_to_end(name)
+        return item[0]
+
+    def _memory_put(self, name: str, value, size: int) -> None:
+        # Un singolo elemento non può occupare più di 1/4 della memoria disponibile
+        if size > self._max_memory_bytes // 4:
+            return
+        self._memory_pop(name)
+        self._memory[name] = (value, size)
+        self._memory_bytes += size
+        while self._memory_bytes > self._max_memory_bytes:
+            _, (_, old_size) = self._memory.popitem(last=False)
+            self._memory_bytes -= old_size
+
+    def _memory_pop(self, name: str) -> None:
+        item = self._memory.pop(name, None)
+        if item is not None:
+            self._memory_bytes -= item[1]
+
+    # Livello su disco
+
+    def _disk_touch(self, name: str) -> bool:
+        if name not in self._disk:
+            return False
+        self._disk.move_to_end(name)
+        try:
+            os.utime(self._path(name))
+        except OSError:
+            # File rimosso dall'esterno: la voce non è più valida
+            self._disk_remove(name)
+            return False
+        return True
+
+    def _disk_add(self, name: str, size: int) -> None:
+        if name in self._disk:
+            self._disk_bytes -= self._disk.pop(name)
+        self._disk[name] = size
+        self._disk_bytes += size
+        self._evict_disk()
+
+    def _disk_remove(self, name: str) -> None:
+        size = self._disk.pop(name, None)
+        if size is None:
+            return
+        self._disk_bytes -= size
+        self._memory_pop(name)
+        try:
+            os.remove(self._path(name))
+        except OSError:
+            pass
+
+    def _evict_disk(self) -> None:
+        while self._disk_bytes > self._max_disk_bytes and self._disk:
+            name = next(iter(self._disk))
+            self._disk_remove(name)
+            self._counters["evictions"] += 1
+
+    # Documenti
+
+    def lookup(self, url: str) -> Optional[CachedDownload]:
+        """Ultima versione in cache dell'URL, se il documento è ancora disponibile."""
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._urls.get(url)
+            if entry is None:
+                return None
+            if self._document_name(entry.sha256) not in self._disk:
+                # Documento rimosso per spazio: anche la voce dell'URL non serve più
+                self._urls.pop(url, None)
+                return None
+            self._urls.move_to_end(url)
+            return entry
+
+    def open_document(self, sha256: str) -> Optional[BinaryIO]:
+        """
+        Apre il documento in cache (lettura binaria, da chiudere a cura del chiamante).
+
+        Returns:
+            file-like: Documento posizionato all'inizio, None se non più in cache
+        """
+        name = self._document_name(sha256)
+        with self._lock:
+            self._ensure_loaded()
+            data = self._memory_get(name)
+            if data is not None and self._disk_touch(name):
+                self._counters["document_hits"] += 1
+                return io.BytesIO(data)
+            if not self._disk_touch(name):
+                self._counters["document_misses"] += 1
+                return None
+            self._counters["document_hits"] += 1
+            size = self._disk[name]
+            if size <= self._max_memory_bytes // 4:
+                with open(self._path(name), "rb") as document:
+                    data = document.read()
+                self._memory_put(name, data, size)
+                return io.BytesIO(data)
+        return open(self._path(name), "rb")
+
+    def store_document(
+        self,
+        url: str,
+        stream: BinaryIO,
+        sha256: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None
+    ) -> None:
+        """
+        Copia il documento scaricato nella cache e associa l'URL ai suoi validatori.
+        Operazione bloccante (scrittura su disco): va eseguita in un thread.
+        Lo stream viene riportato all'inizio.
+        """
+        name = self._document_name(sha256)
+        with self._lock:
+            self._ensure_loaded()
+            self._counters["document_misses"] += 1
+            present = self._disk_touch(name)
+
+        if not present:
+            stream.seek(0)
+            handle, temp_path = tempfile.mkstemp(dir=self._path("documents"), suffix=".tmp")
+            try:
+                with os.fdopen(handle, "wb") as target:
+                    shutil.copyfileobj(stream, target, _COPY_CHUNK_SIZE)
+                os.replace(temp_path, self._path(name))
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            finally:
+                stream.seek(0)
+
+        size = os.path.getsize(self._path(name))
+        with self._lock:
+            if not present:
+                self._disk_add(name, size)
+            if name not in self._disk:
+                # Più grande dell'intera cache
+                return
+            self._urls[url] = CachedDownload(sha256, size, etag, last_modified)
+            self._urls.move_to_end(url)
+            while len(self._urls) > self._max_urls:
+                self._urls.popitem(last=False)
+
+    # Risultati di parsing/analisi
+
+    def get_result(self, sha256: str, name: str) -> Optional[dict]:
+        """Risultato `name` (es. 'signature_hints') calcolato per il documento `sha256`."""
+        file_name = self._result_name(sha256, name)
+        with self._lock:
+            self._ensure_loaded()
+            result = self._memory_get(file_name)
+            if result is not None and self._disk_touch(file_name):
+                self._counters["result_hits"] += 1
+                return json.loads(result)
+            if not self._disk_touch(file_name):
+                self._counters["result_misses"] += 1
+                return None
+            try:
+                with open(self._path(file_name), "rb") as source:
+                    result = source.read()
+            except OSError:
+                self._disk_remove(file_name)
+                self._counters["result_misses"] += 1
+                return None
+            self._counters["result_hits"] += 1
+            self._memory_put(file_name, result, len(result))
+        # Ogni chiamante riceve una copia indipendente
+        return json.loads(result)
+
+    def put_result(self, sha256: str, name: str, result: dict) -> None:
+        """Memorizza un risultato serializzabile in JSON per il documento `sha256`."""
+        file_name = self._result_name(sha256, name)
+        data = json.dumps(result, ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            self._ensure_loaded()
+            handle, temp_path = tempfile.mkstemp(dir=self._path("results"), suffix=".tmp")
+            try:
+                with os.fdopen(handle, "wb") as target:
+                    target.write(data)
+                os.replace(temp_path, self._path(file_name))
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            self._disk_add(file_name, len(data))
+            if file_name in self._disk:
+                self._memory_put(file_name, data, len(data))
+
+    # Gestione
+
+    def stats(self) -> dict:
+        """Contatori hit/miss/evictions e occupazione corrente."""
+        with self._lock:
+            return {
+                "document_hits": self._counters["document_hits"],
+                "document_misses": self._counters["document_misses"],
+                "revalidations": self._counters["revalidations"],
+                "result_hits": self._counters["result_hits"],
+                "result_misses": self._counters["result_misses"],
+                "evictions": self._counters["evictions"],
+                "disk_bytes": self._disk_bytes,
+                "memory_bytes": self._memory_bytes,
+                "urls": len(self._urls)
+            }
+
+    def record_revalidation(self) -> None:
+        """Conta una risposta 304 Not Modified (documento riusato senza riscaricarlo)."""
+        with self._lock:
+            self._counters["revalidations"] += 1
+
+    def clear(self) -> None:
+        """Svuota la cache (indice, memoria e file su disco)."""
+        with self._lock:
+            self._ensure_loaded()
+            for name in list(self._disk):
+                self._disk_remove(name)
+            self._urls.clear()
+            self._memory.clear()
+            self._memory_bytes = 0
+
+
+def _default_directory() -> str:
+    return settings.DOCUMENT_CACHE_DIR or os.path.join(tempfile.gettempdir(), "signature-mcp-cache")
+
+
+document_cache: Optional[DocumentCache] = DocumentCache(
+    directory=_default_directory(),
+    max_disk_bytes=settings.DOCUMENT_CACHE_MAX_BYTES,
+    max_memory_bytes=settings.DOCUMENT_CACHE_MEMORY_BYTES
+) if settings.DOCUMENT_CACHE_ENABLED else None
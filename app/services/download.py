@@ -0,0 +1,121 @@
+"""
+Download in streaming dei PDF da firmare o analizzare.
+
+Il documento viene letto a blocchi e scritto in un `SpooledTemporaryFile`: resta in
+memoria fino a PDF_SPOOL_THRESHOLD byte e passa automaticamente su disco oltre
+questa soglia. Il download si interrompe appena supera PDF_MAX_DOWNLOAD_BYTES,
+così una scansione enorme o un'origine bloccata non tengono occupati worker e RAM.
+I documenti con ETag/Last-Modified vengono conservati in cache (document_cache).
+La cache serve solo a velocizzare: se la sua directory non è utilizzabile (permessi,
+proprietario diverso, disco pieno) il documento viene scaricato normalmente.
+"""
+import hashlib
+import tempfile
+from typing import BinaryIO, Callable, Optional, TypeVar
+
+import anyio
+import httpx
+
+from app.config.setting import settings
+from app.services.document_cache import document_cache
+from app.services.http_client import async_http_client
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+T = TypeVar("T")
+
+
+class DocumentTooLargeError(Exception):
+    """Il documento supera la dimensione massima consentita per il download."""
+
+    def __init__(self, size: int, max_bytes: int):
+        self.size = size
+        self.max_bytes = max_bytes
+        super().__init__(f"Documento troppo grande: oltre {size} byte (massimo {max_bytes} byte)")
+
+
+def _is_cacheable(response: httpx.Response) -> bool:
+    """Solo le risposte con validatori (ETag/Last-Modified) possono essere rivalidate."""
+    if "no-store" in response.headers.get("Cache-Control", "").lower():
+        return False
+    return bool(response.headers.get("ETag") or response.headers.get("Last-Modified"))
+
+
+async def _with_cache(operation: Callable[..., T], *args) -> Optional[T]:
+    """Operazione su document_cache in un thread; None (con un avviso) se il disco della cache non è utilizzabile."""
+    try:
+        return await anyio.to_thread.run_sync(operation, *args)
+    except OSError as e:
+        print(f"Warning: cache dei documenti non disponibile, download senza cache: {str(e)}")
+        return None
+
+
+async def download_pdf(
+    url: str,
+    max_bytes: Optional[int] = None,
+    spool_threshold: Optional[int] = None
+) -> BinaryIO:
+    """
+    Scarica un documento in streaming in un file temporaneo "spooled".
+
+    Se il documento è in cache (DOCUMENT_CACHE_ENABLED) viene rivalidato con una GET
+    condizionale (If-None-Match / If-Modified-Since): con 304 Not Modified viene
+    restituita la copia locale senza riscaricarlo.
+
+    Args:
+        url (str): URL del documento
+        max_bytes (int): Dimensione massima consentita (default PDF_MAX_DOWNLOAD_BYTES)
+        spool_threshold (int): Byte oltre i quali il file passa su disco (default PDF_SPOOL_THRESHOLD)
+
+    Returns:
+        file-like: File posizionato all'inizio, da chiudere a cura del chiamante
+
+    Raises:
+        httpx.HTTPError: Errore di rete, timeout o stato HTTP non 2xx
+        DocumentTooLargeError: Il documento supera max_bytes
+    """
+    max_bytes = max_bytes or settings.PDF_MAX_DOWNLOAD_BYTES
+    timeout = httpx.Timeout(settings.PDF_DOWNLOAD_READ_TIMEOUT, connect=settings.PDF_DOWNLOAD_CONNECT_TIMEOUT)
+    cached = await _with_cache(document_cache.lookup, url) if document_cache is not None else None
+
+    while True:
+        spool = tempfile.SpooledTemporaryFile(max_size=spool_threshold or settings.PDF_SPOOL_THRESHOLD)
+        digest = hashlib.sha256()
+        headers = cached.conditional_headers() if cached is not None else {}
+        try:
+            async with async_http_client.stream("GET", url, timeout=timeout, headers=headers) as response:
+                if cached is not None and response.status_code == 304:
+                    document_cache.record_revalidation()
+                    document = await _with_cache(document_cache.open_document, cached.sha256)
+                    spool.close()
+                    if document is not None:
+                        return document
+                    # Copia locale rimossa nel frattempo: nuova richiesta senza validatori
+                    cached = None
+                    continue
+                response.raise_for_status()
+
+                # Rifiuta subito se l'origine dichiara una dimensione eccessiva
+                declared_length = response.headers.get("Content-Length")
+                if declared_length and declared_length.isdigit() and int(declared_length) > max_bytes:
+                    raise DocumentTooLargeError(int(declared_length), max_bytes)
+
+                size = 0
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise DocumentTooLargeError(size, max_bytes)
+                    spool.write(chunk)
+                    digest.update(chunk)
+
+                if document_cache is not None and _is_cacheable(response):
+                    await _with_cache(
+                        document_cache.store_document, url, spool, digest.hexdigest(),
+                        response.headers.get("ETag"), response.headers.get("Last-Modified")
+                    )
+        except BaseException:
+            spool.close()
+            raise
+
+        spool.seek(0)
+        return spool
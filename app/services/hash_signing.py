@@ -0,0 +1,287 @@
+"""
+Firma PAdES con invio del solo digest (signing_mode='hash').
+
+Nella firma classica il PDF viaggia due volte: in base64 verso Infocert e firmato
+nella risposta. Qui il documento resta locale: pyHanko aggiunge il campo firma con
+il talloncino visibile e il segnaposto /Contents, calcola il digest del ByteRange e
+solo quei 32 byte vengono inviati al firmatario remoto, che restituisce la firma
+CMS (CAdES) da inserire nel segnaposto. I byte scambiati con il servizio di firma
+non dipendono più dalla dimensione del documento.
+
+LocalHashSigner sostituisce il servizio remoto nei test offline: firma il digest con
+una chiave locale (o generata all'avvio, con certificato autofirmato). Viene usato solo
+con SIGN_HASH_ALLOW_LOCAL_SIGNER, così una configurazione di prova dimenticata non
+produce in esercizio firme senza valore.
+"""
+import base64
+import datetime
+import functools
+import io
+import tempfile
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import BinaryIO, Dict, Optional
+
+import anyio
+from asn1crypto import keys as asn1_keys, x509 as asn1_x509
+from pyhanko.pdf_utils.images import PdfImage
+from pyhanko.pdf_utils.incremental_writer import IncrementalPdfFileWriter
+from pyhanko.pdf_utils.text import TextBoxStyle
+from pyhanko.sign import fields, signers
+from pyhanko.sign.signers.pdf_byterange import PreparedByteRangeDigest
+from pyhanko.sign.signers.pdf_signer import PdfSignatureMetadata, PdfSigner, PdfTBSDocument
+from pyhanko.stamp import TextStampStyle
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+from app.config.setting import settings
+from app.services.http_client import async_http_client
+from app.services.rate_limit import SIGN
+
+# Algoritmo del digest inviato al firmatario
+DIGEST_ALGORITHM = "sha256"
+# Nome del campo firma creato quando non si usa un campo esistente
+DEFAULT_FIELD_NAME = "Signature"
+
+
+class HashSigningError(Exception):
+    """Firma del digest non riuscita o firma CMS non inseribile nel documento."""
+
+
+@dataclass
+class PreparedHashSignature:
+    """Documento con il segnaposto della firma, in attesa della firma CMS del digest."""
+    digest: bytes
+    prepared_digest: PreparedByteRangeDigest
+    output: BinaryIO
+
+    def close(self) -> None:
+        self.output.close()
+
+
+def _stamp_style(visible_text: str, signature_image: Optional[bytes]) -> TextStampStyle:
+    """Talloncino con il testo della firma sopra l'immagine PNG (se Pillow è disponibile)."""
+    background = None
+    if signature_image and PIL_AVAILABLE:
+        background = PdfImage(Image.open(io.BytesIO(signature_image)))
+    return TextStampStyle(
+        # Il testo viene interpolato da pyHanko con l'operatore %
+        stamp_text=visible_text.replace("%", "%%"),
+        text_box_style=TextBoxStyle(font_size=4),
+        background=background,
+        border_width=0
+    )
+
+
+async def prepare_hash_signature(
+    stream: BinaryIO,
+    page: int,
+    coords: Dict[str, int],
+    visible_text: str,
+    signature_image: Optional[bytes] = None,
+    existing_field: Optional[str] = None,
+    bytes_reserved: Optional[int] = None
+) -> PreparedHashSignature:
+    """
+    Aggiunge al PDF (revisione incrementale) il campo firma, il talloncino e il
+    segnaposto della firma, e calcola il digest da far firmare. La lettura del PDF
+    (struttura e xref) avviene in un thread; la scrittura della revisione e il digest
+    usano l'API asincrona di pyHanko.
+
+    Args:
+        stream (BinaryIO): PDF originale
+        page (int): Pagina (1-based) del nuovo campo firma
+        coords (dict): Rettangolo del talloncino {'llx', 'lly', 'urx', 'ury'} in spazio utente
+        visible_text (str): Testo del talloncino
+        signature_image (bytes): PNG di sfondo del talloncino
+        existing_field (str): Nome completo di un campo firma esistente da firmare (page e coords ignorati)
+        bytes_reserved (int): Byte riservati alla firma CMS (default SIGN_HASH_SIGNATURE_BYTES)
+
+    Returns:
+        PreparedHashSignature: Digest e documento preparato (in un file temporaneo)
+
+    Raises:
+        HashSigningError: Documento non modificabile (es. cifrato) o campo non firmabile
+    """
+    stream.seek(0)
+    try:
+        writer = await anyio.to_thread.run_sync(functools.partial(IncrementalPdfFileWriter, stream, strict=False))
+    except Exception as e:
+        raise HashSigningError(f"Documento non modificabile: {str(e)}") from e
+    field_spec = None
+    if existing_field is None:
+        field_spec = fields.SigFieldSpec(
+            DEFAULT_FIELD_NAME,
+            on_page=page - 1,
+            box=(coords["llx"], coords["lly"], coords["urx"], coords["ury"])
+        )
+    pdf_signer = PdfSigner(
+        PdfSignatureMetadata(
+            field_name=existing_field or DEFAULT_FIELD_NAME,
+            md_algorithm=DIGEST_ALGORITHM,
+            subfilter=fields.SigSeedSubFilter.PADES
+        ),
+        # Il firmatario vero è remoto: qui serve solo a preparare il documento
+        signers.ExternalSigner(signing_cert=None, cert_registry=None),
+        stamp_style=_stamp_style(visible_text, signature_image),
+        new_field_spec=field_spec
+    )
+    output = tempfile.SpooledTemporaryFile(max_size=settings.PDF_SPOOL_THRESHOLD)
+    try:
+        prepared_digest, _, output = await pdf_signer.async_digest_doc_for_signing(
+            writer,
+            # pyHanko misura lo spazio in cifre esadecimali: due per byte
+            bytes_reserved=2 * (bytes_reserved or settings.SIGN_HASH_SIGNATURE_BYTES),
+            output=output
+        )
+    except Exception as e:
+        output.close()
+        raise HashSigningError(f"Preparazione della firma non riuscita: {str(e)}") from e
+    return PreparedHashSignature(prepared_digest.document_digest, prepared_digest, output)
+
+
+async def finish_hash_signature(prepared: PreparedHashSignature, signature_cms: bytes) -> BinaryIO:
+    """
+    Inserisce la firma CMS nel segnaposto e restituisce il PDF firmato, posizionato
+    all'inizio.
+
+    Raises:
+        HashSigningError: Firma più grande dello spazio riservato
+    """
+    reserved = (prepared.prepared_digest.reserved_region_end - prepared.prepared_digest.reserved_region_start - 2) // 2
+    if len(signature_cms) > reserved:
+        raise HashSigningError(
+            f"Firma CMS di {len(signature_cms)} byte oltre lo spazio riservato ({reserved} byte): "
+            f"aumentare SIGN_HASH_SIGNATURE_BYTES"
+        )
+    await PdfTBSDocument.async_finish_signing(prepared.output, prepared.prepared_digest, signature_cms)
+    prepared.output.seek(0)
+    return prepared.output
+
+
+class RemoteHashSigner:
+    """
+    Firma del digest con il servizio remoto (SIGN_HASH_ENDPOINT).
+
+    Corpo della richiesta, come padesSignatures ma con il solo digest:
+    {"applicationId", "pin", "hashSignatures": [{"requestId", "hash" (base64),
+    "hashAlgorithm", "signatureLevel"}]}. La risposta contiene in signatureResult,
+    per ogni requestId, la firma CMS detached in base64 nel campo "signature".
+
+    Args:
+        url (str): URL dell'endpoint di firma del digest
+        headers (dict): Header di autorizzazione (come la firma PAdES)
+        pin (str): PIN del certificato
+        request_id (str): Identificativo della richiesta
+    """
+
+    def __init__(self, url: str, headers: dict, pin: str, request_id: str):
+        self._url = url
+        self._headers = headers
+        self._pin = pin
+        self._request_id = request_id
+
+    async def sign_digest(self, digest: bytes, digest_algorithm: str = DIGEST_ALGORITHM) -> bytes:
+        response = await async_http_client.post(self._url, headers=self._headers, json={
+            "applicationId": "trusty",
+            "pin": self._pin,
+            "hashSignatures": [{
+                "requestId": self._request_id,
+                "hash": base64.b64encode(digest).decode("ascii"),
+                "hashAlgorithm": digest_algorithm.upper(),
+                "signatureLevel": "BASELINE-B"
+            }]
+        }, upstream=SIGN)
+        response.raise_for_status()
+        results = response.json().get("signatureResult") or []
+        result = next((item for item in results if item.get("requestId") == self._request_id), None)
+        if result is None or not result.get("isOk", True) or not result.get("signature"):
+            raise HashSigningError(f"Firma del digest non restituita dal servizio: {result}")
+        return base64.b64decode(result["signature"])
+
+
+class LocalHashSigner:
+    """
+    Firmatario locale del digest, per provare la modalità 'hash' senza il servizio remoto.
+
+    Args:
+        signing_key (PrivateKeyInfo): Chiave privata
+        signing_cert (Certificate): Certificato della chiave
+    """
+
+    def __init__(self, signing_key: asn1_keys.PrivateKeyInfo, signing_cert: asn1_x509.Certificate):
+        self._signer = signers.SimpleSigner(signing_cert=signing_cert, signing_key=signing_key, cert_registry=None)
+
+    @property
+    def signing_cert(self) -> asn1_x509.Certificate:
+        return self._signer.signing_cert
+
+    @classmethod
+    def from_files(cls, key_path: str, cert_path: str) -> "LocalHashSigner":
+        """Chiave (PKCS#8, non cifrata) e certificato in formato PEM o DER."""
+        signer = signers.SimpleSigner.load(key_path, cert_path)
+        if signer is None:
+            raise HashSigningError(f"Chiave o certificato non leggibili: {key_path}, {cert_path}")
+        return cls(signer.signing_key, signer.signing_cert)
+
+    @classmethod
+    def self_signed(cls, common_name: str = "Firmatario di prova") -> "LocalHashSigner":
+        """Chiave RSA e certificato autofirmato generati al momento (validi un giorno)."""
+        from cryptography import x509
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        from cryptography.x509.oid import NameOID
+
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        certificate = (
+            x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(minutes=5))
+            .not_valid_after(now + datetime.timedelta(days=1))
+            .sign(key, hashes.SHA256())
+        )
+        return cls(
+            asn1_keys.PrivateKeyInfo.load(key.private_bytes(
+                serialization.Encoding.DER, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+            )),
+            asn1_x509.Certificate.load(certificate.public_bytes(serialization.Encoding.DER))
+        )
+
+    async def sign_digest(self, digest: bytes, digest_algorithm: str = DIGEST_ALGORITHM) -> bytes:
+        signed_data = await self._signer.async_sign(digest, digest_algorithm, use_pades=True)
+        return signed_data.dump()
+
+
+def uses_local_hash_signer() -> bool:
+    """
+    True se il digest va firmato dal firmatario locale di prova (SIGN_HASH_SIGNER=local).
+
+    Raises:
+        HashSigningError: Firmatario locale richiesto senza SIGN_HASH_ALLOW_LOCAL_SIGNER
+    """
+    if settings.SIGN_HASH_SIGNER != "local":
+        return False
+    if not settings.SIGN_HASH_ALLOW_LOCAL_SIGNER:
+        raise HashSigningError(
+            "SIGN_HASH_SIGNER=local firma con un certificato di prova ed è consentito solo "
+            "con SIGN_HASH_ALLOW_LOCAL_SIGNER=true (test/sviluppo)"
+        )
+    return True
+
+
+@lru_cache(maxsize=1)
+def local_hash_signer() -> LocalHashSigner:
+    """Firmatario locale condiviso: da SIGN_HASH_LOCAL_KEY/CERT oppure autofirmato, creato al primo utilizzo."""
+    uses_local_hash_signer()
+    if settings.SIGN_HASH_LOCAL_KEY and settings.SIGN_HASH_LOCAL_CERT:
+        return LocalHashSigner.from_files(settings.SIGN_HASH_LOCAL_KEY, settings.SIGN_HASH_LOCAL_CERT)
+    return LocalHashSigner.self_signed()
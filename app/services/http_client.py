@@ -0,0 +1,179 @@
+"""
+Client HTTP condivisi per tutte le chiamate verso Infocert e verso le origini dei PDF.
+
+Ogni host (SIGNATURE_API, AUTHORIZATION_API, origini dei documenti) ha il proprio
+pool di connessioni keep-alive: le chiamate successive riusano la connessione
+TCP/TLS già aperta invece di rifare l'handshake ad ogni tool call.
+
+- `async_http_client`: client asincrono (httpx, HTTP/2 se disponibile) usato dai tool MCP
+- `http_client`: client sincrono (requests), usato solo da remote_pdf
+
+I pool sono due perché remote_pdf non può usare il client asincrono: RemotePdfFile è
+un file che pdfminer e pyHanko leggono con read()/seek() sincroni dai thread di analisi,
+e ogni blocco mancante va scaricato dentro quella read(). Da un thread il client httpx
+asincrono si userebbe solo rientrando nell'event loop (anyio.from_thread) a ogni blocco:
+ogni lettura del parser resterebbe in attesa del loop condiviso con tutti i tool. Il
+client sincrono ha un pool proprio e non passa dal limitatore, perché le origini dei
+documenti non sono upstream Infocert.
+
+Le chiamate asincrone verso Infocert indicano il proprio upstream (`upstream=`) e
+passano dal limitatore di rate_limit (token bucket e richieste in corso).
+"""
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.config.setting import settings
+from app.services.rate_limit import retry_after_seconds, upstream_slot
+try:
+    import h2  # noqa: F401  # type: ignore
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class PooledHttpClient:
+    """
+    Wrapper attorno a una `requests.Session` con pool per host e timeout di default,
+    per le letture sincrone di remote_pdf (vedi il docstring del modulo).
+
+    Args:
+        pool_connections (int): Numero di host per cui mantenere un pool dedicato
+        pool_maxsize (int): Numero massimo di connessioni keep-alive per host
+        connect_timeout (float): Timeout di connessione di default (secondi)
+        read_timeout (float): Timeout di lettura di default (secondi)
+    """
+
+    def __init__(
+        self,
+        pool_connections: int,
+        pool_maxsize: int,
+        connect_timeout: float,
+        read_timeout: float
+    ):
+        self.default_timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=False
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method: str, url: str, timeout: Optional[object] = None, **kwargs) -> requests.Response:
+        """Esegue una richiesta sul pool condiviso applicando il timeout di default."""
+        return self.session.request(
+            method,
+            url,
+            timeout=timeout if timeout is not None else self.default_timeout,
+            **kwargs
+        )
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncPooledHttpClient:
+    """
+    Wrapper attorno a un `httpx.AsyncClient` condiviso, usato dai tool asincroni.
+
+    Le richieste non bloccano l'event loop del server SSE, quindi un solo worker
+    può avere molte firme in corso contemporaneamente. HTTP/2 viene negoziato
+    (ALPN) quando il pacchetto `h2` è installato e l'upstream lo supporta.
+
+    Args:
+        max_connections (int): Numero massimo di connessioni aperte in totale
+        max_keepalive_connections (int): Connessioni keep-alive mantenute nel pool
+        connect_timeout (float): Timeout di connessione di default (secondi)
+        read_timeout (float): Timeout di lettura di default (secondi)
+        http2 (bool): Abilita HTTP/2 se disponibile
+    """
+
+    def __init__(
+        self,
+        max_connections: int,
+        max_keepalive_connections: int,
+        connect_timeout: float,
+        read_timeout: float,
+        http2: bool = True
+    ):
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.client = httpx.AsyncClient(
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            # Stesso comportamento di requests sui redirect dei link ai PDF
+            follow_redirects=True
+        )
+
+    async def request(self, method: str, url: str, upstream: Optional[str] = None, **kwargs) -> httpx.Response:
+        """
+        Esegue una richiesta sul pool condiviso (timeout di default del client).
+
+        Con `upstream` la richiesta attende il proprio posto nel limitatore; dopo un 429
+        viene ripetuta se il Retry-After rientra in RATE_LIMIT_MAX_WAIT, altrimenti la
+        risposta 429 viene restituita al chiamante.
+        """
+        deadline = time.monotonic() + settings.RATE_LIMIT_MAX_WAIT
+        while True:
+            async with upstream_slot(upstream, max(0.0, deadline - time.monotonic())) as limiter:
+                response = await self.client.request(method, url, **kwargs)
+            if limiter is None or response.status_code != 429:
+                return response
+            retry_after = retry_after_seconds(response)
+            limiter.throttle(retry_after)
+            if time.monotonic() + retry_after >= deadline:
+                return response
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, upstream: Optional[str] = None, **kwargs) -> AsyncIterator[httpx.Response]:
+        """
+        Richiesta con risposta letta a blocchi (`async with ... as response`). Il posto
+        nel limitatore resta occupato fino alla chiusura della risposta; un 429 sospende
+        l'upstream ma non viene ripetuto (il corpo in streaming non è riutilizzabile).
+        """
+        async with upstream_slot(upstream) as limiter:
+            async with self.client.stream(method, url, **kwargs) as response:
+                if limiter is not None and response.status_code == 429:
+                    limiter.throttle(retry_after_seconds(response))
+                yield response
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+http_client = PooledHttpClient(
+    pool_connections=settings.HTTP_POOL_CONNECTIONS,
+    pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+    connect_timeout=settings.HTTP_CONNECT_TIMEOUT,
+    read_timeout=settings.HTTP_READ_TIMEOUT
+)
+
+async_http_client = AsyncPooledHttpClient(
+    max_connections=settings.HTTP_POOL_CONNECTIONS * settings.HTTP_POOL_MAXSIZE,
+    max_keepalive_connections=settings.HTTP_POOL_CONNECTIONS * settings.HTTP_POOL_MAXSIZE,
+    connect_timeout=settings.HTTP_CONNECT_TIMEOUT,
+    read_timeout=settings.HTTP_READ_TIMEOUT,
+    http2=settings.HTTP2_ENABLED
+)
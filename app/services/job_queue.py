@@ -0,0 +1,201 @@
+"""
+Coda dei job di firma eseguiti in background.
+
+sign_document scarica, firma e carica il documento dentro una sola chiamata del
+tool: con documenti grandi il client MCP va in timeout e i picchi di richieste
+arrivano tutti insieme a Infocert. Con la coda il tool di invio restituisce subito
+l'id del job; un numero fisso di worker esegue la stessa pipeline e lo stato si
+legge con un secondo tool. Quando i job in attesa raggiungono il limite la coda
+rifiuta i nuovi invii (JobQueueFullError) invece di accumulare lavoro: il client
+riprova più tardi.
+
+I job vivono nella memoria del processo (uno stesso server MCP): i risultati
+restano consultabili per `result_ttl` secondi dalla fine del job.
+"""
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# Stati di un job
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINAL_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobQueueFullError(Exception):
+    """Troppi job in attesa: il nuovo job non viene accettato."""
+
+    def __init__(self, max_queued: int):
+        self.max_queued = max_queued
+        super().__init__(f"Coda dei job piena ({max_queued} job in attesa): riprovare più tardi")
+
+
+@dataclass
+class Job:
+    """Job di firma: stato, tempi (time.time()) e risultato del tool eseguito."""
+    id: str
+    description: str
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    _run: Optional[Callable[[], Awaitable[dict]]] = field(default=None, repr=False)
+    _task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "description": self.description,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error
+        }
+
+
+class JobQueue:
+    """
+    Coda FIFO con un pool limitato di worker asyncio, avviati al primo invio.
+
+    Args:
+        workers (int): Job eseguiti contemporaneamente
+        max_queued (int): Job in attesa oltre i quali submit rifiuta i nuovi job
+        result_ttl (int): Secondi per cui un job concluso resta consultabile
+        failed (callable): Dice se il risultato di un job indica un errore (es. {"type": "error"})
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        max_queued: int = 100,
+        result_ttl: int = 3600,
+        failed: Callable[[dict], bool] = lambda result: False
+    ):
+        self._workers = max(1, workers)
+        self._max_queued = max(1, max_queued)
+        self._result_ttl = result_ttl
+        self._failed = failed
+        self._jobs: Dict[str, Job] = {}
+        self._pending: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+
+    @property
+    def queued(self) -> int:
+        """Job in attesa di un worker."""
+        return sum(1 for job in self._jobs.values() if job.status == QUEUED)
+
+    @property
+    def running(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == RUNNING)
+
+    def submit(self, run: Callable[[], Awaitable[dict]], description: str = "") -> Job:
+        """
+        Accoda un job; `run` viene chiamata da un worker e il dizionario restituito
+        diventa il risultato del job.
+
+        Raises:
+            JobQueueFullError: Già `max_queued` job in attesa
+        """
+        self._purge()
+        if self.queued >= self._max_queued:
+            raise JobQueueFullError(self._max_queued)
+        self._start_workers()
+        job = Job(id=uuid.uuid4().hex, description=description, _run=run)
+        self._jobs[job.id] = job
+        self._pending.put_nowait(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._purge()
+        return self._jobs.get(job_id)
+
+    def position(self, job: Job) -> int:
+        """Posizione (1-based) di un job in attesa, 0 se non è in attesa."""
+        if job.status != QUEUED:
+            return 0
+        waiting = [item for item in self._jobs.values() if item.status == QUEUED]
+        return waiting.index(job) + 1
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Annulla un job: se è in attesa non verrà eseguito, se è in esecuzione il task
+        viene cancellato. I job già conclusi restano invariati.
+        """
+        job = self.get(job_id)
+        if job is None or job.status in FINAL_STATES:
+            return job
+        if job.status == RUNNING and job._task is not None:
+            job._task.cancel()
+        self._finish(job, CANCELLED, error="Job annullato")
+        return job
+
+    def _start_workers(self) -> None:
+        if self._pending is None:
+            self._pending = asyncio.Queue()
+        self._worker_tasks = [task for task in self._worker_tasks if not task.done()]
+        while len(self._worker_tasks) < self._workers:
+            self._worker_tasks.append(asyncio.get_running_loop().create_task(self._worker()))
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._pending.get()
+            try:
+                if job.status != QUEUED:
+                    # Annullato mentre era in attesa
+                    continue
+                await self._execute(job)
+            finally:
+                self._pending.task_done()
+
+    async def _execute(self, job: Job) -> None:
+        job.status = RUNNING
+        job.started_at = time.time()
+        task = job._task = asyncio.get_running_loop().create_task(job._run())
+        try:
+            # wait() non propaga la cancellazione del job (cancel_signing_job), solo quella del worker
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            # Cancellato il worker stesso (arresto del server): interrompe anche il job
+            task.cancel()
+            if job.status not in FINAL_STATES:
+                self._finish(job, CANCELLED, error="Job interrotto")
+            raise
+        if job.status in FINAL_STATES:
+            # Annullato con cancel() durante l'esecuzione
+            return
+        if task.cancelled():
+            self._finish(job, CANCELLED, error="Job interrotto")
+        elif task.exception() is not None:
+            self._finish(job, FAILED, error=str(task.exception()))
+        else:
+            result = task.result()
+            self._finish(job, FAILED if self._failed(result) else SUCCEEDED, result=result)
+
+    def _finish(self, job: Job, status: str, result: Optional[dict] = None, error: Optional[str] = None) -> None:
+        job.status = status
+        job.finished_at = time.time()
+        job.result = result
+        job.error = error
+        # Non serve più: libera la chiusura con i parametri della firma (token, PIN)
+        job._run = None
+        job._task = None
+
+    def _purge(self) -> None:
+        """Rimuove i job conclusi da più di result_ttl secondi."""
+        limit = time.time() - self._result_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.status in FINAL_STATES and job.finished_at is not None and job.finished_at < limit
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
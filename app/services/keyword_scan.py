@@ -0,0 +1,310 @@
+"""
+Ricerca in una sola passata delle parole chiave di firma nelle parole di una pagina.
+
+Le parole di ogni pagina vengono estratte una sola volta (dai caratteri del layout
+pdfminer, vedi extract_page_words) e unite in un testo minuscolo con gli offset di ogni parola; un automa
+Aho-Corasick trova in un'unica scansione tutte le occorrenze di keyword e pattern
+di linea (anche sovrapposte, es. 'firma' e 'firma:', o su più parole come 'sign here').
+Ogni occorrenza viene ricondotta alle parole che copre, da cui il bounding box esatto.
+"""
+import time
+from bisect import bisect_right
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+SIGNATURE_KEYWORDS = ["firma", "signature", "sottoscritto", "firmatario", "sign here", "sign:", "firma:"]
+LINE_PATTERNS = ["_____", ".....", "-----"]
+
+
+class AhoCorasick:
+    """
+    Automa Aho-Corasick per la ricerca simultanea di più pattern.
+
+    Args:
+        patterns (list): Pattern da cercare (confronto esatto: normalizzare prima il testo)
+    """
+
+    def __init__(self, patterns: Sequence[str]):
+        self.patterns = list(patterns)
+        # Per ogni stato: transizioni, stato di fallimento, pattern che terminano qui
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(index)
+
+        # Visita in ampiezza: il fallimento di ogni stato è già noto per i livelli precedenti
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                candidate = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = candidate if candidate != next_state else 0
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """Restituisce (inizio, fine, indice del pattern) di ogni occorrenza, sovrapposte incluse."""
+        goto, fail, output, patterns = self._goto, self._fail, self._output, self.patterns
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                yield position + 1 - len(patterns[index]), position + 1, index
+
+
+_SIGNATURE_MATCHER = AhoCorasick(SIGNATURE_KEYWORDS + LINE_PATTERNS)
+
+# Tolleranze di raggruppamento dei caratteri in parole (default di pdfplumber)
+WORD_X_TOLERANCE = 3
+WORD_Y_TOLERANCE = 3
+
+
+def _iter_layout_chars(objects) -> Iterator:
+    for item in objects:
+        children = getattr(item, "_objs", None)
+        if children is not None:
+            # LTFigure e altri contenitori
+            yield from _iter_layout_chars(children)
+        elif hasattr(item, "fontname"):
+            yield item
+
+
+def extract_page_words(page) -> List[dict]:
+    """
+    Parole di una pagina pdfplumber, costruite direttamente dai caratteri del layout pdfminer.
+
+    Stesso raggruppamento di `page.extract_words()` con le tolleranze di default (salvo
+    rari casi come apici e pedici attaccati alla parola), ma evita la conversione
+    di ogni carattere in dizionario (`page.chars`), che è la parte più costosa dell'analisi.
+    Le pagine con testo ruotato usano direttamente `page.extract_words()`.
+
+    Returns:
+        list: Parole {text, x0, x1, top, bottom} in ordine di lettura (righe dall'alto, poi x)
+    """
+    height = page.height
+    words: List[dict] = []
+    current: List = []
+
+    def flush() -> None:
+        if current:
+            words.append({
+                "text": "".join(char.get_text() for char in current),
+                "x0": min(char.x0 for char in current),
+                "x1": max(char.x1 for char in current),
+                "top": height - max(char.y1 for char in current),
+                "bottom": height - min(char.y0 for char in current)
+            })
+            current.clear()
+
+    for char in _iter_layout_chars(page.layout._objs):
+        if not char.upright:
+            # Testo ruotato: raggruppamento per colonne gestito da pdfplumber
+            return page.extract_words()
+        if char.get_text().isspace():
+            flush()
+            continue
+        if current:
+            last = current[-1]
+            if (
+                abs(char.y1 - last.y1) > WORD_Y_TOLERANCE
+                or char.x0 - last.x1 > WORD_X_TOLERANCE
+                or char.x0 < last.x0
+            ):
+                flush()
+        current.append(char)
+    flush()
+
+    # Ordine di lettura: righe raggruppate per `top`, poi da sinistra a destra
+    words.sort(key=lambda word: word["top"])
+    lines: List[List[dict]] = []
+    for word in words:
+        if lines and word["top"] - lines[-1][0]["top"] <= WORD_Y_TOLERANCE:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return [word for line in lines for word in sorted(line, key=lambda word: word["x0"])]
+
+
+def _vertical_position(top: float, page_height: float) -> str:
+    """Classifica la posizione verticale (top/middle/bottom) come nell'analisi originale."""
+    if top < page_height / 3:
+        return "top"
+    if top > 2 * page_height / 3:
+        return "bottom"
+    return "middle"
+
+
+def scan_page_words(words: List[dict], page_number: int, page_height: float) -> List[dict]:
+    """
+    Trova keyword di firma e pattern di linea nelle parole di una pagina.
+
+    Per ogni keyword viene restituita la prima occorrenza della pagina (nell'ordine di
+    SIGNATURE_KEYWORDS), poi il primo pattern di linea trovato (nell'ordine di LINE_PATTERNS).
+
+    Args:
+        words (list): Parole di `page.extract_words()` (text, x0, x1, top, bottom)
+        page_number (int): Numero della pagina (1-based)
+        page_height (float): Altezza della pagina in punti
+
+    Returns:
+        list: text_hints della pagina, con bbox {x0, top, x1, bottom} in punti
+              (origine in alto a sinistra, come pdfplumber)
+    """
+    if not words:
+        return []
+
+    # Testo della pagina: parole minuscole separate da uno spazio, con l'offset iniziale di ciascuna
+    starts: List[int] = []
+    parts: List[str] = []
+    offset = 0
+    for word in words:
+        starts.append(offset)
+        parts.append(word["text"].lower())
+        offset += len(parts[-1]) + 1
+    text = " ".join(parts)
+
+    first_match: Dict[int, Tuple[int, int]] = {}
+    for start, end, index in _SIGNATURE_MATCHER.finditer(text):
+        if index not in first_match:
+            first_match[index] = (start, end)
+
+    hints: List[dict] = []
+    keyword_count = len(SIGNATURE_KEYWORDS)
+    matched_keywords = [index for index in range(keyword_count) if index in first_match]
+    # Un solo pattern di linea per pagina: il primo nell'ordine di LINE_PATTERNS
+    matched_lines = [
+        index for index in range(keyword_count, len(_SIGNATURE_MATCHER.patterns)) if index in first_match
+    ][:1]
+    for index in matched_keywords + matched_lines:
+        start, end = first_match[index]
+        first_word = bisect_right(starts, start) - 1
+        last_word = bisect_right(starts, end - 1) - 1
+        covered = words[first_word:last_word + 1]
+        matched_text = " ".join(word["text"] for word in covered)
+        bbox = {
+            "x0": round(min(word["x0"] for word in covered), 2),
+            "top": round(min(word["top"] for word in covered), 2),
+            "x1": round(max(word["x1"] for word in covered), 2),
+            "bottom": round(max(word["bottom"] for word in covered), 2)
+        }
+        position = _vertical_position(bbox["top"], page_height)
+
+        if index < keyword_count:
+            hints.append({
+                "keyword": SIGNATURE_KEYWORDS[index],
+                "page": page_number,
+                "text": matched_text,
+                "position": position,
+                "bbox": bbox,
+                "description": f"Trovato '{matched_text}' a pagina {page_number} ({position})"
+            })
+        else:
+            pattern = _SIGNATURE_MATCHER.patterns[index]
+            hints.append({
+                "keyword": "line_pattern",
+                "page": page_number,
+                "text": pattern,
+                "position": position,
+                "bbox": bbox,
+                "description": f"Trovato pattern linea '{pattern}' a pagina {page_number} ({position})"
+            })
+    return hints
+
+
+def scan_pdf_pages(pdf) -> List[dict]:
+    """
+    text_hints di tutte le pagine di un documento pdfplumber, in ordine di pagina.
+    Ogni pagina viene liberata subito dopo l'analisi (documenti da centinaia di pagine).
+    """
+    hints: List[dict] = []
+    for page in pdf.pages:
+        hints.extend(scan_page_words(extract_page_words(page), page.page_number, page.height))
+        page.close()
+    return hints
+
+
+def scan_pdf_file(path: str, page_numbers: List[int]) -> List[dict]:
+    """
+    Analizza solo le pagine `page_numbers` (1-based) del PDF in `path`.
+    Eseguita nei processi di PageAnalysisPool: apre il file in modo indipendente.
+    """
+    import pdfplumber
+
+    with pdfplumber.open(path, pages=page_numbers) as pdf:
+        return scan_pdf_pages(pdf)
+
+
+# Etichette che da sole indicano un blocco firma (non semplici menzioni nel testo)
+CONFIDENT_KEYWORDS = {"firma:", "sign here", "sign:"}
+
+
+def priority_page_order(page_count: int, last_pages: int = 2) -> List[int]:
+    """
+    Pagine (1-based) nell'ordine in cui è più probabile trovare il blocco firma:
+    le ultime `last_pages` pagine, la prima pagina, poi le restanti dalla fine verso l'inizio.
+    """
+    last = list(range(page_count, max(page_count - last_pages, 0), -1))
+    first = [1] if page_count > last_pages else []
+    rest = list(range(page_count - last_pages, 1, -1))
+    return last + first + rest
+
+
+def is_confident_signature_page(hints: List[dict]) -> bool:
+    """True se i hint di una pagina indicano con buona sicurezza un blocco firma."""
+    keywords = {hint["keyword"] for hint in hints}
+    if keywords & CONFIDENT_KEYWORDS:
+        return True
+    # Una keyword di firma sulla stessa pagina di una linea da compilare
+    return "line_pattern" in keywords and len(keywords) > 1
+
+
+def scan_pdf_pages_priority(
+    get_page: Callable[[int], object],
+    page_count: int,
+    max_pages: int,
+    deadline: float,
+    last_pages: int = 2
+) -> Tuple[List[dict], List[int]]:
+    """
+    Analizza le pagine in ordine di priorità (priority_page_order) fermandosi alla prima
+    pagina con un blocco firma affidabile, dopo `max_pages` pagine o oltre `deadline`
+    (valore di time.monotonic()). Almeno una pagina viene sempre analizzata.
+
+    Args:
+        get_page (callable): Pagina pdfplumber dal numero 1-based (es. PdfDocument.plumber_page),
+                             così vengono lette solo le pagine visitate
+        page_count (int): Numero di pagine del documento
+
+    Returns:
+        tuple: (text_hints in ordine di visita, pagine effettivamente analizzate)
+    """
+    hints: List[dict] = []
+    scanned: List[int] = []
+    for page_number in priority_page_order(page_count, last_pages)[:max(1, max_pages)]:
+        if scanned and time.monotonic() >= deadline:
+            break
+        page = get_page(page_number)
+        page_hints = scan_page_words(extract_page_words(page), page_number, page.height)
+        page.close()
+        hints.extend(page_hints)
+        scanned.append(page_number)
+        if is_confident_signature_page(page_hints):
+            break
+    return hints, scanned
@@ -0,0 +1,304 @@
+"""
+Ricerca delle linee di firma dalla sola geometria della pagina.
+
+Molti modelli indicano il punto di firma con una linea disegnata (segmento o
+rettangolo sottile). Per trovarle non serve il layout del testo: basta leggere gli
+operatori grafici dei content stream (cm, q/Q, m/l/re/h e gli operatori di disegno),
+seguendo anche i Form XObject. Il testo viene solo tokenizzato e scartato, senza
+caricare font né calcolare la posizione dei caratteri, quindi l'analisi costa una
+frazione di quella di extract_page_words.
+
+Ogni linea candidata viene restituita con le coordinate del talloncino appoggiato
+sopra la linea, nel formato di custom_coords (spazio utente PDF, origine in basso a sinistra).
+Sulle pagine con /Rotate 90, 180 o 270 le linee vengono cercate nella pagina come viene
+visualizzata (una linea orizzontale per chi legge è verticale nello spazio utente) e il
+talloncino viene riportato nello spazio utente con la rotazione inversa, come in _place_on_page.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    from pdfminer.pdftypes import PDFStream, resolve1
+    from pdfminer.psparser import PSEOF, PSKeyword, keyword_name, literal_name
+    from pdfminer.pdfinterp import PDFContentParser
+    from pdfminer.utils import MATRIX_IDENTITY, apply_matrix_pt, mult_matrix
+    PDFMINER_AVAILABLE = True
+except ImportError:
+    PDFMINER_AVAILABLE = False
+
+from app.services.pdf_document import PageBox, PdfDocument
+
+# Dimensioni del talloncino (come get_signature_position)
+SIGNATURE_WIDTH = 80
+SIGNATURE_HEIGHT = 30
+# Larghezza massima del talloncino sulle linee lunghe (allineato all'inizio della linea)
+MAX_SIGNATURE_BOX_WIDTH = 240
+
+# Spessore massimo di un rettangolo pieno per essere considerato una linea
+MAX_RULE_THICKNESS = 3.0
+# Scarto verticale massimo tra gli estremi di un segmento orizzontale
+HORIZONTAL_TOLERANCE = 1.0
+# Le linee più lunghe di questa frazione della pagina sono separatori, non spazi per la firma
+MAX_LINE_PAGE_RATIO = 0.75
+# Candidati massimi per pagina (dal basso verso l'alto)
+MAX_CANDIDATES_PER_PAGE = 5
+# Profondità massima di Form XObject annidati
+MAX_FORM_DEPTH = 8
+
+Point = Tuple[float, float]
+Line = Tuple[float, float, float]  # (x0, x1, y)
+
+_STROKE_OPERATORS = {"S", "s", "B", "B*", "b", "b*"}
+_FILL_OPERATORS = {"f", "F", "f*", "B", "B*", "b", "b*"}
+_CLOSE_OPERATORS = {"s", "b", "b*"}
+
+
+def _numbers(args: Sequence, count: int) -> Optional[List[float]]:
+    """Ultimi `count` operandi numerici, None se mancano o non sono numeri."""
+    if len(args) < count:
+        return None
+    values = args[-count:]
+    if not all(isinstance(value, (int, float)) for value in values):
+        return None
+    return [float(value) for value in values]
+
+
+def _horizontal_segment(start: Point, end: Point) -> Optional[Line]:
+    if abs(start[1] - end[1]) > HORIZONTAL_TOLERANCE:
+        return None
+    return (min(start[0], end[0]), max(start[0], end[0]), (start[1] + end[1]) / 2)
+
+
+def _thin_box(points: List[Point]) -> Optional[Line]:
+    """Linea rappresentata da un sottotracciato pieno e sottile (es. 're' alto 0.5 pt)."""
+    xs = [point[0] for point in points]
+    ys = [point[1] for point in points]
+    if max(ys) - min(ys) > MAX_RULE_THICKNESS:
+        return None
+    return (min(xs), max(xs), (min(ys) + max(ys)) / 2)
+
+
+def _collect_lines(
+    streams: Sequence,
+    resources: dict,
+    ctm: Tuple[float, ...],
+    lines: List[Line],
+    depth: int = 0
+) -> None:
+    """Interpreta solo gli operatori grafici di `streams` e aggiunge a `lines` le linee orizzontali disegnate."""
+    try:
+        parser = PDFContentParser(list(streams))
+    except PSEOF:
+        return
+    xobjects = resolve1((resources or {}).get("XObject")) or {}
+
+    saved: List[Tuple[float, ...]] = []
+    operands: List = []
+    # Sottotracciati del path corrente in coordinate utente: (punti, è un rettangolo 're')
+    subpaths: List[Tuple[List[Point], bool]] = []
+    current: Optional[List[Point]] = None
+
+    while True:
+        try:
+            _, token = parser.nextobject()
+        except PSEOF:
+            break
+        if not isinstance(token, PSKeyword):
+            operands.append(token)
+            continue
+        operator = keyword_name(token)
+        args, operands = operands, []
+
+        if operator == "q":
+            saved.append(ctm)
+        elif operator == "Q":
+            if saved:
+                ctm = saved.pop()
+        elif operator == "cm":
+            matrix = _numbers(args, 6)
+            if matrix is not None:
+                ctm = mult_matrix(tuple(matrix), ctm)
+        elif operator == "m":
+            point = _numbers(args, 2)
+            if point is not None:
+                current = [apply_matrix_pt(ctm, tuple(point))]
+                subpaths.append((current, False))
+        elif operator == "l":
+            point = _numbers(args, 2)
+            if point is not None and current is not None:
+                current.append(apply_matrix_pt(ctm, tuple(point)))
+        elif operator in ("c", "v", "y"):
+            # Le curve non sono linee: il sottotracciato non viene più considerato
+            if current is not None:
+                subpaths.pop()
+                current = None
+        elif operator == "re":
+            rect = _numbers(args, 4)
+            if rect is not None:
+                x, y, width, height = rect
+                corners = [(x, y), (x + width, y), (x + width, y + height), (x, y + height)]
+                subpaths.append(([apply_matrix_pt(ctm, corner) for corner in corners], True))
+                current = None
+        elif operator == "h":
+            if current is not None and len(current) > 1:
+                current.append(current[0])
+        elif operator in _STROKE_OPERATORS or operator in _FILL_OPERATORS or operator == "n":
+            for points, is_rect in subpaths:
+                if operator in _CLOSE_OPERATORS and not is_rect and len(points) > 2:
+                    points = points + [points[0]]
+                line = None
+                if operator in _FILL_OPERATORS or is_rect:
+                    # Rettangoli (pieni o contornati) e poligoni pieni: contano se sottili
+                    line = _thin_box(points) if len(points) > 1 else None
+                if line is not None and operator != "n":
+                    lines.append(line)
+                elif operator in _STROKE_OPERATORS and not is_rect:
+                    for start, end in zip(points, points[1:]):
+                        segment = _horizontal_segment(start, end)
+                        if segment is not None:
+                            lines.append(segment)
+            subpaths = []
+            current = None
+        elif operator == "Do" and depth < MAX_FORM_DEPTH and args:
+            xobject = resolve1(xobjects.get(literal_name(args[-1])))
+            if isinstance(xobject, PDFStream) and literal_name(xobject.get("Subtype")) == "Form":
+                matrix = resolve1(xobject.get("Matrix")) or MATRIX_IDENTITY
+                form_resources = resolve1(xobject.get("Resources")) or resources
+                _collect_lines(
+                    [xobject], form_resources,
+                    mult_matrix(tuple(float(resolve1(value)) for value in matrix), ctm),
+                    lines, depth + 1
+                )
+
+
+def _visible_page(page_box: PageBox) -> Tuple[Tuple[float, ...], PageBox]:
+    """
+    Matrice dallo spazio utente alla pagina visualizzata e geometria visualizzata
+    (origine nell'angolo in basso a sinistra del CropBox ruotato). Senza /Rotate lo
+    spazio utente resta invariato.
+    """
+    left, bottom, right, top = page_box.crop_box
+    # /Rotate ruota la pagina visualizzata in senso orario
+    if page_box.rotate == 90:
+        matrix, size = (0.0, -1.0, 1.0, 0.0, -bottom, right), (page_box.height, page_box.width)
+    elif page_box.rotate == 180:
+        matrix, size = (-1.0, 0.0, 0.0, -1.0, right, top), (page_box.width, page_box.height)
+    elif page_box.rotate == 270:
+        matrix, size = (0.0, 1.0, -1.0, 0.0, top, -left), (page_box.height, page_box.width)
+    else:
+        return MATRIX_IDENTITY, page_box
+    visible_box = (0.0, 0.0) + size
+    return matrix, PageBox(visible_box, visible_box)
+
+
+def _to_user_space(u: float, v: float, page_box: PageBox) -> Tuple[float, float]:
+    """Punto della pagina visualizzata riportato nello spazio utente (inversa di _visible_page)."""
+    left, bottom, right, top = page_box.crop_box
+    if page_box.rotate == 90:
+        return right - v, bottom + u
+    if page_box.rotate == 180:
+        return right - u, top - v
+    if page_box.rotate == 270:
+        return left + v, top - u
+    return u, v
+
+
+def _vertical_position(y: float, page_box: PageBox) -> str:
+    """Posizione verticale (top/middle/bottom) come nei text_hints."""
+    bottom = page_box.crop_box[1]
+    if y < bottom + page_box.height / 3:
+        return "bottom"
+    if y > bottom + 2 * page_box.height / 3:
+        return "top"
+    return "middle"
+
+
+def _signature_box(line: Line, page_box: PageBox) -> Dict[str, int]:
+    """
+    Talloncino appoggiato sopra la linea, dentro il CropBox: centrato sulle linee più
+    corte di SIGNATURE_WIDTH, altrimenti dall'inizio della linea (al massimo MAX_SIGNATURE_BOX_WIDTH).
+    La linea è nella pagina visualizzata (vedi detect_page_lines), il talloncino in spazio utente.
+    """
+    x0, x1, y = line
+    _, visible_box = _visible_page(page_box)
+    left, bottom, right, top = visible_box.crop_box
+    length = x1 - x0
+    width = min(max(length, SIGNATURE_WIDTH), MAX_SIGNATURE_BOX_WIDTH)
+    start = x0 if length >= SIGNATURE_WIDTH else (x0 + x1 - width) / 2
+    llx = min(max(start, left), right - width)
+    lly = min(max(y + 1, bottom), top - SIGNATURE_HEIGHT)
+    if visible_box is not page_box:
+        ux0, uy0 = _to_user_space(llx, lly, page_box)
+        ux1, uy1 = _to_user_space(llx + width, lly + SIGNATURE_HEIGHT, page_box)
+        return {
+            "llx": round(min(ux0, ux1)),
+            "lly": round(min(uy0, uy1)),
+            "urx": round(max(ux0, ux1)),
+            "ury": round(max(uy0, uy1))
+        }
+    return {
+        "llx": round(llx),
+        "lly": round(lly),
+        "urx": round(llx + width),
+        "ury": round(lly + SIGNATURE_HEIGHT)
+    }
+
+
+def detect_page_lines(page, page_box: PageBox, min_length: float = 60.0) -> List[Line]:
+    """
+    Linee orizzontali candidate di una pagina pdfminer (PDFPage), dal basso verso l'alto.
+
+    Args:
+        page: PDFPage di pdfminer (es. `pdfplumber_page.page_obj`)
+        page_box (PageBox): Geometria della pagina
+        min_length (float): Lunghezza minima della linea in punti
+
+    Returns:
+        list: (x0, x1, y) senza duplicati, nella pagina come viene visualizzata: in spazio
+              utente PDF se la pagina non ha /Rotate, altrimenti con origine nell'angolo in
+              basso a sinistra della pagina ruotata
+    """
+    matrix, visible_box = _visible_page(page_box)
+    lines: List[Line] = []
+    _collect_lines(page.contents, page.resources, matrix, lines)
+
+    max_length = visible_box.width * MAX_LINE_PAGE_RATIO
+    left, bottom, right, top = visible_box.crop_box
+    unique: Dict[Tuple[int, int, int], Line] = {}
+    for x0, x1, y in lines:
+        if not (min_length <= x1 - x0 <= max_length and bottom <= y <= top and x1 > left and x0 < right):
+            continue
+        # La stessa linea disegnata più volte (es. contorno e riempimento) conta una volta
+        unique.setdefault((round(x0), round(x1), round(y)), (x0, x1, y))
+    return sorted(unique.values(), key=lambda line: (line[2], line[0]))[:MAX_CANDIDATES_PER_PAGE]
+
+
+def detect_signature_lines(document: PdfDocument, min_length: float = 60.0) -> List[dict]:
+    """
+    Linee di firma candidate di tutte le pagine, senza estrazione del testo.
+    Funzione bloccante: va eseguita in un thread.
+
+    Returns:
+        list: Candidati {page, line, coords, position, description}; `coords` si può
+              passare direttamente come custom_coords con signature_position='custom'
+              (`line` è nella pagina visualizzata, vedi detect_page_lines)
+    """
+    pdf = document.plumber
+    if pdf is None or not PDFMINER_AVAILABLE:
+        return []
+
+    candidates: List[dict] = []
+    for page in pdf.pages:
+        page_number = page.page_number
+        page_box = document.page_box(page_number)
+        _, visible_box = _visible_page(page_box)
+        for line in detect_page_lines(page.page_obj, page_box, min_length):
+            x0, x1, y = line
+            position = _vertical_position(y, visible_box)
+            candidates.append({
+                "page": page_number,
+                "line": {"x0": round(x0, 2), "x1": round(x1, 2), "y": round(y, 2)},
+                "coords": _signature_box(line, page_box),
+                "position": position,
+                "description": f"Linea di {round(x1 - x0)} pt a pagina {page_number} ({position})"
+            })
+    return candidates
@@ -0,0 +1,126 @@
+"""
+Analisi delle pagine in parallelo su un pool di processi.
+
+Il layout di pdfplumber/pdfminer è CPU-bound e in puro Python: in un thread tiene il
+GIL per tutta la durata dell'analisi. Per i documenti grandi le pagine vengono divise
+in intervalli analizzati da processi separati (ognuno apre il file per conto suo) e i
+text_hints vengono riuniti nell'ordine delle pagine. I documenti piccoli restano in
+processo: avviare i task costerebbe più dell'analisi stessa.
+
+L'attesa dei risultati ha un limite proporzionale alle pagine: un processo bloccato
+su una pagina patologica viene terminato e l'analisi riparte in processo, come per
+ogni altro errore del pool.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as PoolTimeoutError
+from typing import List, Optional
+
+from app.config.setting import settings
+from app.services.keyword_scan import scan_pdf_file, scan_pdf_pages
+from app.services.pdf_document import PdfDocument
+
+
+class PageAnalysisPool:
+    """
+    Pool di processi per la ricerca delle keyword di firma, creato al primo utilizzo.
+
+    Args:
+        workers (int): Numero di processi (0 = numero di CPU; 1 = analisi sempre in processo)
+        min_pages (int): Pagine minime perché l'analisi venga distribuita
+        pages_per_task (int): Pagine per ogni task inviato ai processi
+        timeout (float): Secondi di attesa dei risultati, oltre a quelli per pagina
+        timeout_per_page (float): Secondi di attesa aggiuntivi per ogni pagina del documento
+    """
+
+    def __init__(
+        self,
+        workers: int = 0,
+        min_pages: int = 40,
+        pages_per_task: int = 20,
+        timeout: float = 30.0,
+        timeout_per_page: float = 2.0
+    ):
+        self._workers = workers or os.cpu_count() or 1
+        self._min_pages = min_pages
+        self._pages_per_task = max(1, pages_per_task)
+        self._timeout = timeout
+        self._timeout_per_page = timeout_per_page
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def should_parallelize(self, page_count: int) -> bool:
+        """True se il documento è abbastanza grande da distribuire l'analisi sui processi."""
+        return self._workers > 1 and page_count >= self._min_pages
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # "spawn": il server ha thread attivi (event loop, pool HTTP), fork non è sicuro
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self._workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def scan(self, document: PdfDocument) -> List[dict]:
+        """
+        text_hints di tutte le pagine, in ordine di pagina. Funzione bloccante: va
+        eseguita in un thread. Se il pool non è utilizzabile o non risponde entro
+        timeout + pagine * timeout_per_page secondi analizza in processo.
+        """
+        page_count = document.page_count
+        # Task più piccoli se le pagine non bastano a occupare tutti i processi
+        pages_per_task = min(self._pages_per_task, -(-page_count // self._workers))
+        ranges = [
+            list(range(first, min(first + pages_per_task, page_count + 1)))
+            for first in range(1, page_count + 1, pages_per_task)
+        ]
+        deadline = time.monotonic() + self._timeout + page_count * self._timeout_per_page
+        try:
+            executor = self._get_executor()
+            with document.as_file() as path:
+                futures = [executor.submit(scan_pdf_file, path, page_numbers) for page_numbers in ranges]
+                # I risultati vengono letti nell'ordine di invio, cioè per intervallo di pagine
+                return [
+                    hint for future in futures
+                    for hint in future.result(timeout=max(0.0, deadline - time.monotonic()))
+                ]
+        except PoolTimeoutError:
+            print(f"Warning: Analisi parallela senza risposta per {page_count} pagine. Analisi in processo.")
+            self._reset(terminate=True)
+            return scan_pdf_pages(document.plumber)
+        except Exception as e:
+            print(f"Warning: Analisi parallela non disponibile: {str(e)}. Analisi in processo.")
+            self._reset()
+            return scan_pdf_pages(document.plumber)
+
+    def _reset(self, terminate: bool = False) -> None:
+        """
+        Scarta il pool (es. processo terminato in modo anomalo); verrà ricreato alla prossima
+        analisi. Con `terminate` i processi ancora in esecuzione (bloccati) vengono terminati.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        # shutdown non interrompe i task in corso: un processo bloccato resterebbe attivo
+        processes = list((getattr(executor, "_processes", None) or {}).values()) if terminate else []
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    def shutdown(self) -> None:
+        self._reset()
+
+
+page_analysis_pool = PageAnalysisPool(
+    workers=settings.ANALYSIS_PROCESS_WORKERS,
+    min_pages=settings.ANALYSIS_PARALLEL_MIN_PAGES,
+    pages_per_task=settings.ANALYSIS_PAGES_PER_TASK,
+    timeout=settings.ANALYSIS_POOL_TIMEOUT,
+    timeout_per_page=settings.ANALYSIS_POOL_TIMEOUT_PER_PAGE
+)
@@ -0,0 +1,489 @@
+"""
+Modello del documento PDF condiviso da conteggio pagine, analisi e firma.
+
+Il PDF viene aperto una sola volta e le informazioni vengono calcolate solo quando
+servono (e poi memorizzate): numero di pagine, box di ogni pagina, campi AcroForm
+e, per l'analisi del testo, il documento pdfplumber. La struttura viene letta dallo
+stesso parser di pdfplumber (pdfminer), così l'analisi del testo non rilegge xref e
+albero delle pagine; pyHanko viene usato solo se pdfplumber non è disponibile o non
+riesce ad aprire il file.
+"""
+import codecs
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import cached_property
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from pyhanko.pdf_utils.reader import PdfFileReader
+
+try:
+    import pdfplumber
+    from pdfminer.pdfpage import PDFPage
+    PDFPLUMBER_AVAILABLE = True
+except ImportError:
+    PDFPLUMBER_AVAILABLE = False
+
+# Box di default (A4 in punti) se la pagina non dichiara /MediaBox
+DEFAULT_MEDIA_BOX = (0.0, 0.0, 595.0, 842.0)
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class PageBox:
+    """Geometria di una pagina: MediaBox, CropBox (area visibile) e rotazione."""
+    media_box: Tuple[float, float, float, float]
+    crop_box: Tuple[float, float, float, float]
+    rotate: int = 0
+
+    @property
+    def width(self) -> float:
+        return abs(self.crop_box[2] - self.crop_box[0])
+
+    @property
+    def height(self) -> float:
+        return abs(self.crop_box[3] - self.crop_box[1])
+
+
+@dataclass(frozen=True)
+class FormField:
+    """Campo AcroForm terminale, con nome completo (es. 'firme.cliente') e tipo (es. 'Sig')."""
+    name: str
+    field_type: str
+
+
+@dataclass(frozen=True)
+class FieldWidget:
+    """Widget (rettangolo visibile) di un campo: pagina 1-based, None se non determinabile, e /Rect."""
+    page: Optional[int]
+    rect: Tuple[float, float, float, float]
+
+
+def _resolve(value):
+    """Risolve i riferimenti indiretti di pdfminer (resolve) e pyHanko (get_object)."""
+    while True:
+        if hasattr(value, "get_object"):
+            resolved = value.get_object()
+        elif hasattr(value, "resolve"):
+            resolved = value.resolve()
+        else:
+            return value
+        if resolved is value:
+            return value
+        value = resolved
+
+
+def _get(dictionary, key: str, default=None):
+    """Legge una chiave con o senza '/' (pdfminer usa 'Root', pyHanko '/Root')."""
+    if not isinstance(dictionary, dict):
+        return default
+    for candidate in (key, "/" + key):
+        if candidate in dictionary:
+            return _resolve(dictionary[candidate])
+    return default
+
+
+def _name(value) -> str:
+    """Nome PDF senza '/' (PSLiteral di pdfminer o NameObject di pyHanko)."""
+    value = getattr(value, "name", value)
+    if isinstance(value, bytes):
+        value = value.decode("latin-1")
+    return str(value).lstrip("/") if value is not None else ""
+
+
+def _text(value) -> str:
+    """Stringa di testo PDF: UTF-16 con BOM oppure PDFDocEncoding (approssimata con latin-1)."""
+    if isinstance(value, bytes):
+        if value.startswith(codecs.BOM_UTF16_BE):
+            return value[2:].decode("utf-16-be", errors="replace")
+        if value.startswith(codecs.BOM_UTF8):
+            return value[3:].decode("utf-8", errors="replace")
+        return value.decode("latin-1")
+    return str(value) if value is not None else ""
+
+
+def _object_id(reference) -> Optional[int]:
+    """Numero di un oggetto indiretto: PDFObjRef di pdfminer, IndirectObject o dizionario letto da pyHanko."""
+    for attribute in ("objid", "idnum"):
+        number = getattr(reference, attribute, None)
+        if number is not None:
+            return number
+    container = getattr(reference, "container_ref", None)
+    return getattr(container, "idnum", None)
+
+
+def _raw_get(dictionary, key: str):
+    """Come _get, ma senza risolvere il valore (per leggere il numero dell'oggetto)."""
+    if not isinstance(dictionary, dict):
+        return None
+    for candidate in (key, "/" + key):
+        if candidate in dictionary:
+            if hasattr(dictionary, "raw_get"):
+                return dictionary.raw_get(candidate)
+            return dictionary[candidate]
+    return None
+
+
+def _box(value, default: Tuple[float, float, float, float]) -> Tuple[float, float, float, float]:
+    value = _resolve(value)
+    try:
+        x0, y0, x1, y1 = (float(_resolve(number)) for number in value)
+    except (TypeError, ValueError):
+        return default
+    return (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+
+
+class PdfDocument:
+    """
+    Documento PDF aperto una sola volta, con proprietà calcolate su richiesta.
+
+    Uso:
+        with PdfDocument(pdf_stream) as document:
+            document.page_count
+            document.sha256
+            document.page_box(1)
+            document.acroform_fields
+            document.field_widget("firme.cliente")  # pagina e /Rect del campo
+            document.plumber  # pdfplumber.PDF per l'analisi del testo (None se non disponibile)
+            document.plumber_page(3)  # singola pagina pdfplumber, senza leggere le altre
+
+    Le proprietà eseguono parsing bloccante: dal codice async vanno lette in un thread.
+
+    Args:
+        stream (file-like): PDF (es. file temporaneo di download_pdf), lasciato aperto alla chiusura
+    """
+
+    def __init__(self, stream: BinaryIO):
+        self._stream = stream
+        self._plumber = None
+        self._plumber_pages: Dict[int, object] = {}
+        # Nome del campo -> widget (numero oggetto della pagina /P, numero oggetto del widget, /Rect)
+        self._widget_refs: Dict[str, List[Tuple[Optional[int], Optional[int], Tuple[float, ...]]]] = {}
+        self.errors: List[str] = []
+
+    def __enter__(self) -> "PdfDocument":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Libera le cache di pdfplumber; lo stream resta al chiamante."""
+        if self._plumber is None:
+            return
+        for page in self._plumber_pages.values():
+            page.close()
+        self._plumber_pages.clear()
+        if hasattr(self._plumber, "_pages"):
+            self._plumber.close()
+        else:
+            # PDF.close() caricherebbe tutte le pagine solo per liberarle
+            self._plumber.flush_cache()
+
+    @contextmanager
+    def as_file(self) -> Iterator[str]:
+        """
+        Percorso su disco del documento, per librerie o processi che aprono il file da sé.
+        Se lo stream non è un file con nome (es. SpooledTemporaryFile) ne crea una copia temporanea.
+        """
+        name = getattr(self._stream, "name", None)
+        if isinstance(name, str) and os.path.isfile(name):
+            yield name
+            return
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as copy:
+            self._stream.seek(0)
+            shutil.copyfileobj(self._stream, copy, _HASH_CHUNK_SIZE)
+            copy.flush()
+            self._stream.seek(0)
+            yield copy.name
+
+    @cached_property
+    def sha256(self) -> str:
+        """Impronta SHA-256 del contenuto, chiave dei risultati in document_cache."""
+        digest = hashlib.sha256()
+        self._stream.seek(0)
+        for chunk in iter(lambda: self._stream.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+        self._stream.seek(0)
+        return digest.hexdigest()
+
+    @cached_property
+    def plumber(self):
+        """Documento pdfplumber (parser pdfminer), None se non disponibile o illeggibile."""
+        if not PDFPLUMBER_AVAILABLE:
+            return None
+        try:
+            self._stream.seek(0)
+            self._plumber = pdfplumber.open(self._stream)
+        except Exception as e:
+            self.errors.append(f"pdfplumber: {str(e)}")
+            return None
+        return self._plumber
+
+    def plumber_page(self, page_number: int):
+        """
+        Pagina pdfplumber `page_number` (1-based), None se pdfplumber non è disponibile.
+
+        `plumber.pages` legge il dizionario di ogni pagina del documento; qui l'albero
+        delle pagine viene disceso con /Count, leggendo solo i nodi lungo il percorso
+        (conta per i documenti letti a blocchi con HTTP Range, vedi remote_pdf).
+        """
+        pdf = self.plumber
+        if pdf is None:
+            return None
+        if hasattr(pdf, "_pages") or pdf.pages_to_parse is not None:
+            # Pagine già caricate (o filtrate all'apertura): stessa numerazione di pdf.pages
+            return pdf.pages[page_number - 1]
+        page = self._plumber_pages.get(page_number)
+        if page is None:
+            try:
+                page_id, attributes = self._find_page(page_number - 1)
+            except Exception as e:
+                print(f"Warning: Albero delle pagine non navigabile ({str(e)}). Lettura di tutte le pagine.")
+                return pdf.pages[page_number - 1]
+            page = pdfplumber.page.Page(
+                pdf, PDFPage(pdf.doc, page_id, attributes, None), page_number=page_number
+            )
+            self._plumber_pages[page_number] = page
+        return page
+
+    def _find_page(self, index: int) -> Tuple[object, dict]:
+        """(id oggetto, attributi con quelli ereditati) della pagina `index` (0-based) nell'albero pdfminer."""
+        node_ref = self.plumber.doc.catalog["Pages"]
+        inherited: dict = {}
+        for _ in range(64):
+            node = _resolve(node_ref)
+            if not isinstance(node, dict):
+                raise ValueError("nodo dell'albero delle pagine non valido")
+            if _name(node.get("Type")) == "Page" or "Kids" not in node:
+                attributes = dict(node)
+                for key, value in inherited.items():
+                    attributes.setdefault(key, value)
+                return getattr(node_ref, "objid", None), attributes
+            for key in PDFPage.INHERITABLE_ATTRS:
+                if key in node:
+                    inherited[key] = node[key]
+            kids = list(_resolve(node["Kids"]))
+            if _resolve(node.get("Count")) == len(kids):
+                # Ogni figlio contiene una sola pagina: indice diretto, senza leggere gli altri
+                node_ref, index = kids[index], 0
+                continue
+            for kid in kids:
+                kid_node = _resolve(kid)
+                kid_count = int(_resolve(kid_node.get("Count", 1))) if _name(kid_node.get("Type")) == "Pages" else 1
+                if index < kid_count:
+                    node_ref = kid
+                    break
+                index -= kid_count
+            else:
+                raise IndexError("pagina oltre /Count")
+        raise ValueError("albero delle pagine troppo profondo")
+
+    @cached_property
+    def _pyhanko(self) -> Optional[PdfFileReader]:
+        """Reader pyHanko, usato solo se pdfplumber non può leggere la struttura."""
+        try:
+            self._stream.seek(0)
+            # strict=False per gestire PDF con strutture xref non standard
+            return PdfFileReader(self._stream, strict=False)
+        except Exception as e:
+            self.errors.append(f"pyHanko: {str(e)}")
+            return None
+
+    @cached_property
+    def _catalog(self) -> dict:
+        """Catalogo del documento: da pdfminer se leggibile, altrimenti da pyHanko."""
+        if self.plumber is not None:
+            catalog = _resolve(self.plumber.doc.catalog)
+            if _get(catalog, "Pages") is not None:
+                return catalog
+        reader = self._pyhanko
+        if reader is not None:
+            try:
+                return reader.root
+            except Exception as e:
+                self.errors.append(f"pyHanko: {str(e)}")
+        return {}
+
+    @cached_property
+    def page_count(self) -> int:
+        """Numero di pagine da /Pages /Count (1 se il conteggio non è possibile)."""
+        try:
+            count = _get(_get(self._catalog, "Pages", {}), "Count")
+            if count is not None and int(count) > 0:
+                return int(count)
+        except Exception as e:
+            self.errors.append(f"page count: {str(e)}")
+        # Lascia che l'API di firma gestisca il documento
+        print(f"Warning: Impossibile contare le pagine del PDF: {'; '.join(self.errors)}. Usando default: 1 pagina.")
+        return 1
+
+    @cached_property
+    def page_boxes(self) -> List[PageBox]:
+        """
+        Tabella dei box di tutte le pagine, in ordine (attributi ereditati da /Parent inclusi).
+
+        Viene costruita una sola volta visitando direttamente l'albero delle pagine, con
+        entrambi i parser: legge solo i dizionari delle pagine, senza creare le pagine
+        pdfplumber né risolvere risorse e content stream.
+        """
+        boxes: List[PageBox] = []
+        if self._catalog is None:
+            return boxes
+        try:
+            for _, reference in self._page_tree(True):
+                boxes.append(self._page_box(self._inherited_getter(_resolve(reference))))
+        except Exception as e:
+            self.errors.append(f"page boxes: {str(e)}")
+        return boxes
+
+    def page_box(self, page_number: int) -> PageBox:
+        """Box della pagina `page_number` (1-based); A4 se la pagina non è leggibile."""
+        boxes = self.page_boxes
+        if 1 <= page_number <= len(boxes):
+            return boxes[page_number - 1]
+        return PageBox(DEFAULT_MEDIA_BOX, DEFAULT_MEDIA_BOX)
+
+    @staticmethod
+    def _inherited_getter(page: dict):
+        def get(key: str):
+            node = page
+            while isinstance(node, dict):
+                value = _get(node, key)
+                if value is not None:
+                    return value
+                node = _get(node, "Parent")
+            return None
+        return get
+
+    @staticmethod
+    def _page_box(get) -> PageBox:
+        media_box = _box(get("MediaBox"), DEFAULT_MEDIA_BOX)
+        crop_box = _box(get("CropBox"), media_box)
+        try:
+            rotate = int(get("Rotate") or 0) % 360
+        except (TypeError, ValueError):
+            rotate = 0
+        return PageBox(media_box, crop_box, rotate)
+
+    @cached_property
+    def acroform_fields(self) -> List[FormField]:
+        """Campi AcroForm terminali (visita /Fields e /Kids), con tipo ereditato dai genitori."""
+        fields: List[FormField] = []
+        acro_form = _get(self._catalog, "AcroForm")
+        if not isinstance(acro_form, dict):
+            return fields
+
+        def widget(reference, annotation: dict):
+            return (
+                _object_id(_raw_get(annotation, "P")),
+                _object_id(reference),
+                _box(_get(annotation, "Rect"), (0.0, 0.0, 0.0, 0.0))
+            )
+
+        def visit(reference, parent_name: str, parent_type: str, depth: int) -> None:
+            field = _resolve(reference)
+            if not isinstance(field, dict) or depth > 32:
+                return
+            partial_name = _get(field, "T")
+            name = _text(partial_name) if partial_name is not None else ""
+            full_name = f"{parent_name}.{name}" if parent_name and name else (name or parent_name)
+            field_type = _name(_get(field, "FT")) or parent_type
+            # I /Kids senza /T sono solo widget del campo stesso
+            kids = [(kid, _resolve(kid)) for kid in (_get(field, "Kids") or [])]
+            kids = [(kid, node) for kid, node in kids if isinstance(node, dict)]
+            child_fields = [kid for kid, node in kids if _get(node, "T") is not None]
+            if child_fields:
+                for kid in child_fields:
+                    visit(kid, full_name, field_type, depth + 1)
+            elif full_name:
+                fields.append(FormField(full_name, field_type))
+                # Campo e widget possono coincidere (un solo dizionario con /Rect)
+                widgets = [widget(kid, node) for kid, node in kids] or (
+                    [widget(reference, field)] if _get(field, "Rect") is not None else []
+                )
+                self._widget_refs.setdefault(full_name, []).extend(widgets)
+
+        try:
+            for field in _get(acro_form, "Fields") or []:
+                visit(field, "", "", 0)
+        except Exception as e:
+            self.errors.append(f"AcroForm: {str(e)}")
+        return fields
+
+    @cached_property
+    def field_widgets(self) -> Dict[str, List[FieldWidget]]:
+        """
+        Indice dei campi AcroForm: nome completo -> widget con pagina e /Rect.
+
+        La pagina viene dal riferimento /P del widget, confrontato con i /Kids dell'albero
+        delle pagine; solo per i widget senza /P vengono lette le /Annots delle pagine.
+        """
+        self.acroform_fields
+        index: Dict[str, List[FieldWidget]] = {}
+        try:
+            page_ids = self._page_ids
+            for name, widgets in self._widget_refs.items():
+                for page_id, widget_id, rect in widgets:
+                    page = page_ids.get(page_id)
+                    if page is None and widget_id is not None:
+                        page = self._annotation_pages.get(widget_id)
+                    index.setdefault(name, []).append(FieldWidget(page, rect))
+        except Exception as e:
+            self.errors.append(f"AcroForm widgets: {str(e)}")
+        return index
+
+    def field_widget(self, name: str) -> Optional[FieldWidget]:
+        """
+        Primo widget con pagina nota del campo `name` (nome completo, oppure ultimo
+        componente del nome se identifica un solo campo: 'cliente' per 'firme.cliente').
+        """
+        index = self.field_widgets
+        widgets = index.get(name)
+        if widgets is None:
+            matches = [full_name for full_name in index if full_name.rsplit(".", 1)[-1] == name]
+            widgets = index[matches[0]] if len(matches) == 1 else []
+        return next((widget for widget in widgets if widget.page is not None), None)
+
+    def _page_tree(self, resolve_leaves: bool) -> Iterator[Tuple[int, object]]:
+        """
+        (numero di pagina, riferimento) in ordine. Con resolve_leaves=False i figli di un
+        nodo con /Count uguale al numero di /Kids sono trattati come pagine senza leggerli.
+        """
+        number = 0
+        stack = [(_raw_get(self._catalog, "Pages"), 0)]
+        while stack:
+            reference, depth = stack.pop()
+            node = _resolve(reference)
+            kids = _get(node, "Kids")
+            if kids is None or depth > 32:
+                number += 1
+                yield number, reference
+                continue
+            kids = list(kids)
+            if not resolve_leaves and _get(node, "Count") == len(kids):
+                for kid in kids:
+                    number += 1
+                    yield number, kid
+                continue
+            stack.extend((kid, depth + 1) for kid in reversed(kids))
+
+    @cached_property
+    def _page_ids(self) -> Dict[int, int]:
+        """Numero oggetto della pagina -> numero di pagina (1-based)."""
+        return {_object_id(reference): number for number, reference in self._page_tree(False)}
+
+    @cached_property
+    def _annotation_pages(self) -> Dict[int, int]:
+        """Numero oggetto di ogni annotazione -> numero di pagina (legge tutte le pagine)."""
+        pages: Dict[int, int] = {}
+        for number, reference in self._page_tree(True):
+            for annotation in _get(_resolve(reference), "Annots") or []:
+                annotation_id = _object_id(annotation)
+                if annotation_id is not None:
+                    pages.setdefault(annotation_id, number)
+        return pages
@@ -0,0 +1,30 @@
+"""
+Directory locali private per i file dei documenti (cache e giornale dei batch).
+
+Le directory di default stanno nella directory temporanea di sistema, con un nome
+prevedibile: create con i permessi di default, su un host condiviso gli altri utenti
+potrebbero leggere i PDF (anche quelli firmati). Qui la directory viene creata con
+permessi 0700; se esiste già deve appartenere all'utente del processo e i permessi
+di gruppo/altri vengono rimossi.
+"""
+import os
+import stat
+
+
+def ensure_private_directory(path: str) -> str:
+    """
+    Crea (se manca) una directory accessibile solo all'utente del processo.
+
+    Returns:
+        str: Il percorso della directory
+
+    Raises:
+        PermissionError: La directory esiste ma appartiene a un altro utente
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.stat(path)
+    if hasattr(os, "getuid") and info.st_uid != os.getuid():
+        raise PermissionError(f"La directory {path} appartiene a un altro utente")
+    if stat.S_IMODE(info.st_mode) & 0o077:
+        os.chmod(path, 0o700)
+    return path
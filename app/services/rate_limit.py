@@ -0,0 +1,200 @@
+"""
+Limitatore lato client delle chiamate verso ogni upstream (Infocert e Spaces).
+
+Con i picchi di richieste (batch, job in parallelo, più client MCP) Infocert risponde
+429 su /certificates/{id}/sign e sugli endpoint SMSP, e ogni tool fallisce. Qui ogni
+upstream ha:
+- un token bucket: al massimo `rate` richieste al secondo, con raffica di un secondo
+- un limite di richieste in corso contemporaneamente (`max_in_flight`)
+
+Chi non trova posto attende in coda (FIFO) fino a RATE_LIMIT_MAX_WAIT secondi, poi
+riceve UpstreamBusyError (un timeout httpx, gestito come gli altri errori HTTP dei
+tool). Una risposta 429 sospende l'upstream per il tempo indicato da Retry-After,
+così le richieste successive aspettano invece di insistere. La profondità delle code
+si legge con stats().
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Dict, Optional
+
+import anyio
+import httpx
+
+from app.config.setting import settings
+
+# Upstream limitati
+AUTHORIZATION = "authorization"
+CERTIFICATES = "certificates"
+SMSP = "smsp"
+SIGN = "sign"
+SPACES = "spaces"
+
+# Pausa dopo un 429 senza Retry-After (secondi)
+DEFAULT_RETRY_AFTER = 1.0
+
+
+class UpstreamBusyError(httpx.TimeoutException):
+    """Nessun posto libero verso l'upstream entro il tempo massimo di attesa."""
+
+    def __init__(self, upstream: str, waited: float):
+        self.upstream = upstream
+        super().__init__(f"Upstream '{upstream}' occupato: nessun posto libero in {waited:.1f} secondi, riprovare più tardi")
+
+
+class UpstreamLimiter:
+    """
+    Token bucket e limite di richieste in corso per un upstream.
+
+    Args:
+        name (str): Nome dell'upstream
+        rate (float): Richieste al secondo (0: nessun limite)
+        max_in_flight (int): Richieste contemporanee (0: nessun limite)
+    """
+
+    def __init__(self, name: str, rate: float, max_in_flight: int):
+        self.name = name
+        self._rate = rate
+        self._capacity = max(1.0, rate)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._max_in_flight = max_in_flight
+        # Creati al primo utilizzo, dentro l'event loop
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._bucket_lock: Optional[asyncio.Lock] = None
+        self.waiting = 0
+        self.in_flight = 0
+        self.throttled = 0
+        self.rejected = 0
+
+    def stats(self) -> dict:
+        return {
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "max_in_flight": self._max_in_flight,
+            "rate": self._rate,
+            "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 3),
+            "throttled": self.throttled,
+            "rejected": self.rejected
+        }
+
+    @asynccontextmanager
+    async def slot(self, timeout: float) -> AsyncIterator[None]:
+        """
+        Attende un posto (richiesta in corso e token) e lo tiene per tutta la richiesta.
+
+        Raises:
+            UpstreamBusyError: Nessun posto entro `timeout` secondi
+        """
+        if self._slots is None and self._max_in_flight > 0:
+            self._slots = asyncio.Semaphore(self._max_in_flight)
+        if self._bucket_lock is None:
+            self._bucket_lock = asyncio.Lock()
+
+        self.waiting += 1
+        acquired = False
+        try:
+            with anyio.fail_after(timeout):
+                if self._slots is not None:
+                    await self._slots.acquire()
+                    acquired = True
+                async with self._bucket_lock:
+                    await self._take_token()
+        except TimeoutError:
+            self.rejected += 1
+            if acquired:
+                self._slots.release()
+            raise UpstreamBusyError(self.name, timeout) from None
+        except BaseException:
+            if acquired:
+                self._slots.release()
+            raise
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            if acquired:
+                self._slots.release()
+
+    async def _take_token(self) -> None:
+        """Preleva un token, attendendo la ricarica o la fine di una pausa dopo un 429."""
+        while True:
+            now = time.monotonic()
+            if self._rate > 0:
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            delay = self._paused_until - now
+            if self._rate > 0 and self._tokens < 1:
+                delay = max(delay, (1 - self._tokens) / self._rate)
+            if delay <= 0:
+                if self._rate > 0:
+                    self._tokens -= 1
+                return
+            await asyncio.sleep(delay)
+
+    def throttle(self, retry_after: float) -> None:
+        """Risposta 429: nessuna nuova richiesta per `retry_after` secondi."""
+        self.throttled += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+
+def retry_after_seconds(response: httpx.Response) -> float:
+    """Secondi indicati da Retry-After (numero o data HTTP), DEFAULT_RETRY_AFTER se assente."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+def _build_limiters() -> Dict[str, UpstreamLimiter]:
+    if not settings.RATE_LIMIT_ENABLED:
+        return {}
+    return {
+        AUTHORIZATION: UpstreamLimiter(
+            AUTHORIZATION, settings.RATE_LIMIT_AUTHORIZATION_PER_SECOND, settings.RATE_LIMIT_AUTHORIZATION_MAX_IN_FLIGHT
+        ),
+        CERTIFICATES: UpstreamLimiter(
+            CERTIFICATES, settings.RATE_LIMIT_CERTIFICATES_PER_SECOND, settings.RATE_LIMIT_CERTIFICATES_MAX_IN_FLIGHT
+        ),
+        SMSP: UpstreamLimiter(SMSP, settings.RATE_LIMIT_SMSP_PER_SECOND, settings.RATE_LIMIT_SMSP_MAX_IN_FLIGHT),
+        SIGN: UpstreamLimiter(SIGN, settings.RATE_LIMIT_SIGN_PER_SECOND, settings.RATE_LIMIT_SIGN_MAX_IN_FLIGHT),
+        SPACES: UpstreamLimiter(SPACES, settings.RATE_LIMIT_SPACES_PER_SECOND, settings.RATE_LIMIT_SPACES_MAX_IN_FLIGHT)
+    }
+
+
+upstream_limiters: Dict[str, UpstreamLimiter] = _build_limiters()
+
+
+@asynccontextmanager
+async def upstream_slot(upstream: Optional[str], timeout: Optional[float] = None) -> AsyncIterator[Optional[UpstreamLimiter]]:
+    """
+    Posto verso l'upstream indicato (nessun limite se None o se i limiti sono disattivati).
+
+    Args:
+        upstream (str): Nome dell'upstream (AUTHORIZATION, CERTIFICATES, SMSP, SIGN, SPACES)
+        timeout (float): Attesa massima (default RATE_LIMIT_MAX_WAIT)
+    """
+    limiter = upstream_limiters.get(upstream) if upstream else None
+    if limiter is None:
+        yield None
+        return
+    async with limiter.slot(settings.RATE_LIMIT_MAX_WAIT if timeout is None else timeout):
+        yield limiter
+
+
+def upstream_stats() -> Dict[str, dict]:
+    """Stato di ogni upstream: richieste in coda (waiting), in corso, 429 ricevuti, attese scadute."""
+    return {name: limiter.stats() for name, limiter in upstream_limiters.items()}
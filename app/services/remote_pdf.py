@@ -0,0 +1,221 @@
+"""
+Lettura parziale dei PDF remoti con richieste HTTP Range.
+
+Per sapere quante pagine ha un documento o se contiene un campo /Sig bastano il
+trailer, le tabelle/stream xref e pochi oggetti (catalogo, albero delle pagine,
+AcroForm): su un PDF di decine di MB sono pochi blocchi. RemotePdfFile è un file
+in sola lettura che pdfminer/pyHanko leggono come un file locale; ogni blocco
+mancante viene scaricato con una richiesta Range (i blocchi contigui in una sola
+richiesta) e tenuto in una cache LRU per documento.
+
+La lettura parziale viene usata solo se l'origine risponde 206 Partial Content e
+dichiara un validatore forte (ETag non debole o Last-Modified): ogni richiesta
+successiva porta If-Range, così un documento modificato nel frattempo viene
+rilevato (risposta 200) invece di mescolare blocchi di versioni diverse.
+Le richieste partono dai thread di analisi, quindi usano il client sincrono condiviso.
+"""
+import io
+import re
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.config.setting import settings
+from app.services.http_client import http_client
+
+_CONTENT_RANGE = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+)")
+
+
+class RemoteDocumentChangedError(Exception):
+    """L'origine non ha restituito l'intervallo richiesto (documento cambiato o Range non più supportato)."""
+
+
+def _parse_content_range(value: Optional[str]) -> Optional[Tuple[int, int, int]]:
+    """(inizio, fine inclusa, dimensione totale) dall'header Content-Range."""
+    match = _CONTENT_RANGE.match(value or "")
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2)), int(match.group(3))
+
+
+def _strong_validator(headers) -> Optional[str]:
+    """Validatore utilizzabile con If-Range: ETag forte oppure Last-Modified."""
+    etag = headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("Last-Modified")
+
+
+class RemotePdfFile(io.RawIOBase):
+    """
+    File in sola lettura su un documento remoto, letto a blocchi con richieste Range.
+
+    Gli errori di rete durante la lettura vengono anche registrati in `failure`: i
+    parser PDF trasformano le eccezioni di lettura in errori di parsing, quindi il
+    chiamante deve controllare `failure` per distinguere un PDF illeggibile da un
+    download fallito.
+
+    Args:
+        url (str): URL del documento
+        size (int): Dimensione totale (da Content-Range)
+        validator (str): ETag forte o Last-Modified, inviato come If-Range
+        block_size (int): Byte per blocco
+        max_blocks (int): Blocchi massimi in cache (LRU)
+    """
+
+    def __init__(self, url: str, size: int, validator: str, block_size: int, max_blocks: int):
+        super().__init__()
+        self.url = url
+        self.size = size
+        self.validator = validator
+        self._block_size = block_size
+        self._max_blocks = max(2, max_blocks)
+        self._blocks: "OrderedDict[int, bytes]" = OrderedDict()
+        self._position = 0
+        self.failure: Optional[BaseException] = None
+        self.requests = 0
+        self.bytes_fetched = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": self.size, "requests": self.requests, "bytes_fetched": self.bytes_fetched}
+
+    # Interfaccia file
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"whence non valido: {whence}")
+        if position < 0:
+            raise ValueError("Posizione negativa")
+        self._position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        end = min(self._position + len(buffer), self.size)
+        if end <= self._position:
+            return 0
+        data = self._read_range(self._position, end)
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    # Blocchi
+
+    def _read_range(self, start: int, end: int) -> bytes:
+        first, last = start // self._block_size, (end - 1) // self._block_size
+        self._load(first, last)
+        data = b"".join(self._blocks[index] for index in range(first, last + 1))
+        offset = start - first * self._block_size
+        return data[offset:offset + end - start]
+
+    def _load(self, first: int, last: int) -> None:
+        """Porta in cache i blocchi first..last, con una richiesta per ogni serie di blocchi mancanti."""
+        index = first
+        while index <= last:
+            if index in self._blocks:
+                self._blocks.move_to_end(index)
+                index += 1
+                continue
+            run_end = index
+            while run_end + 1 <= last and run_end + 1 not in self._blocks:
+                run_end += 1
+            self._fetch(index, run_end)
+            index = run_end + 1
+        # I blocchi richiesti restano in cache anche se superano max_blocks (servono a questa lettura)
+        while len(self._blocks) > max(self._max_blocks, last - first + 1):
+            self._blocks.popitem(last=False)
+
+    def _fetch(self, first: int, last: int) -> None:
+        start = first * self._block_size
+        end = min((last + 1) * self._block_size, self.size) - 1
+        try:
+            response = http_client.get(
+                self.url,
+                headers={
+                    "Range": f"bytes={start}-{end}",
+                    "If-Range": self.validator,
+                    "Accept-Encoding": "identity"
+                },
+                timeout=(settings.PDF_DOWNLOAD_CONNECT_TIMEOUT, settings.PDF_DOWNLOAD_READ_TIMEOUT)
+            )
+            content_range = _parse_content_range(response.headers.get("Content-Range"))
+            if response.status_code != 206 or content_range != (start, end, self.size):
+                raise RemoteDocumentChangedError(
+                    f"Risposta {response.status_code} alla richiesta Range {start}-{end} di {self.url}"
+                )
+            data = response.content
+            if len(data) != end - start + 1:
+                raise RemoteDocumentChangedError(f"Intervallo {start}-{end} incompleto ({len(data)} byte)")
+        except BaseException as e:
+            if self.failure is None:
+                self.failure = e
+            raise
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        for index in range(first, last + 1):
+            offset = (index - first) * self._block_size
+            self._blocks[index] = data[offset:offset + self._block_size]
+
+
+def open_remote_pdf(url: str, min_bytes: Optional[int] = None) -> Optional[RemotePdfFile]:
+    """
+    Apre un PDF remoto in lettura parziale, se l'origine lo consente.
+
+    La prima richiesta chiede l'ultimo blocco del file (Range suffisso), dove si
+    trovano trailer e startxref: la risposta dice se l'origine supporta Range, la
+    dimensione totale e il validatore, e il blocco resta in cache per il parsing.
+    Operazione bloccante (HTTP sincrono): va eseguita in un thread.
+
+    Args:
+        url (str): URL del documento
+        min_bytes (int): Dimensione minima per la lettura parziale (default REMOTE_PDF_MIN_BYTES)
+
+    Returns:
+        RemotePdfFile: File posizionato all'inizio, None se conviene (o serve) il download completo
+    """
+    min_bytes = settings.REMOTE_PDF_MIN_BYTES if min_bytes is None else min_bytes
+    block_size = settings.REMOTE_PDF_BLOCK_SIZE
+    try:
+        response = http_client.get(
+            url,
+            headers={"Range": f"bytes=-{block_size}", "Accept-Encoding": "identity"},
+            timeout=(settings.PDF_DOWNLOAD_CONNECT_TIMEOUT, settings.PDF_DOWNLOAD_READ_TIMEOUT),
+            stream=True
+        )
+    except Exception as e:
+        print(f"Warning: Lettura parziale non disponibile per {url}: {str(e)}")
+        return None
+
+    with response:
+        content_range = _parse_content_range(response.headers.get("Content-Range"))
+        validator = _strong_validator(response.headers)
+        # 200 (Range ignorato), nessun validatore o documento piccolo: download completo
+        if response.status_code != 206 or content_range is None or validator is None:
+            return None
+        start, end, size = content_range
+        if size < min_bytes or end != size - 1:
+            return None
+        tail = response.content
+
+    remote = RemotePdfFile(url, size, validator, block_size, settings.REMOTE_PDF_CACHE_BLOCKS)
+    # Dalla coda del file resta in cache solo l'ultimo blocco completo (allineato)
+    last_index = (size - 1) // block_size
+    last_start = last_index * block_size
+    if start <= last_start and len(tail) == size - start:
+        remote._blocks[last_index] = tail[last_start - start:]
+    remote.requests += 1
+    remote.bytes_fetched += len(tail)
+    return remote
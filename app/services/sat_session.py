@@ -0,0 +1,117 @@
+"""
+Registro lato server dei SAT (Signature Authorization Token) ottenuti con authorize_smsp.
+
+authorize_smsp chiede a Infocert un SAT valido per più firme (signaturesNumber), ma
+senza traccia lato server il client non sa quante firme restano né quando il SAT
+scade, e rifà challenge SMS e OTP molto più spesso del necessario. Il registro
+conserva il SAT per certificato e transazione con le firme residue e la scadenza:
+sign_document e sign_documents_batch lo usano quando il SAT non viene passato e
+riportano il budget residuo nella risposta.
+
+La chiave è l'hash SHA-256 di certificate_id e transactionId (non conservati in chiaro).
+Il conteggio è prudente: una firma viene scalata quando la richiesta parte verso il
+servizio di firma, anche se poi fallisce. Fa eccezione la firma del solo digest
+(SIGN_HASH_ENDPOINT): se la chiamata fallisce la firma viene restituita con refund.
+"""
+import hashlib
+import hmac
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+
+class SatSessionError(Exception):
+    """SAT non registrato, scaduto o senza firme residue: serve una nuova autorizzazione SMSP."""
+
+
+@dataclass
+class SatSession:
+    sat: str
+    signatures: int
+    expires_at: float  # time.monotonic()
+    used: int = 0
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.signatures - self.used)
+
+    def expires_in(self) -> int:
+        return max(0, int(self.expires_at - time.monotonic()))
+
+    def to_dict(self) -> dict:
+        """Budget residuo, riportato nelle risposte dei tool di firma."""
+        return {
+            "signatures_total": self.signatures,
+            "signatures_remaining": self.remaining,
+            "expires_in": self.expires_in()
+        }
+
+
+class SatSessionRegistry:
+    """
+    Registro LRU con scadenza dei SAT per certificato e transazione.
+
+    Args:
+        ttl (int): Validità di un SAT in secondi dall'autorizzazione
+        max_entries (int): Numero massimo di SAT mantenuti (i meno recenti vengono rimossi)
+    """
+
+    def __init__(self, ttl: int = 3600, max_entries: int = 1024):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[str, SatSession]" = OrderedDict()
+
+    @staticmethod
+    def _key(certificate_id: str, transaction_id: str) -> str:
+        return hashlib.sha256(f"{certificate_id}\0{transaction_id}".encode("utf-8")).hexdigest()
+
+    def register(self, certificate_id: str, transaction_id: str, sat: str, signatures: int) -> SatSession:
+        """Registra il SAT appena ottenuto da authorize_smsp (sostituisce quello della stessa transazione)."""
+        key = self._key(certificate_id, transaction_id)
+        session = self._entries[key] = SatSession(sat, signatures, time.monotonic() + self._ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+        return session
+
+    def get(self, certificate_id: str, transaction_id: str, sat: Optional[str] = None) -> Optional[SatSession]:
+        """
+        SAT registrato e non scaduto per certificato e transazione. Se `sat` è indicato
+        deve coincidere con quello registrato (altrimenti il SAT non è tracciato: None).
+        """
+        key = self._key(certificate_id, transaction_id)
+        session = self._entries.get(key)
+        if session is None:
+            return None
+        if session.expires_at <= time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        if sat and not hmac.compare_digest(session.sat.encode("utf-8"), sat.encode("utf-8")):
+            return None
+        self._entries.move_to_end(key)
+        return session
+
+    def check(self, session: SatSession, count: int = 1) -> None:
+        """
+        Verifica che il SAT sia valido per altre `count` firme.
+
+        Raises:
+            SatSessionError: SAT scaduto o con meno di `count` firme residue
+        """
+        if session.expires_at <= time.monotonic():
+            raise SatSessionError("SAT scaduto: rifare request_smsp_challenge e authorize_smsp")
+        if session.remaining < count:
+            raise SatSessionError(
+                f"Firme residue del SAT insufficienti ({session.remaining}, richieste {count}): "
+                f"rifare request_smsp_challenge e authorize_smsp"
+            )
+
+    def consume(self, session: SatSession, count: int = 1) -> None:
+        """Scala `count` firme dal SAT, prima di inviare la richiesta di firma (vedi check)."""
+        self.check(session, count)
+        session.used += count
+
+    def refund(self, session: SatSession, count: int = 1) -> None:
+        """Restituisce `count` firme scalate con consume per una richiesta non andata a buon fine."""
+        session.used = max(0, session.used - count)
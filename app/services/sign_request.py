@@ -0,0 +1,179 @@
+"""
+Corpo JSON in streaming per la richiesta di firma `/certificates/{id}/sign`.
+
+Invece di tenere in memoria il PDF, la sua versione base64 e il JSON serializzato
+(4-5 volte la dimensione del documento), il corpo viene prodotto a blocchi: le
+parti JSON fisse vengono serializzate una volta sola e il contenuto di ogni
+documento viene codificato in base64 direttamente dal file temporaneo mentre
+la richiesta viene inviata. Il picco di memoria resta vicino a un blocco.
+
+Anche i signatureFields pesano sul corpo: ogni talloncino visibile porta con sé
+l'immagine PNG in base64, quindi il numero di talloncini viene limitato
+(limit_visible_pages) e l'immagine viene letta e codificata una sola volta all'avvio.
+"""
+import base64
+import json
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Dict, List
+
+# Multiplo di 3: ogni blocco si codifica in base64 senza padding intermedio
+BASE64_READ_SIZE = 3 * 64 * 1024
+
+
+# Immagine del talloncino distribuita con il servizio (usata se non ne viene configurata un'altra)
+DEFAULT_SIGNATURE_IMAGE = Path(__file__).resolve().parent.parent / "assets" / "signature_stamp.png"
+
+
+def load_signature_image(path: str = "") -> str:
+    """
+    Immagine PNG del talloncino codificata in base64 (da leggere una volta all'avvio).
+
+    Args:
+        path (str): File PNG dell'immagine; vuoto per l'immagine predefinita
+
+    Raises:
+        OSError: File non leggibile
+        ValueError: Il file non è un PNG
+    """
+    data = Path(path or DEFAULT_SIGNATURE_IMAGE).read_bytes()
+    if not data.startswith(b"\x89PNG\r\n\x1a\n"):
+        raise ValueError(f"L'immagine del talloncino deve essere un PNG: {path}")
+    return base64.b64encode(data).decode("ascii")
+
+
+def limit_visible_pages(signature_pages: List[int], max_fields: int) -> List[int]:
+    """
+    Pagine che ricevono un talloncino visibile.
+
+    La firma PAdES copre sempre l'intero documento: i talloncini sono solo la sua
+    rappresentazione grafica. Oltre `max_fields` pagine (0 = nessun limite) resta un
+    solo talloncino, sull'ultima pagina richiesta, invece di ripetere l'immagine
+    centinaia di volte nel corpo della richiesta.
+    """
+    if max_fields and len(signature_pages) > max_fields:
+        return signature_pages[-1:]
+    return signature_pages
+
+
+def build_signature_fields(
+    signature_pages: List[int],
+    placements: List[Dict[str, int]],
+    visible_text: str,
+    signature_image: str
+) -> list:
+    """
+    Array signatureFields con un talloncino per ogni pagina indicata.
+
+    Args:
+        signature_pages (list): Pagine (1-based) dei talloncini
+        placements (list): Coordinate {'llx', 'lly', 'urx', 'ury'} di ogni pagina, nello stesso ordine
+        visible_text (str): Testo del talloncino
+        signature_image (str): PNG in base64 (load_signature_image), condiviso da tutti i talloncini
+    """
+    signature_fields = []
+    for page_num, coords in zip(signature_pages, placements):
+        signature_fields.append({
+            "position": {
+                "page": page_num,
+                "llx": coords["llx"],
+                "lly": coords["lly"],
+                "urx": coords["urx"],
+                "ury": coords["ury"]
+            },
+            "signatureImage": signature_image,
+            "avoidGraphicLayers": True,
+            "visibleText": visible_text,
+            "fontSize": 4
+        })
+    return signature_fields
+
+
+def _base64_length(size: int) -> int:
+    return 4 * ((size + 2) // 3)
+
+
+def _read_exactly(stream: BinaryIO, size: int) -> bytes:
+    """Legge `size` byte (meno solo a fine file), così i blocchi restano multipli di 3."""
+    chunk = stream.read(size)
+    while chunk and len(chunk) < size:
+        more = stream.read(size - len(chunk))
+        if not more:
+            break
+        chunk += more
+    return chunk
+
+
+def _stream_size(stream: BinaryIO) -> int:
+    stream.seek(0, 2)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+class StreamingSignBody:
+    """
+    Corpo della richiesta di firma con i documenti codificati in base64 al volo.
+
+    Il dizionario `body` usa `placeholder(i)` al posto del campo `document.content`
+    dell'i-esimo documento; `documents[i]` è il file da cui leggere quel contenuto.
+    Può essere passato come `content=` a httpx insieme all'header Content-Length
+    restituito da `headers()`.
+
+    Args:
+        body (dict): Corpo JSON della richiesta con i segnaposto dei documenti
+        documents (list): File binari (es. SpooledTemporaryFile) dei documenti, in ordine
+    """
+
+    def __init__(self, body: dict, documents: List[BinaryIO]):
+        self._token = uuid.uuid4().hex
+        self._documents = documents
+        serialized = json.dumps(self._with_tokens(body), separators=(",", ":")).encode("utf-8")
+
+        # Divide il JSON nei frammenti fissi attorno ai segnaposto
+        self._fragments: List[bytes] = []
+        for index in range(len(documents)):
+            marker = json.dumps(self._marker(index)).encode("utf-8")
+            before, found, serialized = serialized.partition(marker)
+            if not found:
+                raise ValueError(f"Segnaposto del documento {index} non trovato nel corpo della richiesta")
+            self._fragments.append(before + b'"')
+            serialized = b'"' + serialized
+        self._fragments.append(serialized)
+
+        self.content_length = sum(len(fragment) for fragment in self._fragments) + sum(
+            _base64_length(_stream_size(document)) for document in documents
+        )
+
+    @staticmethod
+    def placeholder(index: int) -> dict:
+        """Segnaposto da usare come `document.content` dell'i-esimo documento."""
+        return {"__streamed_document__": index}
+
+    def _marker(self, index: int) -> str:
+        return f"__streamed_document_{self._token}_{index}__"
+
+    def _with_tokens(self, value):
+        """Sostituisce i segnaposto con stringhe univoche riconoscibili nel JSON serializzato."""
+        if isinstance(value, dict):
+            if set(value) == {"__streamed_document__"}:
+                return self._marker(value["__streamed_document__"])
+            return {key: self._with_tokens(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._with_tokens(item) for item in value]
+        return value
+
+    def headers(self) -> dict:
+        return {"Content-Type": "application/json", "Content-Length": str(self.content_length)}
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for index, fragment in enumerate(self._fragments):
+            yield fragment
+            if index < len(self._documents):
+                document = self._documents[index]
+                document.seek(0)
+                while True:
+                    chunk = _read_exactly(document, BASE64_READ_SIZE)
+                    if not chunk:
+                        break
+                    yield base64.b64encode(chunk)
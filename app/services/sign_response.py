@@ -0,0 +1,201 @@
+"""
+Parsing incrementale della risposta di `/certificates/{id}/sign`.
+
+La risposta contiene l'intero PDF firmato in base64 (`signatureResult[].signedDocument.content`).
+Invece di `response.json()` + `base64.b64decode` (più copie complete del documento),
+la risposta viene letta a blocchi: il contenuto firmato viene decodificato a pezzi
+e scritto in un file temporaneo "spooled" per documento, pronto per l'upload
+multipart; il resto del JSON (piccolo) viene ricostruito e analizzato normalmente.
+"""
+import base64
+import json
+import tempfile
+from typing import Dict, List, Optional
+
+from app.config.setting import settings
+
+_WHITESPACE = b" \t\r\n"
+# Escape JSON ammessi dentro una stringa base64
+_BASE64_ESCAPES = {ord("/"): b"/", ord("n"): b"", ord("r"): b"", ord("t"): b""}
+
+
+class _Base64Sink:
+    """Decodifica base64 a blocchi (multipli di 4 caratteri) verso un file temporaneo."""
+
+    def __init__(self, spool_threshold: int):
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+        self._pending = b""
+
+    def write(self, data: bytes) -> None:
+        if not data:
+            return
+        data = self._pending + data.translate(None, _WHITESPACE)
+        usable = len(data) - len(data) % 4
+        if usable:
+            self.file.write(base64.b64decode(data[:usable]))
+        self._pending = data[usable:]
+
+    def finish(self) -> None:
+        if self._pending:
+            # Padding mancante: completa il gruppo finale
+            self.file.write(base64.b64decode(self._pending + b"=" * (-len(self._pending) % 4)))
+            self._pending = b""
+        self.file.seek(0)
+
+
+class SignResponseParser:
+    """
+    Parser a blocchi della risposta di firma.
+
+    I documenti firmati vengono decodificati in file temporanei (in memoria fino a
+    PDF_SPOOL_THRESHOLD byte, poi su disco); nel JSON restituito da `close()` il
+    campo `signedDocument.content` contiene solo un segnaposto.
+
+    Uso:
+        parser = SignResponseParser()
+        async for chunk in response.aiter_bytes():
+            parser.feed(chunk)
+        result = parser.close()
+        signed_pdf = parser.signed_document(0)  # file del primo signatureResult
+    """
+
+    def __init__(self, spool_threshold: Optional[int] = None):
+        self._spool_threshold = spool_threshold or settings.PDF_SPOOL_THRESHOLD
+        self._buffer = b""
+        self._skeleton: List[bytes] = []
+        # Per ogni livello: [tipo ('{' o '['), chiave corrente o indice, in attesa di chiave]
+        self._stack: List[list] = []
+        self._string: Optional[bytearray] = None  # stringa piccola in lettura
+        self._string_is_key = False
+        self._sink: Optional[_Base64Sink] = None  # contenuto firmato in decodifica
+        self._documents: Dict[int, _Base64Sink] = {}
+
+    def _is_signed_content(self) -> bool:
+        """True se la stringa che inizia è signatureResult[i].signedDocument.content."""
+        stack = self._stack
+        return (
+            len(stack) == 4
+            and stack[0][0] == "{" and stack[0][1] == "signatureResult"
+            and stack[1][0] == "["
+            and stack[2][0] == "{" and stack[2][1] == "signedDocument"
+            and stack[3][0] == "{" and stack[3][1] == "content"
+        )
+
+    def feed(self, data: bytes) -> None:
+        """Elabora un blocco della risposta."""
+        buffer = self._buffer + data if self._buffer else data
+        position = 0
+        length = len(buffer)
+
+        while position < length:
+            if self._sink is not None or self._string is not None:
+                position = self._read_string(buffer, position)
+                if position < 0:
+                    # Escape spezzato tra due blocchi: attende il blocco successivo
+                    break
+                continue
+
+            byte = buffer[position]
+            if byte == 0x22:  # '"'
+                top = self._stack[-1] if self._stack else None
+                self._string_is_key = bool(top and top[0] == "{" and top[2])
+                if not self._string_is_key and self._is_signed_content():
+                    index = self._stack[1][1]
+                    self._sink = self._documents[index] = _Base64Sink(self._spool_threshold)
+                    self._skeleton.append(json.dumps(f"__signed_document_{index}__").encode("utf-8"))
+                else:
+                    self._string = bytearray(b'"')
+                position += 1
+                continue
+
+            if byte == 0x7B:  # '{'
+                self._stack.append(["{", None, True])
+            elif byte == 0x5B:  # '['
+                self._stack.append(["[", 0, False])
+            elif byte in (0x7D, 0x5D):  # '}' ']'
+                if self._stack:
+                    self._stack.pop()
+            elif byte == 0x3A:  # ':'
+                if self._stack and self._stack[-1][0] == "{":
+                    self._stack[-1][2] = False
+            elif byte == 0x2C:  # ','
+                if self._stack:
+                    top = self._stack[-1]
+                    if top[0] == "{":
+                        top[1], top[2] = None, True
+                    else:
+                        top[1] += 1
+            self._skeleton.append(buffer[position:position + 1])
+            position += 1
+
+        self._buffer = buffer[position:] if position < length else b""
+
+    def _read_string(self, buffer: bytes, position: int) -> int:
+        """Legge (o decodifica) una stringa fino alla fine del blocco; -1 se serve altro input."""
+        quote = buffer.find(b'"', position)
+        backslash = buffer.find(b"\\", position)
+        end = len(buffer)
+        stop = min(index for index in (quote, backslash, end) if index >= 0)
+
+        segment = buffer[position:stop]
+        if self._sink is not None:
+            self._sink.write(segment)
+        else:
+            self._string += segment
+
+        if stop == end:
+            return end
+        if stop == backslash:
+            if backslash + 1 >= end:
+                return -1
+            escaped = buffer[backslash + 1]
+            if self._sink is not None:
+                if escaped not in _BASE64_ESCAPES:
+                    raise ValueError("Contenuto base64 del documento firmato non valido")
+                self._sink.write(_BASE64_ESCAPES[escaped])
+            else:
+                self._string += buffer[backslash:backslash + 2]
+            return backslash + 2
+
+        # Fine della stringa
+        if self._sink is not None:
+            self._sink.finish()
+            self._sink = None
+        else:
+            self._string += b'"'
+            raw = bytes(self._string)
+            self._string = None
+            self._skeleton.append(raw)
+            if self._string_is_key:
+                self._stack[-1][1] = json.loads(raw)
+        return quote + 1
+
+    def close(self) -> dict:
+        """
+        Completa il parsing e restituisce il JSON della risposta senza i contenuti firmati.
+
+        Raises:
+            ValueError: Risposta incompleta o non valida
+        """
+        if self._sink is not None or self._string is not None or self._buffer or self._stack:
+            self.discard()
+            raise ValueError("Risposta di firma incompleta")
+        try:
+            return json.loads(b"".join(self._skeleton))
+        except ValueError:
+            self.discard()
+            raise
+
+    def signed_document(self, index: int):
+        """
+        File temporaneo con il PDF firmato dell'elemento `index` di signatureResult
+        (None se la risposta non lo conteneva). Il chiamante deve chiuderlo.
+        """
+        sink = self._documents.pop(index, None)
+        return sink.file if sink else None
+
+    def discard(self) -> None:
+        """Chiude i file temporanei non ancora consegnati al chiamante."""
+        for sink in self._documents.values():
+            sink.file.close()
+        self._documents.clear()
@@ -0,0 +1,66 @@
+"""
+Client DigitalOcean Spaces (S3) condiviso.
+
+Il client boto3 viene creato una sola volta e riusato da tutte le chiamate
+(upload e URL firmati): i client boto3 sono thread-safe, a differenza delle
+`boto3.session.Session`, quindi possono essere usati dai thread dei tool.
+"""
+import threading
+from typing import Optional
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+from app.config.setting import settings
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_spaces_client():
+    """
+    Restituisce il client S3 condiviso per DigitalOcean Spaces, creandolo al primo uso.
+
+    Returns:
+        botocore.client.S3: Client S3 con pool di connessioni dimensionato da settings
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                session = boto3.session.Session()
+                _client = session.client(
+                    's3',
+                    region_name=settings.DO_SPACES_REGION,
+                    endpoint_url=settings.DO_SPACES_ENDPOINT,
+                    aws_access_key_id=settings.DO_SPACES_ACCESS_KEY,
+                    aws_secret_access_key=settings.DO_SPACES_SECRET_KEY,
+                    config=Config(max_pool_connections=settings.DO_SPACES_MAX_POOL_CONNECTIONS)
+                )
+    return _client
+
+
+def get_transfer_config(
+    multipart_threshold: Optional[int] = None,
+    multipart_chunksize: Optional[int] = None,
+    max_concurrency: Optional[int] = None
+) -> TransferConfig:
+    """
+    Configurazione del trasferimento multipart: sotto la soglia viene eseguito
+    un singolo PutObject, sopra la soglia il file viene inviato a parti in parallelo.
+
+    Args:
+        multipart_threshold (int): Dimensione (byte) oltre la quale usare il multipart
+        multipart_chunksize (int): Dimensione (byte) di ogni parte
+        max_concurrency (int): Numero di parti caricate in parallelo
+
+    Returns:
+        TransferConfig: Configurazione per `upload_fileobj`
+    """
+    return TransferConfig(
+        multipart_threshold=multipart_threshold or settings.DO_SPACES_MULTIPART_THRESHOLD,
+        multipart_chunksize=multipart_chunksize or settings.DO_SPACES_MULTIPART_CHUNKSIZE,
+        max_concurrency=max_concurrency or settings.DO_SPACES_MAX_CONCURRENCY,
+        use_threads=True
+    )
@@ -0,0 +1,177 @@
+"""
+Cache lato server dei token di accesso Infocert.
+
+Il token ottenuto con il grant `password` viene conservato per utente e restituito
+finché è valido. Poco prima della scadenza (`expiresIn`) un task in background lo
+rinnova con il `refresh_token`, così le sessioni successive non rifanno il login.
+Le richieste concorrenti per lo stesso utente attendono un unico grant in corso.
+Un token rifiutato da Infocert (401/403) viene rimosso con invalidate_token.
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional
+
+
+@dataclass
+class CachedToken:
+    access_token: str
+    refresh_token: str
+    scope: str
+    expires_at: float  # time.monotonic()
+    password_hash: bytes
+    last_used: float = field(default_factory=time.monotonic)
+    refresh_task: Optional[asyncio.Task] = None
+
+    def expires_in(self) -> int:
+        return max(0, int(self.expires_at - time.monotonic()))
+
+    def to_response(self) -> dict:
+        """Formato restituito dal tool auth_token."""
+        return {
+            "access_token": self.access_token,
+            "refresh_token": self.refresh_token,
+            "expires_in": self.expires_in(),
+            "scope": self.scope
+        }
+
+
+class TokenCache:
+    """
+    Cache dei token per utente con rinnovo automatico tramite refresh token.
+
+    Args:
+        password_grant: Coroutine (username, password) -> risposta Infocert del grant password
+        refresh_grant: Coroutine (refresh_token) -> risposta Infocert del grant refresh_token
+        refresh_margin (int): Secondi prima della scadenza in cui rinnovare il token
+        max_entries (int): Numero massimo di utenti mantenuti (i meno recenti vengono rimossi)
+    """
+
+    def __init__(
+        self,
+        password_grant: Callable[[str, str], Awaitable[dict]],
+        refresh_grant: Callable[[str], Awaitable[dict]],
+        refresh_margin: int = 60,
+        max_entries: int = 1024
+    ):
+        self._password_grant = password_grant
+        self._refresh_grant = refresh_grant
+        self._refresh_margin = refresh_margin
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[str, CachedToken]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Salt di processo: gli hash delle password non sono riutilizzabili fuori dal processo
+        self._salt = os.urandom(16)
+
+    def _hash_password(self, password: str) -> bytes:
+        return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), self._salt, 1000)
+
+    def _lock_for(self, username: str) -> asyncio.Lock:
+        lock = self._locks.get(username)
+        if lock is None:
+            if len(self._locks) >= self._max_entries:
+                self._sweep_locks()
+            lock = self._locks[username] = asyncio.Lock()
+        return lock
+
+    def _sweep_locks(self) -> None:
+        """Rimuove i lock liberi degli utenti senza token in cache (es. grant falliti)."""
+        for username, lock in list(self._locks.items()):
+            if username not in self._entries and not lock.locked():
+                del self._locks[username]
+
+    def _is_valid(self, entry: CachedToken) -> bool:
+        return entry.expires_at - time.monotonic() > self._refresh_margin
+
+    async def get_token(self, username: str, password: str) -> dict:
+        """
+        Restituisce un token valido per l'utente, dalla cache o con un nuovo grant password.
+
+        Args:
+            username (str): Username Infocert
+            password (str): Password Infocert (verificata contro l'hash in cache)
+
+        Returns:
+            dict: access_token, refresh_token, expires_in (secondi residui), scope
+        """
+        password_hash = self._hash_password(password)
+
+        entry = self._entries.get(username)
+        if entry and self._is_valid(entry) and hmac.compare_digest(entry.password_hash, password_hash):
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(username)
+            return entry.to_response()
+
+        async with self._lock_for(username):
+            # Un altro chiamante potrebbe aver già completato il grant mentre attendevamo
+            entry = self._entries.get(username)
+            if entry and self._is_valid(entry) and hmac.compare_digest(entry.password_hash, password_hash):
+                entry.last_used = time.monotonic()
+                self._entries.move_to_end(username)
+                return entry.to_response()
+
+            result = await self._password_grant(username, password)
+            entry = self._store(username, result, password_hash)
+            return entry.to_response()
+
+    def _store(self, username: str, result: dict, password_hash: bytes) -> CachedToken:
+        previous = self._entries.get(username)
+        if previous and previous.refresh_task and previous.refresh_task is not asyncio.current_task():
+            previous.refresh_task.cancel()
+
+        entry = CachedToken(
+            access_token=result["accessToken"],
+            refresh_token=result.get("refreshToken") or (previous.refresh_token if previous else ""),
+            scope=result.get("scope", ""),
+            expires_at=time.monotonic() + int(result["expiresIn"]),
+            password_hash=password_hash
+        )
+        entry.refresh_task = asyncio.create_task(self._refresh_later(username, entry))
+        self._entries[username] = entry
+        self._entries.move_to_end(username)
+        while len(self._entries) > self._max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            if evicted.refresh_task and evicted.refresh_task is not asyncio.current_task():
+                evicted.refresh_task.cancel()
+        return entry
+
+    async def _refresh_later(self, username: str, entry: CachedToken) -> None:
+        """Rinnova il token poco prima della scadenza, se è stato usato dall'ultimo rinnovo."""
+        issued_at = entry.last_used
+        delay = max(0.0, entry.expires_at - issued_at - self._refresh_margin)
+        await asyncio.sleep(delay)
+
+        async with self._lock_for(username):
+            if self._entries.get(username) is not entry:
+                return
+            if entry.last_used <= issued_at:
+                # Nessuno ha usato il token: non lo teniamo vivo all'infinito
+                self._entries.pop(username, None)
+                return
+            try:
+                result = await self._refresh_grant(entry.refresh_token)
+            except Exception as e:
+                # Il prossimo get_token rifarà il grant password
+                print(f"Warning: rinnovo token fallito: {type(e).__name__}")
+                self._entries.pop(username, None)
+                return
+            self._store(username, result, entry.password_hash)
+
+    def invalidate(self, username: str) -> None:
+        """Rimuove il token dell'utente dalla cache (es. dopo un 401)."""
+        entry = self._entries.pop(username, None)
+        if entry and entry.refresh_task:
+            entry.refresh_task.cancel()
+
+    def invalidate_token(self, access_token: str) -> None:
+        """
+        Rimuove dalla cache il token rifiutato da Infocert (401/403): i tool di firma
+        ricevono solo l'access token, non lo username. Il prossimo auth_token rifà il grant.
+        """
+        for username, entry in list(self._entries.items()):
+            if hmac.compare_digest(entry.access_token.encode("utf-8"), access_token.encode("utf-8")):
+                self.invalidate(username)
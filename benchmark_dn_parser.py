@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark del parsing dei subject dei certificati.
+
+Confronta, per certificato, il costo dell'estrazione precedente (fino a 8 re.search
+non ancorate per subject) con il parser a passata singola di app/services/dn_parser.py,
+sia a freddo (subject tutti diversi, cache vuota) sia a caldo (subject ripetuti,
+come nei tenant con migliaia di certificati dello stesso gruppo di utenti).
+
+Uso:
+    python benchmark_dn_parser.py
+"""
+
+import re
+import time
+
+from app.services.dn_parser import parse_dn, clear_dn_cache
+
+
+def legacy_extract(subject_str: str) -> dict:
+    """Estrazione precedente di transform_certificates (copia per confronto)."""
+    certificate_id = None
+    dnq_match = re.search(r'DNQ=([^,]+)', subject_str)
+    if dnq_match:
+        certificate_id = dnq_match.group(1)
+    if not certificate_id:
+        cn_match = re.search(r'CN=([^,]+)', subject_str)
+        if cn_match:
+            certificate_id = cn_match.group(1)
+
+    subject_info = {}
+    for key, pattern in (
+        ("given_name", r'GIVENNAME=([^,]+)'),
+        ("surname", r'SURNAME=([^,]+)'),
+        ("common_name", r'CN=([^,]+)'),
+        ("dnq", r'DNQ=([^,]+)'),
+        ("serial_number", r'SERIALNUMBER=([^,]+)'),
+        ("country", r'C=([^,]+)'),
+    ):
+        match = re.search(pattern, subject_str)
+        if match:
+            subject_info[key] = match.group(1)
+    return {"certificateId": certificate_id, "subject_info": subject_info}
+
+
+def new_extract(subject_str: str) -> dict:
+    """Estrazione attuale: una passata, poi lookup sul dizionario."""
+    attributes = parse_dn(subject_str)
+    return {
+        "certificateId": attributes.get("DNQ") or attributes.get("CN"),
+        "subject_info": {
+            key: attributes[attribute]
+            for attribute, key in (
+                ("GIVENNAME", "given_name"), ("SURNAME", "surname"), ("CN", "common_name"),
+                ("DNQ", "dnq"), ("SERIALNUMBER", "serial_number"), ("C", "country"),
+            )
+            if attribute in attributes
+        }
+    }
+
+
+def make_subjects(count: int, distinct: int) -> list:
+    """Genera subject in stile Infocert (con `distinct` subject diversi)."""
+    subjects = []
+    for i in range(count):
+        n = i % distinct
+        subjects.append(
+            f"CN=Utente{n} Cognome{n},GIVENNAME=Utente{n},SURNAME=Cognome{n},"
+            f"SERIALNUMBER=TINIT-RSSMRA80A01H501{n % 10},DNQ=2024{n:09d},"
+            f"O=Azienda {n % 50} S.p.A.,OU=Firma Remota,C=IT"
+        )
+    return subjects
+
+
+def measure(function, subjects: list, repeat: int = 5) -> float:
+    """Restituisce il tempo minimo per certificato in microsecondi."""
+    best = float("inf")
+    for _ in range(repeat):
+        clear_dn_cache()
+        start = time.perf_counter()
+        for subject in subjects:
+            function(subject)
+        best = min(best, time.perf_counter() - start)
+    return best / len(subjects) * 1e6
+
+
+def main():
+    print("=" * 60)
+    print("  BENCHMARK PARSING SUBJECT CERTIFICATI")
+    print("=" * 60)
+    print(f"\n{'certificati':>12} {'distinti':>9} {'legacy µs':>10} {'nuovo µs':>10} {'speedup':>8}")
+
+    for count, distinct in ((1000, 1000), (5000, 5000), (5000, 500), (20000, 200)):
+        subjects = make_subjects(count, distinct)
+        legacy = measure(legacy_extract, subjects)
+        new = measure(new_extract, subjects)
+        print(f"{count:>12} {distinct:>9} {legacy:>10.2f} {new:>10.2f} {legacy / new:>7.1f}x")
+
+    print("\n" + "=" * 60)
+    print("✅ Benchmark completato!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark della ricerca delle keyword di firma (fase 2 di analyze_pdf_signature_fields).
+
+Confronta, su contratti generati di 100+ pagine:
+- legacy: page.extract_text() e poi page.extract_words() per ogni keyword presente
+  (fino a 8 raggruppamenti in parole per pagina, sui caratteri convertiti da page.chars)
+- single-pass: parole estratte una sola volta dal layout pdfminer (extract_page_words)
+  e ricerca Aho-Corasick di tutte le keyword e i pattern di linea
+  (app/services/keyword_scan.py)
+
+La versione single-pass trova anche le keyword su più parole ('sign here'), quindi
+riporta qualche hint in più.
+
+Uso:
+    python benchmark_keyword_scan.py [numero di pagine...]
+"""
+
+import io
+import sys
+import time
+
+import pdfplumber
+
+from app.services.keyword_scan import extract_page_words, scan_page_words
+
+LINES_PER_PAGE = 45
+CLAUSE = "Art. {page}.{line} Le parti convengono che il presente contratto resta valido fino a disdetta scritta."
+SIGNATURE_LINES = [
+    "Il sottoscritto dichiara di aver letto e approvato le clausole che precedono.",
+    "Firma del Cliente: ______________________     Firmatario: ..........................",
+    "Signature / Sign here: ____________________   Firma: ________________",
+]
+
+
+def make_contract(pages: int) -> bytes:
+    """Contratto di `pages` pagine A4; una pagina su cinque (e l'ultima) ha il blocco firme."""
+    objects = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(b"")
+    page_tree = add(b"")
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    kids = []
+    for page in range(1, pages + 1):
+        lines = [CLAUSE.format(page=page, line=line) for line in range(1, LINES_PER_PAGE + 1)]
+        if page % 5 == 0 or page == pages:
+            lines[-len(SIGNATURE_LINES):] = SIGNATURE_LINES
+        text = b"BT /F1 9 Tf 11 TL 40 800 Td " + b" ".join(
+            b"(" + line.encode("latin-1") + b") '" for line in lines
+        ) + b" ET"
+        content = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(text), text))
+        kids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (page_tree, content, font)
+        ))
+    objects[page_tree - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), pages
+    )
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % page_tree
+
+    output = bytearray(b"%PDF-1.7\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(output)
+
+
+def legacy_scan(pdf) -> list:
+    """Fase 2 precedente di _collect_signature_hints (copia per confronto)."""
+    keywords = ["firma", "signature", "sottoscritto", "firmatario", "sign here", "sign:", "firma:"]
+    line_patterns = ["_____", ".....", "-----"]
+    hints = []
+    for page_num, page in enumerate(pdf.pages, start=1):
+        text = page.extract_text()
+        if not text:
+            continue
+        text_lower = text.lower()
+        for keyword in keywords:
+            if keyword in text_lower:
+                for word in page.extract_words():
+                    if keyword in word["text"].lower():
+                        hints.append((keyword, page_num, word["text"]))
+                        break
+        for pattern in line_patterns:
+            if pattern in text:
+                hints.append(("line_pattern", page_num, pattern))
+                break
+        page.close()
+    return hints
+
+
+def single_pass_scan(pdf) -> list:
+    hints = []
+    for page_num, page in enumerate(pdf.pages, start=1):
+        hints.extend(scan_page_words(extract_page_words(page), page_num, page.height))
+        page.close()
+    return hints
+
+
+def measure(scan, data: bytes):
+    start = time.perf_counter()
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        hints = scan(pdf)
+    return time.perf_counter() - start, hints
+
+
+def main():
+    page_counts = [int(pages) for pages in sys.argv[1:]] or [100, 200]
+
+    print("=" * 60)
+    print("  BENCHMARK RICERCA KEYWORD DI FIRMA")
+    print("=" * 60)
+    print(f"\n{'pagine':>7} {'legacy s':>10} {'single-pass s':>14} {'speed-up':>9} {'hint legacy/nuovi':>18}")
+
+    for pages in page_counts:
+        data = make_contract(pages)
+        legacy_time, legacy_hints = measure(legacy_scan, data)
+        new_time, new_hints = measure(single_pass_scan, data)
+        print(f"{pages:>7} {legacy_time:>10.2f} {new_time:>14.2f} {legacy_time / new_time:>8.1f}x "
+              f"{len(legacy_hints):>8}/{len(new_hints):<9}")
+
+    print("\n" + "=" * 60)
+    print("✅ Benchmark completato!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark della dimensione del corpo della richiesta di firma rispetto alle pagine.
+
+Con page_signature='tutte_le_pagine' ogni talloncino porta con sé l'immagine PNG in
+base64: per ogni numero di pagine confronta il corpo (Content-Length di
+StreamingSignBody, documento di 100 KB) con un talloncino per pagina e con il limite
+di talloncini visibili (limit_visible_pages, un solo talloncino oltre il limite).
+
+Uso:
+    python benchmark_sign_request_body.py [numero di pagine...]
+"""
+
+import io
+import sys
+
+from app.services.sign_request import (
+    StreamingSignBody, build_signature_fields, limit_visible_pages, load_signature_image
+)
+
+DOCUMENT_SIZE = 100 * 1024
+MAX_VISIBLE_FIELDS = 50  # Default di SIGN_MAX_VISIBLE_FIELDS
+COORDS = {"llx": 500, "lly": 15, "urx": 580, "ury": 45}
+VISIBLE_TEXT = "Firmato digitalmente da MARIO ROSSI"
+
+
+def body_size(signature_pages: list, signature_image: str) -> int:
+    signature_fields = build_signature_fields(
+        signature_pages, [COORDS] * len(signature_pages), VISIBLE_TEXT, signature_image
+    )
+    body = StreamingSignBody({
+        "applicationId": "trusty",
+        "pin": "0000",
+        "padesSignatures": [{
+            "signatureLevel": "BASELINE-B",
+            "requestId": "benchmark",
+            "document": {
+                "content": StreamingSignBody.placeholder(0),
+                "contentType": "application/pdf",
+                "attachName": "benchmark.pdf"
+            },
+            "packaging": "ENVELOPED",
+            "isVisible": True,
+            "signatureFields": signature_fields
+        }]
+    }, [io.BytesIO(b"%PDF-1.7\n" + bytes(DOCUMENT_SIZE))])
+    return body.content_length
+
+
+def main():
+    page_counts = [int(pages) for pages in sys.argv[1:]] or [1, 10, 50, 100, 500, 2000]
+    signature_image = load_signature_image()
+
+    print("=" * 60)
+    print("  BENCHMARK DIMENSIONE RICHIESTA DI FIRMA")
+    print("=" * 60)
+    print(f"\nImmagine del talloncino: {len(signature_image)} byte in base64")
+    print(f"\n{'pagine':>7} {'per pagina KB':>14} {f'limite {MAX_VISIBLE_FIELDS} KB':>12} {'talloncini':>11}")
+
+    for pages in page_counts:
+        signature_pages = list(range(1, pages + 1))
+        visible_pages = limit_visible_pages(signature_pages, MAX_VISIBLE_FIELDS)
+        every_page = body_size(signature_pages, signature_image)
+        limited = body_size(visible_pages, signature_image)
+        print(f"{pages:>7} {every_page / 1024:>14.1f} {limited / 1024:>12.1f} {len(visible_pages):>11}")
+
+    print("\n" + "=" * 60)
+    print("✅ Benchmark completato!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
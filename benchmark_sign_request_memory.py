@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark di memoria della richiesta di firma (/certificates/{id}/sign).
+
+Per ogni dimensione di documento avvia due processi separati e misura il picco
+di RSS (ru_maxrss) oltre la memoria già occupata dopo gli import:
+- legacy: contenuto letto in memoria, base64 in una stringa, JSON serializzato da httpx
+- streaming: StreamingSignBody, che codifica in base64 il file durante l'invio
+
+La richiesta viene "inviata" a un transport locale che consuma il corpo a blocchi
+senza conservarlo, quindi misura solo il costo lato client.
+
+Uso:
+    python benchmark_sign_request_memory.py [dimensioni in MB...]
+"""
+
+import asyncio
+import base64
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+import httpx
+
+from app.services.sign_request import StreamingSignBody
+
+
+class CountingTransport(httpx.AsyncBaseTransport):
+    """Transport che legge il corpo della richiesta a blocchi e ne conta i byte."""
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        received = 0
+        async for chunk in request.stream:
+            received += len(chunk)
+        return httpx.Response(200, json={"received": received})
+
+
+def peak_rss_mb() -> float:
+    # Su Linux ru_maxrss è in KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_document(size_mb: int) -> str:
+    """Crea un file temporaneo della dimensione richiesta senza tenerlo in memoria."""
+    handle, path = tempfile.mkstemp(suffix=".pdf")
+    with os.fdopen(handle, "wb") as document:
+        document.write(b"%PDF-1.7\n")
+        for _ in range(size_mb):
+            document.write(os.urandom(1024 * 1024))
+    return path
+
+
+def signature_entry(content) -> dict:
+    return {
+        "signatureLevel": "BASELINE-B",
+        "requestId": "benchmark",
+        "document": {"content": content, "contentType": "application/pdf", "attachName": "benchmark.pdf"},
+        "packaging": "ENVELOPED",
+        "isVisible": True,
+        "signatureFields": []
+    }
+
+
+async def send(mode: str, path: str) -> int:
+    async with httpx.AsyncClient(transport=CountingTransport()) as client:
+        if mode == "legacy":
+            with open(path, "rb") as document:
+                content = document.read()
+            content_base64 = base64.b64encode(content).decode("utf-8")
+            body = {"applicationId": "trusty", "pin": "0000", "padesSignatures": [signature_entry(content_base64)]}
+            response = await client.post("http://benchmark/sign", json=body)
+        else:
+            with open(path, "rb") as document:
+                body = StreamingSignBody(
+                    {"applicationId": "trusty", "pin": "0000",
+                     "padesSignatures": [signature_entry(StreamingSignBody.placeholder(0))]},
+                    [document]
+                )
+                response = await client.post("http://benchmark/sign", headers=body.headers(), content=body)
+        return response.json()["received"]
+
+
+def run_child(mode: str, size_mb: int) -> None:
+    path = make_document(size_mb)
+    try:
+        baseline = peak_rss_mb()
+        received = asyncio.run(send(mode, path))
+        print(f"{peak_rss_mb() - baseline:.1f} {received}")
+    finally:
+        os.remove(path)
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        run_child(sys.argv[2], int(sys.argv[3]))
+        return
+
+    sizes = [int(size) for size in sys.argv[1:]] or [10, 50, 100]
+
+    print("=" * 60)
+    print("  BENCHMARK MEMORIA RICHIESTA DI FIRMA")
+    print("=" * 60)
+    print(f"\n{'documento MB':>12} {'modalità':>10} {'picco MB':>9} {'x documento':>12} {'corpo MB':>9}")
+
+    for size_mb in sizes:
+        for mode in ("legacy", "streaming"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", mode, str(size_mb)],
+                capture_output=True, text=True, check=True
+            ).stdout.split()
+            peak, received = float(output[0]), int(output[1])
+            print(f"{size_mb:>12} {mode:>10} {peak:>9.1f} {peak / size_mb:>11.2f}x {received / 1024 / 1024:>9.1f}")
+
+    print("\n" + "=" * 60)
+    print("✅ Benchmark completato!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
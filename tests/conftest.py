@@ -0,0 +1,27 @@
+"""
+Configurazione comune dei test.
+
+Settings richiede le credenziali Infocert/Spaces nell'ambiente: qui vengono impostati
+valori fittizi (solo se mancanti) prima che i moduli dell'app vengano importati, e le
+directory locali (cache, giornale) puntano a directory temporanee.
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_TEST_ENVIRONMENT = {
+    "CLIENT_ID": "test-client",
+    "CLIENT_SECRET": "test-secret",
+    "SIGNATURE_API": "http://signature.test",
+    "AUTHORIZATION_API": "http://authorization.test",
+    "TENANT": "test",
+    "DO_SPACES_ACCESS_KEY": "test-key",
+    "DO_SPACES_SECRET_KEY": "test-secret",
+    "DO_SPACES_BUCKET": "test-bucket",
+}
+for _name, _value in _TEST_ENVIRONMENT.items():
+    os.environ.setdefault(_name, _value)
+os.environ.setdefault("DOCUMENT_CACHE_DIR", tempfile.mkdtemp(prefix="test-document-cache-"))
+os.environ.setdefault("SIGN_BATCH_JOURNAL_DIR", tempfile.mkdtemp(prefix="test-batch-journal-"))
@@ -0,0 +1,55 @@
+"""Infocert, origine dei documenti e Spaces simulati per i test dei tool di firma."""
+import json
+
+import httpx
+
+import app.main as main
+from app.services import http_client
+from pdf_factory import make_pdf
+
+
+class FakeServices:
+    def __init__(self):
+        self.pdf = make_pdf(3)
+        self.sign_requests = []
+        self.downloads = 0
+        self.uploads = []
+        self.failing_uploads = set()
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        url = str(request.url)
+        if url.endswith("/certificates"):
+            return httpx.Response(200, json=[{"subject": "CN=Mario Rossi,DNQ=123"}])
+        if url.endswith("/sign"):
+            self.sign_requests.append(request)
+            body = json.loads(request.content)
+            return httpx.Response(200, json={"signatureResult": [
+                {"requestId": item["requestId"], "isOk": True, "signedDocument": {"content": item["document"]["content"]}}
+                for item in body["padesSignatures"]
+            ]})
+        self.downloads += 1
+        return httpx.Response(200, content=self.pdf)
+
+    def upload(self, content, filename):
+        if filename in self.failing_uploads:
+            return {"success": False, "error": "Upload error: Spaces non disponibile"}
+        key = f"signed_documents/{filename}"
+        self.uploads.append((key, content.read()))
+        return {"success": True, "signed_url": f"https://spaces.test/{key}", "expires_in": 3600, "spaces_key": key}
+
+    def install(self, monkeypatch, journal) -> "FakeServices":
+        """Sostituisce client HTTP, upload, URL firmati e giornale dei batch in app.main."""
+        monkeypatch.setattr(http_client.async_http_client, "client", httpx.AsyncClient(transport=httpx.MockTransport(self.handler)))
+        monkeypatch.setattr(main, "upload_to_digitalocean_spaces", self.upload)
+        monkeypatch.setattr(main, "presign_spaces_document", lambda key: {
+            "success": True, "signed_url": f"https://spaces.test/{key}?renewed", "expires_in": 3600
+        })
+        monkeypatch.setattr(main, "batch_journal", journal)
+        return self
+
+
+def run_batch(links, batch_id=None, certificate_id="cert-1", infocert_sat="SAT", transaction_id="transaction"):
+    documents = [main.BatchDocument(link_pdf=link, page_signature="ultima_pagina") for link in links]
+    return main.sign_documents_batch(
+        certificate_id, "token", infocert_sat, transaction_id, "1234", documents, batch_id=batch_id
+    )
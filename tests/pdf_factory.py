@@ -0,0 +1,124 @@
+"""PDF minimi generati in memoria per i test (una riga di testo e una linea per pagina)."""
+from typing import Dict, List, Optional, Tuple
+
+
+def make_pdf(
+    pages: int = 3,
+    text: str = "Firma del Cliente ________",
+    sizes: Optional[List[Tuple[int, int]]] = None,
+    rotate: Optional[Dict[int, int]] = None,
+    signature_field: bool = False,
+    graphics: str = "0 0 0 RG 300 80 m 500 80 l S",
+    form_fields: Optional[List[dict]] = None,
+    media_boxes: Optional[Dict[int, Tuple[int, int, int, int]]] = None,
+    crop_boxes: Optional[Dict[int, Tuple[int, int, int, int]]] = None,
+    texts: Optional[Dict[int, str]] = None
+) -> bytes:
+    """
+    Args:
+        pages (int): Numero di pagine
+        text (str): Testo scritto su ogni pagina (seguito da " p<numero>")
+        sizes (list): (larghezza, altezza) di ogni pagina, default A4
+        rotate (dict): Indice pagina (0-based) -> /Rotate
+        signature_field (bool): Campo firma 'Firma1' sull'ultima pagina
+        graphics (str): Operatori grafici di ogni pagina (default una linea da 300,80 a 500,80)
+        form_fields (list): Albero AcroForm; ogni campo è un dict con 'name' (/T, None per
+            omettere il nome), 'type' (/FT, facoltativo), 'kids' (campi figli) oppure 'widgets'
+            [(indice pagina 0-based, (x0, y0, x1, y1))]. Con 'merged' l'unico widget coincide
+            con il campo; con 'page_ref': False i widget non hanno /P (pagina dalle /Annots)
+        media_boxes (dict): Indice pagina (0-based) -> /MediaBox (al posto di sizes)
+        crop_boxes (dict): Indice pagina (0-based) -> /CropBox
+        texts (dict): Indice pagina (0-based) -> testo al posto di `text`
+    """
+    objects: List[Optional[bytes]] = []
+
+    def add(value: Optional[bytes]) -> int:
+        objects.append(value)
+        return len(objects)
+
+    catalog = add(None)
+    page_tree = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    kids, fields, page_entries = [], [], []
+    annotations: Dict[int, List[int]] = {}
+    for index in range(pages):
+        width, height = sizes[index] if sizes else (595, 842)
+        page_text = texts[index] if texts and index in texts else text
+        content = f"BT /F1 12 Tf 72 100 Td ({page_text} p{index + 1}) Tj ET\n{graphics}\n".encode()
+        stream = add(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        extra = b""
+        if rotate and index in rotate:
+            extra += b" /Rotate %d" % rotate[index]
+        page = add(None)
+        if signature_field and index == pages - 1:
+            widget = add(
+                b"<< /Type /Annot /Subtype /Widget /FT /Sig /T (Firma1) /Rect [400 50 500 100] /P %d 0 R >>" % page
+            )
+            fields.append(widget)
+            annotations.setdefault(index, []).append(widget)
+        page_entries.append((page, width, height, stream, extra))
+        kids.append(page)
+
+    def widget_entries(page_index: int, rect: Tuple[float, ...], page_ref: bool) -> bytes:
+        entries = b"/Type /Annot /Subtype /Widget /Rect [%s]" % " ".join(str(value) for value in rect).encode()
+        if page_ref:
+            entries += b" /P %d 0 R" % kids[page_index]
+        return entries
+
+    def add_field(spec: dict, parent: Optional[int]) -> int:
+        number = add(None)
+        entries = b""
+        if spec.get("name") is not None:
+            entries += b" /T (%s)" % spec["name"].encode("latin-1")
+        if spec.get("type"):
+            entries += b" /FT /%s" % spec["type"].encode()
+        if parent is not None:
+            entries += b" /Parent %d 0 R" % parent
+        page_ref = spec.get("page_ref", True)
+        children = [add_field(kid, number) for kid in spec.get("kids", [])]
+        if spec.get("merged"):
+            (page_index, rect), = spec["widgets"]
+            entries += b" " + widget_entries(page_index, rect, page_ref)
+            annotations.setdefault(page_index, []).append(number)
+        else:
+            for page_index, rect in spec.get("widgets", []):
+                widget = add(b"<< %s /Parent %d 0 R >>" % (widget_entries(page_index, rect, page_ref), number))
+                annotations.setdefault(page_index, []).append(widget)
+                children.append(widget)
+        if children:
+            entries += b" /Kids [" + b" ".join(b"%d 0 R" % child for child in children) + b"]"
+        objects[number - 1] = b"<<" + entries + b" >>"
+        return number
+
+    for spec in form_fields or []:
+        fields.append(add_field(spec, None))
+
+    for index, (page, width, height, stream, extra) in enumerate(page_entries):
+        media_box = media_boxes[index] if media_boxes and index in media_boxes else (0, 0, width, height)
+        if crop_boxes and index in crop_boxes:
+            extra += b" /CropBox [%d %d %d %d]" % crop_boxes[index]
+        if index in annotations:
+            extra += b" /Annots [" + b" ".join(b"%d 0 R" % number for number in annotations[index]) + b"]"
+        objects[page - 1] = (
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [%d %d %d %d] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R >> >>%s >>" % (page_tree, *media_box, stream, font, extra)
+        )
+    objects[page_tree - 1] = (
+        b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % kid for kid in kids) + b"] /Count %d >>" % pages
+    )
+    acroform = b""
+    if fields:
+        acroform = b" /AcroForm << /Fields [" + b" ".join(b"%d 0 R" % f for f in fields) + b"] /SigFlags 3 >>"
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R%s >>" % (page_tree, acroform)
+
+    output = bytearray(b"%PDF-1.7\n")
+    offsets = []
+    for number, value in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + value + b"\nendobj\n"
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(output)
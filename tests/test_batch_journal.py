@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import io
+import os
+import sqlite3
+
+import httpx
+import pytest
+from pdfminer.pdfparser import PDFSyntaxError
+
+import app.main as main
+from app.services import batch_journal
+from app.services.batch_journal import (
+    DOWNLOADED, PENDING, SIGNED, UPLOADED, BatchJournal, BatchMismatchError, batch_owner
+)
+from fake_services import FakeServices, run_batch as sign_batch
+
+OWNER = batch_owner("cert-1")
+LINKS = ["http://docs.test/a.pdf", "http://docs.test/b.pdf"]
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return BatchJournal(str(tmp_path / "journal"))
+
+
+def test_new_batch_starts_pending(journal):
+    entries = journal.start("batch-1", LINKS, OWNER)
+
+    assert [entry.stage for entry in entries.values()] == [PENDING, PENDING]
+    assert [entry.link_pdf for entry in entries.values()] == LINKS
+
+
+def test_stages_are_persisted(journal):
+    journal.start("batch-1", LINKS, OWNER)
+    journal.mark_downloaded("batch-1", 0, 3, [3])
+    path = journal.mark_signed("batch-1", 1, io.BytesIO(b"%PDF-signed"))
+
+    entries = journal.start("batch-1", LINKS, OWNER)
+    assert entries[0].stage == DOWNLOADED
+    assert entries[0].signature_pages == [3]
+    assert entries[1].stage == SIGNED
+    with open(entries[1].signed_path, "rb") as kept:
+        assert kept.read() == b"%PDF-signed"
+
+    journal.mark_uploaded("batch-1", 1, "signed_documents/b.pdf")
+    entries = journal.start("batch-1", LINKS, OWNER)
+    assert entries[1].stage == UPLOADED
+    assert entries[1].spaces_key == "signed_documents/b.pdf"
+    assert not os.path.exists(path)
+
+
+def test_mismatched_documents_are_rejected(journal):
+    journal.start("batch-1", LINKS, OWNER)
+
+    with pytest.raises(BatchMismatchError):
+        journal.start("batch-1", list(reversed(LINKS)), OWNER)
+
+
+def test_other_certificate_cannot_resume(journal):
+    journal.start("batch-1", LINKS, OWNER)
+
+    with pytest.raises(BatchMismatchError):
+        journal.start("batch-1", LINKS, batch_owner("cert-2"))
+
+
+def test_purge_removes_expired_batches_and_files(tmp_path):
+    directory = str(tmp_path / "journal")
+    journal = BatchJournal(directory)
+    journal.start("batch-1", LINKS, OWNER)
+    path = journal.mark_signed("batch-1", 0, io.BytesIO(b"%PDF-signed"))
+    assert os.path.exists(path)
+
+    # Un nuovo processo con TTL già scaduto: il batch viene dimenticato all'apertura
+    expired = BatchJournal(directory, ttl=-1)
+    entries = expired.start("batch-1", list(reversed(LINKS)), batch_owner("cert-2"))
+
+    assert not os.path.exists(path)
+    assert [entry.stage for entry in entries.values()] == [PENDING, PENDING]
+
+
+# sign_documents_batch con Infocert, documenti e Spaces simulati
+
+
+@pytest.fixture
+def services(monkeypatch, journal):
+    return FakeServices().install(monkeypatch, journal)
+
+
+def run_batch(batch_id=None, certificate_id="cert-1"):
+    return asyncio.run(sign_batch(LINKS, batch_id, certificate_id))
+
+
+def test_batch_resumes_signed_and_uploaded_documents(services):
+    services.failing_uploads.add("b.pdf")
+    first = run_batch()
+    assert [result["success"] for result in first["results"]] == [True, False]
+    assert len(services.sign_requests) == 1
+
+    services.failing_uploads.clear()
+    second = run_batch(first["batch_id"])
+
+    # Nessun nuovo download né firma: a.pdf riceve solo un nuovo URL, b.pdf viene solo caricato
+    assert len(services.sign_requests) == 1
+    assert services.downloads == 2
+    assert second["signed"] == 2
+    uploaded, signed = second["results"]
+    assert uploaded["resumed"] == UPLOADED
+    assert uploaded["signed_url"].endswith("?renewed")
+    assert signed["resumed"] == SIGNED
+    assert [key for key, _ in services.uploads] == ["signed_documents/a.pdf", "signed_documents/b.pdf"]
+    assert services.uploads[1][1].startswith(b"%PDF")
+
+
+def test_batch_rejects_resume_from_another_certificate(services):
+    first = run_batch()
+
+    result = run_batch(first["batch_id"], certificate_id="cert-2")
+
+    assert result["type"] == "error"
+    assert len(services.sign_requests) == 1
+
+
+def test_journal_errors_do_not_abort_the_batch(services, journal, monkeypatch):
+    def broken(*args):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(journal, "mark_downloaded", broken)
+    monkeypatch.setattr(journal, "mark_signed", broken)
+
+    result = run_batch()
+
+    assert result["signed"] == 2
+
+
+def test_journal_directory_is_private(journal, tmp_path):
+    journal.start("batch-1", LINKS, OWNER)
+
+    for folder in ("journal", os.path.join("journal", "signed")):
+        assert os.stat(tmp_path / folder).st_mode & 0o777 == 0o700
+
+
+def test_corrupt_pdf_fails_only_its_document(services, monkeypatch):
+    corrupt = b"%PDF-1.7\nnon un PDF\n%%EOF"
+    handler = services.handler
+
+    def serve_corrupt_b(request):
+        if str(request.url).endswith("/b.pdf"):
+            return httpx.Response(200, content=corrupt)
+        return handler(request)
+
+    # Il conteggio delle pagine tollera molti PDF rotti (default 1 pagina): qui il parser
+    # solleva come pdfminer/pyHanko sui documenti che non riesce a leggere
+    page_count = main._page_count
+
+    def strict_page_count(document):
+        if document.sha256 == hashlib.sha256(corrupt).hexdigest():
+            raise PDFSyntaxError("No /Root object! - Is this really a PDF?")
+        return page_count(document)
+
+    monkeypatch.setattr(services, "handler", serve_corrupt_b)
+    services.install(monkeypatch, main.batch_journal)
+    monkeypatch.setattr(main, "_page_count", strict_page_count)
+
+    result = run_batch()
+
+    ok, failed = result["results"]
+    assert ok["success"] is True
+    assert failed["success"] is False
+    assert "No /Root object" in failed["error"]
+    assert result["signed"] == 1
+    assert len(services.sign_requests) == 1
+
+
+def test_running_journal_purges_expired_batches(tmp_path, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(batch_journal.time, "time", lambda: now[0])
+    journal = BatchJournal(str(tmp_path / "journal"), ttl=3600)
+    journal.start("batch-1", LINKS, OWNER)
+    path = journal.mark_signed("batch-1", 0, io.BytesIO(b"%PDF-signed"))
+
+    # Connessione già aperta: la pulizia avviene durante l'esecuzione, non solo all'avvio
+    now[0] += 3600 + batch_journal.PURGE_INTERVAL
+    journal.start("batch-2", LINKS, OWNER)
+
+    assert not os.path.exists(path)
+    entries = journal.start("batch-1", list(reversed(LINKS)), batch_owner("cert-2"))
+    assert [entry.stage for entry in entries.values()] == [PENDING, PENDING]
+
+
+def test_purge_is_throttled(tmp_path, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(batch_journal.time, "time", lambda: now[0])
+    journal = BatchJournal(str(tmp_path / "journal"), ttl=60)
+    journal.start("batch-1", LINKS, OWNER)
+
+    # Scaduto ma entro PURGE_INTERVAL dall'ultima pulizia: il batch resta
+    now[0] += 61
+    journal.start("batch-2", LINKS, OWNER)
+    assert journal.start("batch-1", LINKS, OWNER)[0].stage == PENDING
+    with pytest.raises(BatchMismatchError):
+        journal.start("batch-1", LINKS, batch_owner("cert-2"))
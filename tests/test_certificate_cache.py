@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from app.services.certificate_cache import CertificateCache
+
+
+class FakeFetch:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = 0
+
+    async def __call__(self, access_token):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise RuntimeError("certificati non disponibili")
+        return {"id": f"cert-{access_token}"}
+
+
+def test_concurrent_callers_share_one_fetch():
+    cache = CertificateCache()
+    fetch = FakeFetch()
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_fetch("token", fetch) for _ in range(5)))
+
+    certificates = asyncio.run(run())
+
+    assert fetch.calls == 1
+    assert all(certificate == {"id": "cert-token"} for certificate in certificates)
+    assert cache._locks == {}
+
+
+def test_cache_hit_does_not_create_locks():
+    cache = CertificateCache()
+    cache.put("token", {"id": "cert-token"})
+
+    async def fail(access_token):
+        raise AssertionError("fetch non atteso")
+
+    assert asyncio.run(cache.get_or_fetch("token", fail)) == {"id": "cert-token"}
+    assert cache._locks == {}
+
+
+def test_failed_fetch_releases_its_lock():
+    cache = CertificateCache()
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(cache.get_or_fetch("token", FakeFetch(fail=True)))
+
+    assert cache._locks == {}
+    assert cache.get("token") is None
+
+
+def test_locks_do_not_grow_with_distinct_tokens():
+    cache = CertificateCache(max_entries=2)
+    fetch = FakeFetch()
+
+    async def run():
+        for index in range(20):
+            await cache.get_or_fetch(f"token-{index}", fetch)
+
+    asyncio.run(run())
+
+    assert cache._locks == {}
+    assert len(cache._entries) == 2
@@ -0,0 +1,61 @@
+import pytest
+
+from app.services.dn_parser import clear_dn_cache, parse_dn
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_dn_cache()
+    yield
+    clear_dn_cache()
+
+
+@pytest.mark.parametrize("dn, expected", [
+    ("CN=Mario Rossi,DNQ=2024501530362,C=IT", {"CN": "Mario Rossi", "DNQ": "2024501530362", "C": "IT"}),
+    ("cn=Mario Rossi , c=IT", {"CN": "Mario Rossi", "C": "IT"}),
+    ("CN=Mario,CN=Altro", {"CN": "Mario"}),
+])
+def test_simple_dn(dn, expected):
+    assert parse_dn(dn) == expected
+
+
+@pytest.mark.parametrize("dn, expected", [
+    ("CN=Rossi, Mario,C=IT", {"CN": "Rossi", "C": "IT"}),
+    ("CN=a,,C=IT", {"CN": "a", "C": "IT"}),
+    (",CN=a,C=IT", {"CN": "a", "C": "IT"}),
+    ("CN=a,=vuoto,C=IT", {"CN": "a", "C": "IT"}),
+    ('CN=a,"senza tipo, con virgola",C=IT', {"CN": "a", "C": "IT"}),
+    ("CN=a,C=IT,", {"CN": "a", "C": "IT"}),
+    ("CN=a,x y=b,C=IT", {"CN": "a", "C": "IT"}),
+])
+def test_malformed_rdn_is_skipped(dn, expected):
+    assert parse_dn(dn) == expected
+
+
+@pytest.mark.parametrize("dn, expected", [
+    ('CN="Rossi, Mario",C=IT', {"CN": "Rossi, Mario", "C": "IT"}),
+    ('CN="Mario \\"Super\\" Rossi",C=IT', {"CN": 'Mario "Super" Rossi', "C": "IT"}),
+    ("CN=Rossi\\, Mario,C=IT", {"CN": "Rossi, Mario", "C": "IT"}),
+    ("CN=A\\+B\\\\C,C=IT", {"CN": "A+B\\C", "C": "IT"}),
+    ("CN=Nicol\\C3\\B2 Bianchi,C=IT", {"CN": "Nicolò Bianchi", "C": "IT"}),
+    ("CN=Trailing\\ ,C=IT", {"CN": "Trailing ", "C": "IT"}),
+    ("CN=Mario+SN=Rossi;C=IT", {"CN": "Mario", "SN": "Rossi", "C": "IT"}),
+])
+def test_quoted_and_escaped_values(dn, expected):
+    assert parse_dn(dn) == expected
+
+
+def test_numeric_oid_attribute_types():
+    dn = "2.5.4.3=Mario Rossi,2.5.4.46=2024501530362+C=IT"
+
+    assert parse_dn(dn) == {"2.5.4.3": "Mario Rossi", "2.5.4.46": "2024501530362", "C": "IT"}
+
+
+def test_country_does_not_match_inside_other_types():
+    assert parse_dn("DC=example,CN=Mario") == {"DC": "example", "CN": "Mario"}
+
+
+def test_result_is_a_copy():
+    parse_dn("CN=Mario,C=IT")["CN"] = "modificato"
+
+    assert parse_dn("CN=Mario,C=IT")["CN"] == "Mario"
@@ -0,0 +1,55 @@
+import io
+import os
+import stat
+
+import pytest
+
+from app.services.document_cache import DocumentCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DocumentCache(str(tmp_path / "cache"), max_disk_bytes=1024 * 1024, max_memory_bytes=64 * 1024)
+
+
+def _mode(path) -> int:
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_cache_files_are_private(cache, tmp_path):
+    cache.store_document("http://docs.test/a.pdf", io.BytesIO(b"%PDF-a"), "a" * 64)
+    cache.put_result("a" * 64, "signature_hints", {"pages": [1]})
+
+    root = tmp_path / "cache"
+    for folder in (root, root / "documents", root / "results"):
+        assert _mode(folder) == 0o700
+    for folder in ("documents", "results"):
+        for entry in os.scandir(root / folder):
+            assert _mode(entry.path) == 0o600
+
+
+def test_disk_eviction_is_lru_by_size(tmp_path):
+    cache = DocumentCache(str(tmp_path / "cache"), max_disk_bytes=1000, max_memory_bytes=64 * 1024)
+    for name in ("a", "b"):
+        cache.store_document(f"http://docs.test/{name}.pdf", io.BytesIO(name.encode() * 400), name * 64)
+
+    # a.pdf usato di recente: al superamento del limite viene rimosso b.pdf
+    cache.open_document("a" * 64).close()
+    cache.store_document("http://docs.test/c.pdf", io.BytesIO(b"c" * 400), "c" * 64)
+
+    assert cache.lookup("http://docs.test/a.pdf") is not None
+    assert cache.lookup("http://docs.test/b.pdf") is None
+    assert cache.lookup("http://docs.test/c.pdf") is not None
+    assert cache.open_document("b" * 64) is None
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["disk_bytes"] == 800
+
+
+def test_document_larger_than_cache_is_not_indexed(tmp_path):
+    cache = DocumentCache(str(tmp_path / "cache"), max_disk_bytes=100, max_memory_bytes=64 * 1024)
+
+    cache.store_document("http://docs.test/big.pdf", io.BytesIO(b"x" * 500), "x" * 64)
+
+    assert cache.lookup("http://docs.test/big.pdf") is None
+    assert cache.stats()["disk_bytes"] == 0
@@ -0,0 +1,136 @@
+import asyncio
+import errno
+import os
+
+import httpx
+import pytest
+
+from app.services import download, http_client, private_dir
+from app.services.document_cache import DocumentCache
+
+
+class Origin:
+    """Origine dei documenti con supporto a If-None-Match / If-Modified-Since."""
+
+    def __init__(self, content: bytes, etag=None, last_modified=None):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.requests = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        headers = {}
+        if self.etag:
+            headers["ETag"] = self.etag
+        if self.last_modified:
+            headers["Last-Modified"] = self.last_modified
+        if self.etag and request.headers.get("If-None-Match") == self.etag:
+            return httpx.Response(304, headers=headers)
+        if not self.etag and self.last_modified and request.headers.get("If-Modified-Since") == self.last_modified:
+            return httpx.Response(304, headers=headers)
+        return httpx.Response(200, content=self.content, headers=headers)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = DocumentCache(str(tmp_path / "cache"), max_disk_bytes=1024 * 1024, max_memory_bytes=64 * 1024)
+    monkeypatch.setattr(download, "document_cache", cache)
+    return cache
+
+
+def _serve(monkeypatch, origin: Origin) -> None:
+    client = httpx.AsyncClient(transport=httpx.MockTransport(origin.handler))
+    monkeypatch.setattr(http_client.async_http_client, "client", client)
+
+
+def _download(url: str) -> bytes:
+    async def run():
+        with await download.download_pdf(url) as document:
+            return document.read()
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("validators", [
+    {"etag": '"v1"'},
+    {"last_modified": "Wed, 21 Oct 2015 07:28:00 GMT"},
+])
+def test_cached_document_is_revalidated(cache, monkeypatch, validators):
+    origin = Origin(b"%PDF-v1", **validators)
+    _serve(monkeypatch, origin)
+
+    assert _download("http://docs.test/a.pdf") == b"%PDF-v1"
+    assert _download("http://docs.test/a.pdf") == b"%PDF-v1"
+
+    conditional = origin.requests[1].headers
+    assert conditional.get("If-None-Match") == validators.get("etag")
+    assert conditional.get("If-Modified-Since") == validators.get("last_modified")
+    stats = cache.stats()
+    assert stats["revalidations"] == 1
+    assert stats["document_hits"] == 1
+
+
+def test_changed_document_is_downloaded_again(cache, monkeypatch):
+    origin = Origin(b"%PDF-v1", etag='"v1"')
+    _serve(monkeypatch, origin)
+    _download("http://docs.test/a.pdf")
+
+    origin.content, origin.etag = b"%PDF-v2", '"v2"'
+
+    assert _download("http://docs.test/a.pdf") == b"%PDF-v2"
+    assert cache.lookup("http://docs.test/a.pdf").etag == '"v2"'
+    assert cache.stats()["revalidations"] == 0
+
+
+def test_response_without_validators_is_not_cached(cache, monkeypatch):
+    _serve(monkeypatch, Origin(b"%PDF-v1"))
+
+    _download("http://docs.test/a.pdf")
+
+    assert cache.lookup("http://docs.test/a.pdf") is None
+
+
+def _unusable_cache(tmp_path, monkeypatch, kind):
+    if kind == "read-only":
+        directory = tmp_path / "cache"
+        directory.mkdir()
+        directory.chmod(0o500)
+    elif kind == "other-owner":
+        directory = tmp_path / "cache"
+        directory.mkdir()
+        monkeypatch.setattr(private_dir.os, "getuid", lambda: os.stat(directory).st_uid + 1)
+    else:
+        # Al posto della directory c'è un file: la cache non può essere creata
+        directory = tmp_path / "not-a-directory"
+        directory.write_bytes(b"")
+    return DocumentCache(str(directory), max_disk_bytes=1024 * 1024, max_memory_bytes=64 * 1024)
+
+
+@pytest.mark.parametrize("kind", [
+    pytest.param("read-only", marks=pytest.mark.skipif(
+        hasattr(os, "geteuid") and os.geteuid() == 0, reason="root ignora i permessi della directory"
+    )),
+    "other-owner",
+    "file",
+])
+def test_unusable_cache_falls_back_to_plain_download(tmp_path, monkeypatch, capsys, kind):
+    monkeypatch.setattr(download, "document_cache", _unusable_cache(tmp_path, monkeypatch, kind))
+    origin = Origin(b"%PDF-v1", etag='"v1"')
+    _serve(monkeypatch, origin)
+
+    assert _download("http://docs.test/a.pdf") == b"%PDF-v1"
+    assert _download("http://docs.test/a.pdf") == b"%PDF-v1"
+
+    assert len(origin.requests) == 2
+    assert "If-None-Match" not in origin.requests[1].headers
+    assert "cache dei documenti non disponibile" in capsys.readouterr().out
+
+
+def test_failed_cache_write_keeps_the_download(cache, monkeypatch):
+    def disk_full(*args):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(cache, "store_document", disk_full)
+    _serve(monkeypatch, Origin(b"%PDF-v1", etag='"v1"'))
+
+    assert _download("http://docs.test/a.pdf") == b"%PDF-v1"
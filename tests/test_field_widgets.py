@@ -0,0 +1,106 @@
+"""Indice dei widget AcroForm (field_widgets) usato da use_existing_field e dall'analisi."""
+import asyncio
+import io
+
+import pytest
+
+import app.main as main
+from app.main import FieldNotFoundError, _existing_field, _existing_field_name
+from app.services.pdf_document import FieldWidget, PdfDocument
+from pdf_factory import make_pdf
+
+FORM = [
+    {"name": "firme", "kids": [
+        {"name": "cliente", "type": "Sig", "widgets": [(2, (400, 50, 500, 100))]},
+        {"name": "agente", "type": "Sig", "kids": [
+            {"name": "principale", "widgets": [(0, (50, 60, 150, 110))]}
+        ]}
+    ]},
+    # Un campo con un widget per pagina (es. sigla ripetuta)
+    {"name": "sigla", "type": "Sig", "widgets": [(0, (500, 20, 560, 40)), (1, (500, 20, 560, 40)), (3, (10, 20, 70, 40))]},
+    # Campo e widget nello stesso dizionario
+    {"name": "data", "type": "Tx", "merged": True, "widgets": [(1, (72, 700, 200, 720))]},
+    # Widget senza /P: la pagina si ricava dalle /Annots
+    {"name": "timbro", "type": "Sig", "page_ref": False, "widgets": [(3, (300, 300, 400, 350))]},
+    # Stesso nome breve sotto due genitori diversi
+    {"name": "allegato1", "kids": [{"name": "firma", "type": "Sig", "widgets": [(0, (1, 1, 2, 2))]}]},
+    {"name": "allegato2", "kids": [{"name": "firma", "type": "Sig", "widgets": [(1, (3, 3, 4, 4))]}]},
+]
+
+
+@pytest.fixture(params=["pdfminer", "pyhanko"])
+def document(request):
+    with PdfDocument(io.BytesIO(make_pdf(pages=4, form_fields=FORM))) as document:
+        if request.param == "pyhanko":
+            # Catalogo letto da pyHanko, come per i PDF che pdfminer non riesce ad aprire
+            document.__dict__["plumber"] = None
+        yield document
+
+
+def test_nested_kids_use_fully_qualified_names(document):
+    names = {field.name: field.field_type for field in document.acroform_fields}
+
+    assert names == {
+        "firme.cliente": "Sig",
+        "firme.agente.principale": "Sig",
+        "sigla": "Sig",
+        "data": "Tx",
+        "timbro": "Sig",
+        "allegato1.firma": "Sig",
+        "allegato2.firma": "Sig",
+    }
+    assert document.field_widgets["firme.cliente"] == [FieldWidget(3, (400.0, 50.0, 500.0, 100.0))]
+    # Il tipo /FT è ereditato dal genitore
+    assert document.field_widget("firme.agente.principale") == FieldWidget(1, (50.0, 60.0, 150.0, 110.0))
+
+
+def test_widgets_spanning_pages(document):
+    assert [widget.page for widget in document.field_widgets["sigla"]] == [1, 2, 4]
+    assert document.field_widget("sigla").page == 1
+
+
+def test_merged_field_and_widget_without_page_reference(document):
+    assert document.field_widget("data") == FieldWidget(2, (72.0, 700.0, 200.0, 720.0))
+    assert document.field_widget("timbro") == FieldWidget(4, (300.0, 300.0, 400.0, 350.0))
+
+
+@pytest.mark.parametrize("name, page", [
+    ("firme.cliente", 3),
+    ("cliente", 3),
+    ("principale", 1),
+    ("agente.principale", None),
+    ("firma", None),
+    ("allegato2.firma", 2),
+    ("inesistente", None),
+])
+def test_lookup_by_full_or_last_component(document, name, page):
+    widget = document.field_widget(name)
+
+    assert (widget.page if widget else None) == page
+
+
+def test_existing_field_errors_list_the_available_names(document):
+    assert _existing_field(document, None) is None
+    widget = _existing_field(document, "cliente")
+    assert _existing_field_name(document, widget) == "firme.cliente"
+
+    with pytest.raises(FieldNotFoundError) as error:
+        _existing_field(document, "firma")
+    assert "allegato1.firma" in str(error.value) and "firme.agente.principale" in str(error.value)
+
+
+def test_analysis_reports_page_and_coordinates_of_nested_fields(monkeypatch):
+    pdf = make_pdf(pages=4, form_fields=FORM)
+
+    async def fake_download(url):
+        return io.BytesIO(pdf)
+
+    monkeypatch.setattr(main, "download_pdf", fake_download)
+    monkeypatch.setattr(main, "document_cache", None)
+    result = asyncio.run(main.analyze_pdf_signature_fields("https://docs.test/modulo.pdf"))
+
+    fields = {field["name"]: field for field in result["acroform_fields"]}
+    assert fields["firme.cliente"]["page"] == 3
+    assert fields["sigla"]["page"] == 1
+    assert fields["timbro"]["page"] == 4
+    assert "data" not in fields
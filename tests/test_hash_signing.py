@@ -0,0 +1,149 @@
+import asyncio
+import io
+
+import httpx
+import pytest
+from pyhanko.pdf_utils.reader import PdfFileReader
+from pyhanko.sign.validation import async_validate_pdf_signature
+from pyhanko_certvalidator import ValidationContext
+
+import app.main as main
+from app.config.setting import settings
+from app.services import hash_signing, http_client
+from app.services.hash_signing import (
+    HashSigningError, LocalHashSigner, finish_hash_signature, prepare_hash_signature
+)
+from app.services.sat_session import SatSessionRegistry
+from pdf_factory import make_pdf
+
+BOX = {"llx": 350, "lly": 40, "urx": 550, "ury": 100}
+
+
+@pytest.fixture
+def local_signer(monkeypatch):
+    signer = LocalHashSigner.self_signed()
+    monkeypatch.setattr(settings, "SIGN_HASH_SIGNER", "local")
+    monkeypatch.setattr(settings, "SIGN_HASH_ALLOW_LOCAL_SIGNER", True)
+    monkeypatch.setattr(main, "local_hash_signer", lambda: signer)
+    return signer
+
+
+async def _validate(signed: bytes, signer: LocalHashSigner):
+    reader = PdfFileReader(io.BytesIO(signed))
+    signature, = reader.embedded_signatures
+    context = ValidationContext(trust_roots=[signer.signing_cert])
+    return signature, await async_validate_pdf_signature(signature, context)
+
+
+def test_prepare_sign_finish_round_trip():
+    signer = LocalHashSigner.self_signed()
+
+    async def run():
+        prepared = await prepare_hash_signature(io.BytesIO(make_pdf(2)), 2, BOX, "Firmato da Mario Rossi")
+        signature_cms = await signer.sign_digest(prepared.digest)
+        with await finish_hash_signature(prepared, signature_cms) as output:
+            return await _validate(output.read(), signer)
+
+    signature, status = asyncio.run(run())
+
+    assert status.intact and status.valid and status.trusted
+    assert status.coverage.name == "ENTIRE_FILE"
+    assert signature.field_name == hash_signing.DEFAULT_FIELD_NAME
+
+
+def test_signature_larger_than_reserved_space_is_rejected():
+    prepared = asyncio.run(prepare_hash_signature(io.BytesIO(make_pdf(1)), 1, BOX, "Firma", bytes_reserved=64))
+    try:
+        with pytest.raises(HashSigningError):
+            asyncio.run(finish_hash_signature(prepared, b"\x30" * 65))
+    finally:
+        prepared.close()
+
+
+def test_local_signer_requires_explicit_flag(monkeypatch):
+    monkeypatch.setattr(settings, "SIGN_HASH_SIGNER", "local")
+    monkeypatch.setattr(settings, "SIGN_HASH_ALLOW_LOCAL_SIGNER", False)
+    hash_signing.local_hash_signer.cache_clear()
+
+    with pytest.raises(HashSigningError):
+        hash_signing.local_hash_signer()
+
+
+def _sign_document(signing_mode="hash"):
+    return asyncio.run(main.sign_document(
+        "cert-1", "token", "SAT", "transaction", "1234", "http://docs.test/a.pdf",
+        page_signature="ultima_pagina", signing_mode=signing_mode
+    ))
+
+
+def test_sign_document_refuses_local_signer_without_flag(monkeypatch):
+    monkeypatch.setattr(settings, "SIGN_HASH_SIGNER", "local")
+    monkeypatch.setattr(settings, "SIGN_HASH_ALLOW_LOCAL_SIGNER", False)
+    requests = []
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: requests.append(request)))
+    monkeypatch.setattr(http_client.async_http_client, "client", client)
+
+    result = _sign_document()
+
+    assert result["type"] == "error"
+    assert "SIGN_HASH_ALLOW_LOCAL_SIGNER" in result["content"]
+    assert requests == []
+
+
+def test_sign_document_reports_test_signature(monkeypatch, local_signer):
+    uploads = _serve_document(monkeypatch)
+
+    result = _sign_document()
+
+    assert result["success"] and result["test_signature"] is True
+    _, status = asyncio.run(_validate(uploads[0], local_signer))
+    assert status.intact and status.valid
+
+
+def _serve_document(monkeypatch, sign_hash_status=None):
+    pdf = make_pdf(2)
+    uploads = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if str(request.url).endswith("/certificates"):
+            return httpx.Response(200, json=[{"subject": "CN=Mario Rossi,DNQ=123"}])
+        if str(request.url).endswith("/sign-hash"):
+            return httpx.Response(sign_hash_status)
+        return httpx.Response(200, content=pdf)
+
+    def upload(content, filename):
+        uploads.append(content.read())
+        return {"success": True, "signed_url": f"https://spaces.test/{filename}", "expires_in": 3600}
+
+    monkeypatch.setattr(http_client.async_http_client, "client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(main, "upload_to_digitalocean_spaces", upload)
+    return uploads
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = SatSessionRegistry()
+    monkeypatch.setattr(main, "sat_sessions", registry)
+    return registry
+
+
+def test_failed_sign_hash_call_refunds_the_sat(monkeypatch, registry):
+    monkeypatch.setattr(settings, "SIGN_HASH_SIGNER", "remote")
+    session = registry.register("cert-1", "transaction", "SAT", signatures=5)
+    _serve_document(monkeypatch, sign_hash_status=502)
+
+    result = _sign_document()
+
+    assert result["type"] == "error"
+    assert session.remaining == 5
+
+
+def test_successful_hash_signature_consumes_the_sat(monkeypatch, registry, local_signer):
+    session = registry.register("cert-1", "transaction", "SAT", signatures=5)
+    _serve_document(monkeypatch)
+
+    result = _sign_document()
+
+    assert result["success"]
+    assert result["sat_session"]["signatures_remaining"] == 4
+    assert session.remaining == 4
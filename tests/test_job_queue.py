@@ -0,0 +1,171 @@
+import asyncio
+
+import pytest
+
+import app.main as main
+from app.services import job_queue
+from app.services.job_queue import (
+    CANCELLED, FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue, JobQueueFullError
+)
+
+
+class FakeJob:
+    """Job controllato dal test: parte, attende il via libera e restituisce `result`."""
+
+    def __init__(self, result=None, error=None):
+        self.result = {"success": True} if result is None else result
+        self.error = error
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.cancelled = False
+
+    async def __call__(self) -> dict:
+        self.started.set()
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+async def settle():
+    """Lascia girare worker e job fino al prossimo punto di attesa."""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def make_queue(**kwargs):
+    return JobQueue(failed=lambda result: not result.get("success"), **kwargs)
+
+
+def test_jobs_run_and_report_results():
+    async def run():
+        queue = make_queue(workers=2)
+        ok, failing, raising = FakeJob(), FakeJob({"success": False}), FakeJob(error=RuntimeError("boom"))
+        jobs = [queue.submit(job) for job in (ok, failing, raising)]
+        for job in (ok, failing, raising):
+            job.release.set()
+        await settle()
+        await settle()
+        return jobs
+
+    ok, failing, raising = asyncio.run(run())
+
+    assert (ok.status, ok.result) == (SUCCEEDED, {"success": True})
+    assert failing.status == FAILED
+    assert (raising.status, raising.error) == (FAILED, "boom")
+
+
+def test_full_queue_rejects_new_jobs():
+    async def run():
+        queue = make_queue(workers=1, max_queued=2)
+        running = FakeJob()
+        queue.submit(running)
+        await running.started.wait()
+        waiting = [queue.submit(FakeJob()), queue.submit(FakeJob())]
+        with pytest.raises(JobQueueFullError):
+            queue.submit(FakeJob())
+        positions = [queue.position(job) for job in waiting]
+
+        # Un posto in coda si libera quando il job in esecuzione termina
+        running.release.set()
+        await settle()
+        queue.submit(FakeJob())
+        return positions, queue.queued, queue.running
+
+    positions, queued, running = asyncio.run(run())
+
+    assert positions == [1, 2]
+    assert (queued, running) == (2, 1)
+
+
+def test_cancel_queued_job_never_runs():
+    async def run():
+        queue = make_queue(workers=1)
+        first, second = FakeJob(), FakeJob()
+        queue.submit(first)
+        job = queue.submit(second)
+        await first.started.wait()
+        assert job.status == QUEUED
+
+        cancelled = queue.cancel(job.id)
+        first.release.set()
+        await settle()
+        return cancelled, second.started.is_set()
+
+    job, started = asyncio.run(run())
+
+    assert job.status == CANCELLED
+    assert job.error == "Job annullato"
+    assert not started
+
+
+def test_cancel_running_job_interrupts_it():
+    async def run():
+        queue = make_queue(workers=1)
+        running, following = FakeJob(), FakeJob()
+        job = queue.submit(running)
+        queue.submit(following)
+        await running.started.wait()
+        assert job.status == RUNNING
+
+        queue.cancel(job.id)
+        await settle()
+        # Il worker passa al job successivo
+        await asyncio.wait_for(following.started.wait(), 1)
+        return job, running.cancelled
+
+    job, interrupted = asyncio.run(run())
+
+    assert job.status == CANCELLED
+    assert interrupted
+    assert job.result is None
+
+
+def test_finished_jobs_are_purged_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(job_queue.time, "time", lambda: now[0])
+
+    async def run():
+        queue = make_queue(result_ttl=60)
+        done = FakeJob()
+        job = queue.submit(done)
+        done.release.set()
+        await settle()
+        waiting = FakeJob()
+        pending = queue.submit(waiting)
+
+        now[0] += 59
+        kept = queue.get(job.id)
+        now[0] += 2
+        return kept, queue.get(job.id), queue.get(pending.id)
+
+    kept, purged, pending = asyncio.run(run())
+
+    assert kept is not None and kept.status == SUCCEEDED
+    assert purged is None
+    # I job non conclusi non scadono
+    assert pending is not None
+
+
+def test_submit_tool_reports_full_queue(monkeypatch):
+    queue = make_queue(workers=1, max_queued=1)
+    monkeypatch.setattr(main, "signing_jobs", queue)
+
+    async def run():
+        blocker = FakeJob()
+        queue.submit(blocker)
+        await blocker.started.wait()
+        queue.submit(FakeJob())
+        return await main.submit_signing_job(
+            "cert-1", "token", "SAT", "transaction", "1234", "http://docs.test/a.pdf"
+        )
+
+    result = asyncio.run(run())
+
+    assert result["type"] == "error"
+    assert result["queued_jobs"] == 1
+    assert result["retry_after_seconds"] > 0
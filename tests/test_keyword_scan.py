@@ -0,0 +1,147 @@
+"""Ricerca delle keyword di firma in una passata, confrontata con la vecchia ricerca per sottostringa."""
+import io
+import random
+
+import pytest
+
+from app.services.keyword_scan import (
+    LINE_PATTERNS,
+    SIGNATURE_KEYWORDS,
+    AhoCorasick,
+    extract_page_words,
+    scan_page_words,
+)
+from app.services.pdf_document import PdfDocument
+from pdf_factory import make_pdf
+
+PAGE_HEIGHT = 842
+
+
+def _brute_force(patterns, text):
+    return sorted(
+        (start, start + len(pattern), index)
+        for index, pattern in enumerate(patterns)
+        for start in range(len(text) - len(pattern) + 1)
+        if text.startswith(pattern, start)
+    )
+
+
+def _words(*lines: str):
+    """Parole sintetiche: una riga ogni 20 punti dall'alto, parole distanziate di 60 punti."""
+    words = []
+    for line_number, line in enumerate(lines):
+        for position, text in enumerate(line.split()):
+            x0 = 50 + 60 * position
+            top = 700 + 20 * line_number
+            words.append({"text": text, "x0": x0, "x1": x0 + 40, "top": top, "bottom": top + 10})
+    return words
+
+
+def _old_scan(words):
+    """
+    Ricerca prima di AhoCorasick: per ogni keyword la prima parola che la contiene
+    (le keyword su più parole non venivano mai trovate), poi il primo pattern di linea.
+    """
+    hints = []
+    for keyword in SIGNATURE_KEYWORDS:
+        word = next((word for word in words if keyword in word["text"].lower()), None)
+        if word is not None:
+            hints.append((keyword, word["text"]))
+    text = " ".join(word["text"] for word in words)
+    pattern = next((pattern for pattern in LINE_PATTERNS if pattern in text), None)
+    if pattern is not None:
+        hints.append(("line_pattern", pattern))
+    return hints
+
+
+def _scan(words):
+    return [(hint["keyword"], hint["text"]) for hint in scan_page_words(words, 1, PAGE_HEIGHT)]
+
+
+@pytest.mark.parametrize("patterns, text", [
+    (["he", "she", "his", "hers"], "ushers she his hers"),
+    (["a", "aa", "aaa"], "aaaa"),
+    (["firma", "firma:", "firmatario", "ma:"], "firmatario firma: firma"),
+    (SIGNATURE_KEYWORDS + LINE_PATTERNS, "sign here: firma:______ ...... --- ----- signature"),
+])
+def test_finditer_reports_every_overlapping_occurrence(patterns, text):
+    assert sorted(AhoCorasick(patterns).finditer(text)) == _brute_force(patterns, text)
+
+
+def test_finditer_matches_brute_force_on_random_text():
+    generator = random.Random(13)
+    patterns = SIGNATURE_KEYWORDS + LINE_PATTERNS + ["ir", "rma", "gn h"]
+    matcher = AhoCorasick(patterns)
+    for _ in range(200):
+        text = "".join(generator.choice("firmasgnhe:_.- ") for _ in range(generator.randint(0, 120)))
+        assert sorted(matcher.finditer(text)) == _brute_force(patterns, text)
+
+
+@pytest.mark.parametrize("lines, expected", [
+    # Keyword sovrapposte nella stessa parola
+    (["Firmatario:"], [("firma", "Firmatario:"), ("firmatario", "Firmatario:")]),
+    (["Firma:"], [("firma", "Firma:"), ("firma:", "Firma:")]),
+    # Maiuscole e minuscole
+    (["SIGNATURE", "SoTtOsCrItTo"], [("signature", "SIGNATURE"), ("sottoscritto", "SoTtOsCrItTo")]),
+    # Keyword su più parole, anche a capo: il testo riporta tutte le parole coperte
+    (["Please sign", "here"], [("sign here", "sign here")]),
+    (["Please sign here:"], [("sign here", "sign here:")]),
+    # Le parole restano separate: 'fir ma' non è 'firma'
+    (["fir ma", "sig n:"], []),
+    # Prima occorrenza della pagina per ogni keyword
+    (["Sign: data", "firma del cliente Firma:"], [("firma", "firma"), ("sign:", "Sign:"), ("firma:", "Firma:")]),
+    # Un solo pattern di linea, il primo nell'ordine di LINE_PATTERNS
+    (["-----", "........", "Firma ________"], [("firma", "Firma"), ("line_pattern", "_____")]),
+    ([], []),
+])
+def test_page_scan_table(lines, expected):
+    assert _scan(_words(*lines)) == expected
+
+
+@pytest.mark.parametrize("lines", [
+    ["Firma del Cliente ________"],
+    ["Il sottoscritto", "Firmatario:", "signature ....."],
+    ["FIRMA: ---------- sign:"],
+    ["Luogo e data", "Sign here", "Firma"],
+    ["nessuna keyword", "in questa pagina"],
+])
+def test_same_hints_as_the_old_substring_scan(lines):
+    words = _words(*lines)
+    # Le keyword su più parole sono le sole che la vecchia ricerca non poteva trovare
+    single_word = [hint for hint in _scan(words) if " " not in hint[1] or hint[0] == "line_pattern"]
+
+    assert single_word == _old_scan(words)
+
+
+def test_same_hints_as_the_old_substring_scan_on_random_pages():
+    generator = random.Random(10)
+    vocabulary = ["Firma", "firma:", "FIRMATARIO", "Signature", "sign:", "sign", "here", "_____", "......",
+                  "-----", "data", "Sottoscritto", "cliente", "Luogo", "xfirmax"]
+    for _ in range(300):
+        lines = [
+            " ".join(generator.choice(vocabulary) for _ in range(generator.randint(1, 6)))
+            for _ in range(generator.randint(1, 4))
+        ]
+        words = _words(*lines)
+        hints = [hint for hint in _scan(words) if hint[0] != "sign here"]
+        assert hints == _old_scan(words), lines
+
+
+def test_bbox_covers_the_matched_words():
+    hints = scan_page_words(_words("Please sign", "here"), 1, PAGE_HEIGHT)
+
+    assert hints[0]["bbox"] == {"x0": 50, "top": 700, "x1": 150, "bottom": 730}
+    assert hints[0]["position"] == "bottom"
+
+
+def test_layout_words_match_pdfplumber():
+    pdf = make_pdf(pages=1, text="Il Sottoscritto  Firma: ________ sign here")
+    with PdfDocument(io.BytesIO(pdf)) as document:
+        page = document.plumber.pages[0]
+        words = extract_page_words(page)
+        expected = page.extract_words()
+
+    assert [word["text"] for word in words] == [word["text"] for word in expected]
+    for word, reference in zip(words, expected):
+        for key in ("x0", "x1", "top", "bottom"):
+            assert word[key] == pytest.approx(reference[key])
@@ -0,0 +1,43 @@
+import io
+
+import pytest
+
+from app.services.line_detection import detect_signature_lines
+from app.services.pdf_document import PdfDocument
+from pdf_factory import make_pdf
+
+# Linea orizzontale nello spazio utente, a 80 pt dal fondo di una pagina A4 (595x842)
+HORIZONTAL = "300 80 m 500 80 l S"
+
+
+def _candidates(pdf: bytes):
+    with PdfDocument(io.BytesIO(pdf)) as document:
+        return detect_signature_lines(document)
+
+
+def test_box_sits_above_the_line():
+    candidate, = _candidates(make_pdf(1, graphics=f"0 0 0 RG {HORIZONTAL}"))
+
+    assert candidate["line"] == {"x0": 300, "x1": 500, "y": 80}
+    assert candidate["coords"] == {"llx": 300, "lly": 81, "urx": 500, "ury": 111}
+    assert candidate["position"] == "bottom"
+
+
+@pytest.mark.parametrize("rotate, line, coords", [
+    # Linee disegnate in modo da apparire orizzontali, a 80 pt dal bordo inferiore visualizzato
+    (90, "515 300 m 515 500 l S", {"llx": 484, "lly": 300, "urx": 514, "ury": 500}),
+    (180, "95 762 m 295 762 l S", {"llx": 95, "lly": 731, "urx": 295, "ury": 761}),
+    (270, "80 342 m 80 542 l S", {"llx": 81, "lly": 342, "urx": 111, "ury": 542}),
+])
+def test_rotated_pages_use_the_displayed_orientation(rotate, line, coords):
+    # Con 90/270 la linea orizzontale nello spazio utente appare verticale e viene ignorata
+    extra = "" if rotate == 180 else HORIZONTAL
+    candidate, = _candidates(make_pdf(1, rotate={0: rotate}, graphics=f"0 0 0 RG {line} {extra}"))
+
+    assert candidate["line"] == {"x0": 300, "x1": 500, "y": 80}
+    assert candidate["coords"] == coords
+    assert candidate["position"] == "bottom"
+
+
+def test_vertical_lines_are_ignored_on_unrotated_pages():
+    assert _candidates(make_pdf(1, graphics="0 0 0 RG 515 300 m 515 500 l S")) == []
@@ -0,0 +1,87 @@
+"""Ripiego in processo dell'analisi parallela delle pagine."""
+import io
+from concurrent.futures import Future
+
+import pytest
+
+from app.services import page_analysis
+from app.services.keyword_scan import scan_pdf_pages
+from app.services.page_analysis import PageAnalysisPool
+from app.services.pdf_document import PdfDocument
+from pdf_factory import make_pdf
+
+
+class FakeExecutor:
+    """Executor che restituisce future fallite o mai completate."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.submitted = 0
+        self.shutdown_calls = []
+
+    def submit(self, fn, *args):
+        self.submitted += 1
+        future = Future()
+        if self.error is not None:
+            future.set_exception(self.error)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shutdown_calls.append(cancel_futures)
+
+
+def _scan_with(executor, monkeypatch, **kwargs):
+    pool = PageAnalysisPool(workers=2, min_pages=1, pages_per_task=2, **kwargs)
+    monkeypatch.setattr(pool, "_get_executor", lambda: pool._executor)
+    pool._executor = executor
+    with PdfDocument(io.BytesIO(make_pdf(pages=5))) as document:
+        hints = pool.scan(document)
+        expected = scan_pdf_pages(document.plumber)
+    return pool, hints, expected
+
+
+@pytest.mark.parametrize("error", [RuntimeError("processo terminato"), OSError("spawn fallito")])
+def test_pool_failure_falls_back_to_in_process_scan(monkeypatch, error):
+    executor = FakeExecutor(error=error)
+    pool, hints, expected = _scan_with(executor, monkeypatch)
+
+    assert hints == expected
+    assert sorted({hint["page"] for hint in hints}) == [1, 2, 3, 4, 5]
+    assert executor.submitted == 3
+    assert executor.shutdown_calls == [True]
+    assert pool._executor is None
+
+
+def test_unresponsive_pool_times_out_and_falls_back(monkeypatch):
+    executor = FakeExecutor()
+    terminated = []
+
+    class HungProcess:
+        def terminate(self):
+            terminated.append(True)
+
+    executor._processes = {1: HungProcess(), 2: HungProcess()}
+    pool, hints, expected = _scan_with(executor, monkeypatch, timeout=0.05, timeout_per_page=0.0)
+
+    assert hints == expected
+    assert executor.shutdown_calls == [True]
+    assert terminated == [True, True]
+    assert pool._executor is None
+
+
+def test_timeout_grows_with_page_count(monkeypatch):
+    waits = []
+
+    class RecordingFuture(Future):
+        def result(self, timeout=None):
+            waits.append(timeout)
+            return []
+
+    class RecordingExecutor(FakeExecutor):
+        def submit(self, fn, *args):
+            return RecordingFuture()
+
+    monkeypatch.setattr(page_analysis.time, "monotonic", lambda: 1000.0)
+    _scan_with(RecordingExecutor(), monkeypatch, timeout=10.0, timeout_per_page=2.0)
+
+    assert waits == [20.0, 20.0, 20.0]
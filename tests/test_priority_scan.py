@@ -0,0 +1,133 @@
+"""scan_strategy='priority': ordine delle pagine, budget e risultati in document_cache."""
+import io
+
+import pytest
+
+import app.main as main
+from app.services.document_cache import DocumentCache
+from app.services.keyword_scan import priority_page_order, scan_pdf_pages_priority
+from app.services.pdf_document import PdfDocument
+from pdf_factory import make_pdf
+
+NO_KEYWORDS = "Condizioni generali"
+
+
+@pytest.mark.parametrize("page_count, last_pages, expected", [
+    (1, 2, [1]),
+    (2, 2, [2, 1]),
+    (3, 2, [3, 2, 1]),
+    (6, 2, [6, 5, 1, 4, 3, 2]),
+    (5, 1, [5, 1, 4, 3, 2]),
+    (4, 0, [1, 4, 3, 2]),
+])
+def test_page_order(page_count, last_pages, expected):
+    assert priority_page_order(page_count, last_pages) == expected
+
+
+def _scan(pdf: bytes, max_pages: int, deadline: float = float("inf")):
+    with PdfDocument(io.BytesIO(pdf)) as document:
+        return scan_pdf_pages_priority(document.plumber_page, document.page_count, max_pages, deadline)
+
+
+def test_page_budget_limits_the_scanned_pages():
+    hints, scanned = _scan(make_pdf(pages=6, text=NO_KEYWORDS), max_pages=3)
+
+    assert scanned == [6, 5, 1]
+    assert hints == []
+
+
+def test_scan_stops_at_the_first_confident_page():
+    pdf = make_pdf(pages=6, text=NO_KEYWORDS, texts={0: "Firma: ________"})
+
+    hints, scanned = _scan(pdf, max_pages=10)
+
+    assert scanned == [6, 5, 1]
+    assert {hint["keyword"] for hint in hints} == {"firma", "firma:", "line_pattern"}
+
+
+def test_expired_time_budget_still_scans_one_page():
+    hints, scanned = _scan(make_pdf(pages=6), max_pages=10, deadline=0.0)
+
+    assert scanned == [6]
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = DocumentCache(str(tmp_path / "cache"), max_disk_bytes=1024 * 1024, max_memory_bytes=64 * 1024)
+    monkeypatch.setattr(main, "document_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def collected(monkeypatch):
+    """Strategie delle analisi effettivamente eseguite (cioè non servite dalla cache)."""
+    calls = []
+    collect = main._collect_signature_hints
+
+    def counting(document, result, scan_strategy="full", *args):
+        calls.append(scan_strategy)
+        collect(document, result, scan_strategy, *args)
+
+    monkeypatch.setattr(main, "_collect_signature_hints", counting)
+    return calls
+
+
+def _analyze(pdf: bytes, scan_strategy: str, max_pages=None) -> dict:
+    result = main._new_analysis_result(scan_strategy)
+    with PdfDocument(io.BytesIO(pdf)) as document:
+        main._analyze_document(document, result, scan_strategy, max_pages)
+    return result
+
+
+def test_settled_priority_result_is_cached(cache, collected):
+    pdf = make_pdf(pages=6, text=NO_KEYWORDS, texts={0: "Firma: ________"})
+
+    first = _analyze(pdf, "priority")
+    second = _analyze(pdf, "priority")
+
+    assert collected == ["priority"]
+    assert second == first
+    assert second["scan_strategy"] == "priority"
+    assert second["scanned_pages"] == [6, 5, 1]
+
+
+def test_cached_priority_result_needs_enough_page_budget(cache, collected):
+    pdf = make_pdf(pages=6, text=NO_KEYWORDS, texts={0: "Firma: ________"})
+    _analyze(pdf, "priority")
+
+    # Con due pagine la richiesta non sarebbe arrivata alla pagina 1
+    short = _analyze(pdf, "priority", max_pages=2)
+    assert short["scanned_pages"] == [6, 5]
+    assert short["text_hints"] == []
+
+    assert _analyze(pdf, "priority", max_pages=3)["scanned_pages"] == [6, 5, 1]
+    assert collected == ["priority", "priority"]
+
+
+def test_priority_result_stopped_by_the_budget_is_not_cached(cache, collected):
+    pdf = make_pdf(pages=6, text=NO_KEYWORDS)
+
+    _analyze(pdf, "priority", max_pages=2)
+    _analyze(pdf, "priority", max_pages=2)
+
+    assert collected == ["priority", "priority"]
+
+
+def test_signature_field_settles_the_priority_scan(cache, collected):
+    pdf = make_pdf(pages=3, text=NO_KEYWORDS, signature_field=True)
+
+    first = _analyze(pdf, "priority")
+    assert _analyze(pdf, "priority") == first
+    assert first["scanned_pages"] == []
+    assert collected == ["priority"]
+
+
+def test_full_result_serves_priority_requests(cache, collected):
+    pdf = make_pdf(pages=6, text=NO_KEYWORDS)
+
+    full = _analyze(pdf, "full")
+    priority = _analyze(pdf, "priority")
+
+    assert collected == ["full"]
+    assert priority == full
+    assert priority["scanned_pages"] == [1, 2, 3, 4, 5, 6]
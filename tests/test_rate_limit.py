@@ -0,0 +1,186 @@
+import asyncio
+import types
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+from app.config.setting import settings
+from app.services import rate_limit
+from app.services.http_client import AsyncPooledHttpClient
+from app.services.rate_limit import SIGN, UpstreamBusyError, UpstreamLimiter, retry_after_seconds
+
+
+class FakeClock:
+    """Orologio simulato per il token bucket: sleep avanza il tempo senza attendere."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return 1_700_000_000.0 + self.now
+
+    async def sleep(self, delay: float) -> None:
+        self.now += delay
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    monkeypatch.setattr(rate_limit, "asyncio", types.SimpleNamespace(
+        Semaphore=asyncio.Semaphore, Lock=asyncio.Lock, sleep=clock.sleep
+    ))
+    return clock
+
+
+def test_token_bucket_allows_a_burst_then_the_rate(clock):
+    async def run():
+        limiter = UpstreamLimiter("test", rate=2, max_in_flight=0)
+        granted = []
+        for _ in range(5):
+            async with limiter.slot(timeout=10):
+                granted.append(clock.now)
+        return granted
+
+    # Raffica di un secondo (2 richieste), poi una richiesta ogni mezzo secondo
+    assert asyncio.run(run()) == [0.0, 0.0, 0.5, 1.0, 1.5]
+
+
+def test_throttle_pauses_the_upstream(clock):
+    async def run():
+        limiter = UpstreamLimiter("test", rate=0, max_in_flight=0)
+        limiter.throttle(3)
+        paused_for = limiter.stats()["paused_for"]
+        async with limiter.slot(timeout=10):
+            return paused_for, clock.now, limiter.stats()["throttled"]
+
+    assert asyncio.run(run()) == (3.0, 3.0, 1)
+
+
+def test_max_in_flight_caps_concurrent_requests():
+    async def run():
+        limiter = UpstreamLimiter("test", rate=0, max_in_flight=2)
+        release = asyncio.Event()
+        entered = []
+
+        async def request(index):
+            async with limiter.slot(timeout=5):
+                entered.append(index)
+                await release.wait()
+
+        tasks = [asyncio.create_task(request(index)) for index in range(3)]
+        await asyncio.sleep(0.01)
+        during = (sorted(entered), limiter.in_flight, limiter.waiting)
+        release.set()
+        await asyncio.gather(*tasks)
+        return during, len(entered), limiter.in_flight
+
+    (entered, in_flight, waiting), total, after = asyncio.run(run())
+
+    assert (entered, in_flight, waiting) == ([0, 1], 2, 1)
+    assert (total, after) == (3, 0)
+
+
+def test_wait_beyond_timeout_raises_upstream_busy():
+    async def run():
+        limiter = UpstreamLimiter("test", rate=0, max_in_flight=1)
+        async with limiter.slot(timeout=1):
+            with pytest.raises(UpstreamBusyError) as error:
+                async with limiter.slot(timeout=0.05):
+                    pass
+        # Il posto non resta occupato dopo l'attesa scaduta
+        async with limiter.slot(timeout=0.05):
+            pass
+        return error.value, limiter.stats()
+
+    error, stats = asyncio.run(run())
+
+    assert isinstance(error, httpx.TimeoutException)
+    assert error.upstream == "test"
+    assert (stats["rejected"], stats["waiting"], stats["in_flight"]) == (1, 0, 0)
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, rate_limit.DEFAULT_RETRY_AFTER),
+    ("2.5", 2.5),
+    ("-3", 0.0),
+    ("non valido", rate_limit.DEFAULT_RETRY_AFTER),
+])
+def test_retry_after_seconds(header, expected):
+    headers = {"Retry-After": header} if header is not None else {}
+
+    assert retry_after_seconds(httpx.Response(429, headers=headers)) == expected
+
+
+def test_retry_after_http_date():
+    when = datetime.now(timezone.utc) + timedelta(seconds=30)
+    response = httpx.Response(429, headers={"Retry-After": format_datetime(when, usegmt=True)})
+
+    assert 25 < retry_after_seconds(response) <= 30
+
+
+class ThrottledUpstream:
+    """Risponde 429 alle prime `throttled` richieste, poi 200."""
+
+    def __init__(self, throttled: int, retry_after: str):
+        self.throttled = throttled
+        self.retry_after = retry_after
+        self.requests = 0
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.requests <= self.throttled:
+            return httpx.Response(429, headers={"Retry-After": self.retry_after})
+        return httpx.Response(200, json={"ok": True})
+
+
+@pytest.fixture
+def sign_limiter(monkeypatch):
+    limiter = UpstreamLimiter(SIGN, rate=0, max_in_flight=4)
+    monkeypatch.setitem(rate_limit.upstream_limiters, SIGN, limiter)
+    monkeypatch.setattr(settings, "RATE_LIMIT_MAX_WAIT", 1.0)
+    return limiter
+
+
+def _request(server: ThrottledUpstream, **kwargs) -> httpx.Response:
+    async def run():
+        client = AsyncPooledHttpClient(1, 1, 1.0, 1.0, http2=False)
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(server.handler))
+        try:
+            return await client.post("http://signature.test/sign", **kwargs)
+        finally:
+            await client.aclose()
+    return asyncio.run(run())
+
+
+def test_request_retries_after_429(sign_limiter):
+    upstream = ThrottledUpstream(throttled=1, retry_after="0.05")
+
+    response = _request(upstream, upstream=SIGN)
+
+    assert response.status_code == 200
+    assert upstream.requests == 2
+    assert sign_limiter.stats()["throttled"] == 1
+
+
+def test_request_returns_429_when_retry_after_exceeds_max_wait(sign_limiter):
+    upstream = ThrottledUpstream(throttled=1, retry_after="30")
+
+    response = _request(upstream, upstream=SIGN)
+
+    assert response.status_code == 429
+    assert upstream.requests == 1
+    assert sign_limiter.stats()["paused_for"] > 25
+
+
+def test_request_without_upstream_is_not_retried(sign_limiter):
+    upstream = ThrottledUpstream(throttled=1, retry_after="0")
+
+    assert _request(upstream).status_code == 429
+    assert upstream.requests == 1
@@ -0,0 +1,182 @@
+"""Lettura parziale dei PDF remoti con richieste Range (origine simulata con httpx.MockTransport)."""
+import io
+import re
+
+import httpx
+import pytest
+
+from app.config.setting import settings
+from app.services import remote_pdf
+from app.services.pdf_document import PdfDocument
+from app.services.remote_pdf import RemoteDocumentChangedError, open_remote_pdf
+from pdf_factory import make_pdf
+
+URL = "https://docs.test/contratto.pdf"
+BLOCK_SIZE = 64
+DATA = bytes((index * 31) % 251 for index in range(1000))  # 15 blocchi pieni + 40 byte finali
+
+
+class Origin:
+    """
+    Origine HTTP con supporto Range. `mode`: 'range' (206), 'ignore' (200 con il file
+    intero), 'changed' (200 alle richieste con If-Range), 'short' (206 troncato).
+    """
+
+    def __init__(self, data: bytes = DATA, mode: str = "range", etag: str = '"v1"'):
+        self.data = data
+        self.mode = mode
+        self.etag = etag
+        self.ranges = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        headers = {"ETag": self.etag} if self.etag else {}
+        requested = request.headers.get("Range")
+        if requested is None or self.mode == "ignore" or (self.mode == "changed" and "If-Range" in request.headers):
+            return httpx.Response(200, headers=headers, content=self.data)
+        size = len(self.data)
+        suffix = re.fullmatch(r"bytes=-(\d+)", requested)
+        if suffix:
+            start, end = max(0, size - int(suffix.group(1))), size - 1
+        else:
+            start, end = (int(value) for value in re.fullmatch(r"bytes=(\d+)-(\d+)", requested).groups())
+        self.ranges.append((start, end))
+        content = self.data[start:end + 1]
+        if self.mode == "short" and suffix is None:
+            content = content[:-1]
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return httpx.Response(206, headers=headers, content=content)
+
+
+class MockResponse:
+    """Risposta httpx con l'interfaccia di requests usata da remote_pdf (anche come context manager)."""
+
+    def __init__(self, response: httpx.Response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.content
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class MockHttpClient:
+    def __init__(self, origin: Origin):
+        self.client = httpx.Client(transport=httpx.MockTransport(origin.handler))
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+        return MockResponse(self.client.get(url, headers=headers))
+
+
+@pytest.fixture
+def origin(monkeypatch):
+    origin = Origin()
+    monkeypatch.setattr(remote_pdf, "http_client", MockHttpClient(origin))
+    monkeypatch.setattr(settings, "REMOTE_PDF_BLOCK_SIZE", BLOCK_SIZE)
+    monkeypatch.setattr(settings, "REMOTE_PDF_CACHE_BLOCKS", 4)
+    return origin
+
+
+def test_opening_reads_only_the_tail(origin):
+    remote = open_remote_pdf(URL, min_bytes=0)
+
+    assert remote.size == len(DATA)
+    assert remote.validator == '"v1"'
+    assert origin.ranges == [(len(DATA) - BLOCK_SIZE, len(DATA) - 1)]
+    # L'ultimo blocco (corto) è già in cache: leggerlo non richiede altre richieste
+    remote.seek(-10, io.SEEK_END)
+    assert remote.read(100) == DATA[-10:]
+    assert len(origin.ranges) == 1
+
+
+@pytest.mark.parametrize("start, length", [(0, 1), (0, 64), (63, 2), (100, 300), (950, 50), (990, 100)])
+def test_range_reads_match_the_document(origin, start, length):
+    remote = open_remote_pdf(URL, min_bytes=0)
+
+    remote.seek(start)
+    assert remote.read(length) == DATA[start:start + length]
+    assert remote.tell() == min(start + length, len(DATA))
+
+
+def test_seek_and_tell(origin):
+    remote = open_remote_pdf(URL, min_bytes=0)
+
+    assert remote.tell() == 0
+    assert remote.seek(100) == 100
+    assert remote.seek(50, io.SEEK_CUR) == 150
+    assert remote.read(5) == DATA[150:155]
+    assert remote.seek(-1, io.SEEK_END) == len(DATA) - 1
+    assert remote.read() == DATA[-1:]
+    assert remote.seek(10, io.SEEK_END) == len(DATA) + 10
+    assert remote.read(5) == b""
+    with pytest.raises(ValueError):
+        remote.seek(-1)
+    with pytest.raises(ValueError):
+        remote.seek(0, 3)
+
+
+def test_missing_contiguous_blocks_use_one_request(origin):
+    remote = open_remote_pdf(URL, min_bytes=0)
+
+    remote.seek(70)
+    assert remote.read(200) == DATA[70:270]
+    assert origin.ranges[1:] == [(64, 319)]
+    remote.seek(0)
+    assert remote.read(400) == DATA[:400]
+    # Blocchi 1-4 già in cache: richieste solo per il blocco 0 e per i blocchi 5-6
+    assert origin.ranges[2:] == [(0, 63), (320, 447)]
+    assert remote.stats() == {"size": len(DATA), "requests": 4, "bytes_fetched": 64 + 256 + 64 + 128}
+
+
+def test_server_ignoring_range_means_full_download(origin):
+    origin.mode = "ignore"
+
+    assert open_remote_pdf(URL, min_bytes=0) is None
+
+
+@pytest.mark.parametrize("etag", [None, 'W/"v1"'])
+def test_without_strong_validator_means_full_download(origin, etag):
+    origin.etag = etag
+
+    assert open_remote_pdf(URL, min_bytes=0) is None
+
+
+def test_small_document_means_full_download(origin):
+    assert open_remote_pdf(URL, min_bytes=len(DATA) + 1) is None
+
+
+def test_document_changed_during_reading(origin):
+    remote = open_remote_pdf(URL, min_bytes=0)
+    origin.mode = "changed"
+
+    with pytest.raises(RemoteDocumentChangedError):
+        remote.read(10)
+    assert isinstance(remote.failure, RemoteDocumentChangedError)
+
+
+def test_short_range_response_is_rejected(origin):
+    remote = open_remote_pdf(URL, min_bytes=0)
+    origin.mode = "short"
+
+    remote.seek(100)
+    with pytest.raises(RemoteDocumentChangedError, match="incompleto"):
+        remote.read(10)
+    assert remote.failure is not None
+    assert remote.stats()["requests"] == 1
+
+
+def test_pdf_parsed_through_range_reads(monkeypatch):
+    pdf = make_pdf(pages=4)
+    origin = Origin(data=pdf)
+    monkeypatch.setattr(remote_pdf, "http_client", MockHttpClient(origin))
+    monkeypatch.setattr(settings, "REMOTE_PDF_BLOCK_SIZE", 256)
+
+    remote = open_remote_pdf(URL, min_bytes=0)
+    with remote, PdfDocument(remote) as document:
+        assert document.page_count == 4
+
+    assert remote.failure is None
+    # Solo richieste Range, una per ogni serie di blocchi mancanti
+    assert len(origin.ranges) == remote.stats()["requests"]
@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+import app.main as main
+from app.services import sat_session
+from app.services.batch_journal import BatchJournal
+from app.services.sat_session import SatSessionError, SatSessionRegistry
+from fake_services import FakeServices, run_batch
+
+LINKS = ["http://docs.test/a.pdf", "http://docs.test/b.pdf", "http://docs.test/c.pdf"]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sat_session.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_check_and_consume_track_remaining_signatures():
+    registry = SatSessionRegistry()
+    session = registry.register("cert-1", "transaction", "SAT", signatures=3)
+
+    registry.check(session, 3)
+    registry.consume(session, 2)
+
+    assert session.to_dict()["signatures_remaining"] == 1
+    with pytest.raises(SatSessionError):
+        registry.check(session, 2)
+    with pytest.raises(SatSessionError):
+        registry.consume(session, 2)
+    # Un consume rifiutato non scala le firme
+    assert session.remaining == 1
+    registry.consume(session)
+    assert session.remaining == 0
+
+
+def test_get_matches_certificate_transaction_and_sat():
+    registry = SatSessionRegistry()
+    session = registry.register("cert-1", "transaction", "SAT", signatures=10)
+
+    assert registry.get("cert-1", "transaction") is session
+    assert registry.get("cert-1", "transaction", "SAT") is session
+    assert registry.get("cert-1", "transaction", "altro SAT") is None
+    assert registry.get("cert-2", "transaction") is None
+    assert registry.get("cert-1", "altra transazione") is None
+
+
+def test_sessions_expire(clock):
+    registry = SatSessionRegistry(ttl=60)
+    session = registry.register("cert-1", "transaction", "SAT", signatures=10)
+
+    clock[0] += 59
+    assert registry.get("cert-1", "transaction") is session
+    assert session.to_dict()["expires_in"] == 1
+
+    clock[0] += 1
+    with pytest.raises(SatSessionError):
+        registry.check(session)
+    assert registry.get("cert-1", "transaction") is None
+
+
+def test_least_recently_used_sessions_are_dropped():
+    registry = SatSessionRegistry(max_entries=2)
+    registry.register("cert-1", "t1", "SAT1", signatures=1)
+    registry.register("cert-1", "t2", "SAT2", signatures=1)
+    registry.get("cert-1", "t1")
+    registry.register("cert-1", "t3", "SAT3", signatures=1)
+
+    assert registry.get("cert-1", "t1") is not None
+    assert registry.get("cert-1", "t2") is None
+
+
+# Pre-controllo del budget in sign_documents_batch
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = SatSessionRegistry()
+    monkeypatch.setattr(main, "sat_sessions", registry)
+    return registry
+
+
+@pytest.fixture
+def services(monkeypatch, tmp_path):
+    return FakeServices().install(monkeypatch, BatchJournal(str(tmp_path / "journal")))
+
+
+def test_batch_is_rejected_before_any_call_when_budget_is_short(registry, services):
+    session = registry.register("cert-1", "transaction", "SAT-registrato", signatures=2)
+
+    result = asyncio.run(run_batch(LINKS, infocert_sat=""))
+
+    assert result["type"] == "error"
+    assert "insufficienti" in result["content"]
+    assert services.downloads == 0 and services.sign_requests == []
+    assert session.remaining == 2
+
+
+def test_batch_without_registered_sat_is_rejected(registry, services):
+    result = asyncio.run(run_batch(LINKS, infocert_sat=""))
+
+    assert result["type"] == "error"
+    assert services.downloads == 0
+
+
+def test_batch_uses_and_consumes_the_registered_sat(registry, services):
+    session = registry.register("cert-1", "transaction", "SAT-registrato", signatures=5)
+
+    result = asyncio.run(run_batch(LINKS, infocert_sat=""))
+
+    assert result["signed"] == 3
+    assert result["sat_session"]["signatures_remaining"] == 2
+    assert session.remaining == 2
+    assert {request.headers["Infocert-SAT"] for request in services.sign_requests} == {"SAT-registrato"}
+
+
+def test_batch_resume_only_needs_budget_for_unsigned_documents(registry, services):
+    services.failing_uploads.add("c.pdf")
+    registry.register("cert-1", "transaction", "SAT-registrato", signatures=3)
+    first = asyncio.run(run_batch(LINKS, infocert_sat=""))
+    assert first["sat_session"]["signatures_remaining"] == 0
+
+    # Tutti i documenti sono già firmati: la ripresa non richiede firme residue
+    services.failing_uploads.clear()
+    second = asyncio.run(run_batch(LINKS, batch_id=first["batch_id"], infocert_sat=""))
+
+    assert second["signed"] == 3
+    assert len(services.sign_requests) == 1
+
+
+def test_unregistered_sat_is_used_without_accounting(registry, services):
+    result = asyncio.run(run_batch(LINKS, infocert_sat="SAT-esterno"))
+
+    assert result["signed"] == 3
+    assert "sat_session" not in result
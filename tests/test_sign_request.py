@@ -0,0 +1,93 @@
+"""Corpo in streaming della richiesta di firma, confrontato con il vecchio json.dumps."""
+import asyncio
+import base64
+import io
+import json
+
+import httpx
+import pytest
+
+from app.main import _build_pades_signature
+from app.services.sign_request import BASE64_READ_SIZE, StreamingSignBody
+
+SIZES = [0, 1, 2, 3, BASE64_READ_SIZE - 1, BASE64_READ_SIZE, BASE64_READ_SIZE + 1, 2 * BASE64_READ_SIZE + 2]
+
+
+class ShortReads(io.BytesIO):
+    """File che restituisce al massimo 1000 byte per lettura (come una pipe o un socket)."""
+
+    def read(self, size=-1):
+        return super().read(1000 if size < 0 else min(size, 1000))
+
+
+def _document(size: int) -> bytes:
+    return bytes((index * 7 + size) % 256 for index in range(size))
+
+
+def _bodies(documents):
+    """(corpo con i segnaposto, corpo completo come lo serializzava json.dumps)."""
+    fields = [{"position": {"page": 1, "llx": 1, "lly": 2, "urx": 3, "ury": 4}, "visibleText": "Firmato è \"ok\""}]
+
+    def body(content):
+        return {
+            "signatureInfo": {"pin": "12345678", "otp": "€"},
+            "padesSignatures": [
+                _build_pades_signature(content(index, document), f"doc {index}.pdf", f"r{index}", fields)
+                for index, document in enumerate(documents)
+            ]
+        }
+
+    streamed = body(lambda index, document: StreamingSignBody.placeholder(index))
+    inline = body(lambda index, document: base64.b64encode(document).decode("ascii"))
+    return streamed, inline
+
+
+async def _collect(body: StreamingSignBody) -> bytes:
+    return b"".join([chunk async for chunk in body])
+
+
+@pytest.mark.parametrize("reader", [io.BytesIO, ShortReads])
+def test_streamed_body_matches_json_dumps(reader):
+    documents = [_document(size) for size in SIZES]
+    streamed, inline = _bodies(documents)
+
+    body = StreamingSignBody(streamed, [reader(document) for document in documents])
+    content = asyncio.run(_collect(body))
+
+    assert json.loads(content) == json.loads(json.dumps(inline))
+    assert body.content_length == len(content)
+    assert body.headers()["Content-Length"] == str(len(content))
+
+
+def test_body_can_be_streamed_again():
+    documents = [_document(5), _document(BASE64_READ_SIZE + 4)]
+    streamed, _ = _bodies(documents)
+    body = StreamingSignBody(streamed, [io.BytesIO(document) for document in documents])
+
+    assert asyncio.run(_collect(body)) == asyncio.run(_collect(body))
+
+
+def test_advertised_length_is_what_httpx_sends():
+    documents = [_document(size) for size in (10, BASE64_READ_SIZE + 1)]
+    streamed, inline = _bodies(documents)
+    body = StreamingSignBody(streamed, [io.BytesIO(document) for document in documents])
+    received = {}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        received["length"] = request.headers["Content-Length"]
+        received["content"] = b"".join([chunk async for chunk in request.stream])
+        return httpx.Response(200, json={})
+
+    async def send():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            await client.post("https://sign.test/certificates/1/sign", headers=body.headers(), content=body)
+
+    asyncio.run(send())
+
+    assert int(received["length"]) == len(received["content"]) == body.content_length
+    assert json.loads(received["content"]) == inline
+
+
+def test_missing_placeholder_is_rejected():
+    with pytest.raises(ValueError):
+        StreamingSignBody({"padesSignatures": []}, [io.BytesIO(b"%PDF")])
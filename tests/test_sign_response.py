@@ -0,0 +1,94 @@
+"""Parsing a blocchi della risposta di firma, confrontato con json.loads sull'intera risposta."""
+import base64
+import json
+
+import pytest
+
+from app.services.sign_response import SignResponseParser
+
+DOCUMENTS = [b"%PDF-1.7 primo documento\n" * 5, bytes(range(256)), b"%PDF-1.4 ultimo"]
+
+
+def _wrapped(document: bytes) -> str:
+    """Base64 come lo serializzano alcuni server: '/' in escape e a capo ogni 40 caratteri."""
+    encoded = base64.b64encode(document).decode("ascii")
+    lines = [encoded[start:start + 40] for start in range(0, len(encoded), 40)]
+    return "\\n".join(lines).replace("/", "\\/")
+
+
+def _payload() -> bytes:
+    results = []
+    for index, document in enumerate(DOCUMENTS):
+        results.append(
+            '{"requestId": "r%d", "isOk": true, "signedDocument": {"attachName": %s, '
+            '"content": "%s", "contentType": "application/pdf"}}'
+            % (index, json.dumps(f'firmato \\ "{index}" è.pdf'), _wrapped(document))
+        )
+    results.append('{"requestId": "r3", "isOk": false, "errorMessage": "PIN \\"errato\\"\\u0021"}')
+    return ('{"signatureResult": [%s], "note": ["content", {"content": "\\\\"}]}' % ", ".join(results)).encode()
+
+
+def _expected() -> dict:
+    expected = json.loads(_payload())
+    for index, result in enumerate(expected["signatureResult"][:len(DOCUMENTS)]):
+        result["signedDocument"]["content"] = f"__signed_document_{index}__"
+    return expected
+
+
+def _parse(chunks, spool_threshold=64):
+    parser = SignResponseParser(spool_threshold=spool_threshold)
+    for chunk in chunks:
+        parser.feed(chunk)
+    result = parser.close()
+    documents = []
+    for index in range(len(DOCUMENTS) + 1):
+        file = parser.signed_document(index)
+        documents.append(file.read() if file else None)
+        if file:
+            file.close()
+    return result, documents
+
+
+def test_whole_payload_matches_json_loads():
+    result, documents = _parse([_payload()])
+
+    assert result == _expected()
+    assert documents == DOCUMENTS + [None]
+
+
+def test_every_split_point_gives_the_same_result():
+    payload = _payload()
+    expected = _expected()
+
+    for split in range(1, len(payload)):
+        result, documents = _parse([payload[:split], payload[split:]])
+        assert result == expected, split
+        assert documents == DOCUMENTS + [None], split
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7])
+def test_small_chunks_split_escapes_and_base64_groups(size):
+    payload = _payload()
+    chunks = [payload[start:start + size] for start in range(0, len(payload), size)]
+
+    result, documents = _parse(chunks, spool_threshold=16)
+
+    assert result == _expected()
+    assert documents == DOCUMENTS + [None]
+
+
+def test_truncated_response_is_rejected():
+    payload = _payload()
+
+    for cut in range(1, len(payload)):
+        parser = SignResponseParser(spool_threshold=64)
+        parser.feed(payload[:cut])
+        with pytest.raises(ValueError):
+            parser.close()
+        assert parser.signed_document(0) is None
+
+
+def test_unexpected_escape_in_signed_content_is_rejected():
+    parser = SignResponseParser(spool_threshold=64)
+    with pytest.raises(ValueError):
+        parser.feed(b'{"signatureResult": [{"signedDocument": {"content": "QUJD\\u0044"}}]}')
@@ -0,0 +1,104 @@
+"""Posizione del talloncino su pagine ruotate e con CropBox diverso dal MediaBox."""
+import io
+
+import pytest
+
+from app.main import _place_on_page, _signature_placements, get_signature_position, get_signature_positions
+from app.services.pdf_document import PageBox, PdfDocument
+from pdf_factory import make_pdf
+
+POSITIONS = ["bottom-right", "bottom-left", "bottom-center", "top-right", "top-left", "top-center", "center"]
+LETTER = (0.0, 0.0, 612.0, 792.0)
+# Area visibile 540x720 con origine spostata di 36 punti
+CROP = (36.0, 36.0, 576.0, 756.0)
+
+
+def _displayed(coords: dict, page_box: PageBox) -> dict:
+    """Rettangolo come appare a video: spazio utente ruotato in senso orario di /Rotate."""
+    left, bottom, right, top = page_box.crop_box
+
+    def forward(x: float, y: float):
+        if page_box.rotate == 90:
+            return y - bottom, right - x
+        if page_box.rotate == 180:
+            return right - x, top - y
+        if page_box.rotate == 270:
+            return top - y, x - left
+        return x - left, y - bottom
+
+    u0, v0 = forward(coords["llx"], coords["lly"])
+    u1, v1 = forward(coords["urx"], coords["ury"])
+    return {"llx": min(u0, u1), "lly": min(v0, v1), "urx": max(u0, u1), "ury": max(v0, v1)}
+
+
+@pytest.mark.parametrize("rotate, expected", [
+    # bottom-right a video: angolo della pagina non ruotata che finisce in basso a destra
+    (0, {"llx": 481, "lly": 51, "urx": 561, "ury": 81}),
+    (90, {"llx": 531, "lly": 661, "urx": 561, "ury": 741}),
+    (180, {"llx": 51, "lly": 711, "urx": 131, "ury": 741}),
+    (270, {"llx": 51, "lly": 51, "urx": 81, "ury": 131}),
+])
+def test_bottom_right_in_user_space(rotate, expected):
+    assert _place_on_page("bottom-right", PageBox(LETTER, CROP, rotate)) == expected
+
+
+@pytest.mark.parametrize("rotate", [0, 90, 180, 270])
+@pytest.mark.parametrize("crop_box", [LETTER, CROP, (100.0, 200.0, 695.0, 1042.0)])
+@pytest.mark.parametrize("position", POSITIONS)
+def test_displayed_rectangle_matches_the_unrotated_position(position, crop_box, rotate):
+    page_box = PageBox(LETTER, crop_box, rotate)
+    left, bottom, right, top = crop_box
+    width, height = right - left, top - bottom
+    visible_width, visible_height = (height, width) if rotate in (90, 270) else (width, height)
+
+    coords = _place_on_page(position, page_box)
+
+    # Dentro l'area visibile e, ruotato come a video, nella posizione richiesta
+    assert left <= coords["llx"] < coords["urx"] <= right
+    assert bottom <= coords["lly"] < coords["ury"] <= top
+    assert _displayed(coords, page_box) == get_signature_position(position, int(visible_width), int(visible_height))
+
+
+def test_invalid_rotation_is_ignored():
+    assert _place_on_page("top-left", PageBox(LETTER, CROP, 45)) == _place_on_page("top-left", PageBox(LETTER, CROP, 0))
+
+
+def test_positions_are_computed_per_geometry():
+    boxes = [PageBox(LETTER, CROP, 0), PageBox(LETTER, CROP, 90), PageBox(LETTER, CROP, 0)]
+
+    placements = get_signature_positions("bottom-right", boxes)
+
+    assert placements == [_place_on_page("bottom-right", box) for box in boxes]
+    assert placements[0] is placements[2]
+    custom = {"llx": 1, "lly": 2, "urx": 3, "ury": 4}
+    assert get_signature_positions("custom", boxes, custom) == [custom] * 3
+
+
+def test_page_geometry_read_from_the_pdf():
+    pdf = make_pdf(
+        pages=4,
+        rotate={1: 90, 2: 180, 3: 270},
+        media_boxes={index: (0, 0, 612, 792) for index in range(4)},
+        crop_boxes={index: (36, 36, 576, 756) for index in range(4)}
+    )
+    with PdfDocument(io.BytesIO(pdf)) as document:
+        assert [box.rotate for box in document.page_boxes] == [0, 90, 180, 270]
+        assert {box.crop_box for box in document.page_boxes} == {CROP}
+        placements = _signature_placements(document, [1, 2, 3, 4], "bottom-right", None, None)
+
+    assert placements == [
+        {"llx": 481, "lly": 51, "urx": 561, "ury": 81},
+        {"llx": 531, "lly": 661, "urx": 561, "ury": 741},
+        {"llx": 51, "lly": 711, "urx": 131, "ury": 741},
+        {"llx": 51, "lly": 51, "urx": 81, "ury": 131},
+    ]
+
+
+def test_crop_box_defaults_to_an_offset_media_box():
+    # Nessun CropBox: l'area visibile è il MediaBox, anche con origine non nulla
+    pdf = make_pdf(pages=1, media_boxes={0: (100, 200, 695, 1042)})
+    with PdfDocument(io.BytesIO(pdf)) as document:
+        box = document.page_box(1)
+
+    assert box.crop_box == (100.0, 200.0, 695.0, 1042.0)
+    assert _place_on_page("bottom-left", box) == {"llx": 115, "lly": 215, "urx": 195, "ury": 245}
@@ -0,0 +1,131 @@
+import asyncio
+
+import httpx
+import pytest
+
+import app.main as main
+from app.services import http_client
+from app.services.token_cache import TokenCache
+
+
+class FakeGrants:
+    def __init__(self, expires_in=3600):
+        self.expires_in = expires_in
+        self.password_grants = 0
+        self.refresh_grants = 0
+
+    async def password(self, username, password):
+        self.password_grants += 1
+        return {"accessToken": f"token-{self.password_grants}", "refreshToken": "refresh",
+                "expiresIn": self.expires_in, "scope": "sign"}
+
+    async def refresh(self, refresh_token):
+        self.refresh_grants += 1
+        return {"accessToken": f"refreshed-{self.refresh_grants}", "expiresIn": self.expires_in, "scope": "sign"}
+
+
+@pytest.fixture
+def grants():
+    return FakeGrants()
+
+
+def test_token_is_reused_until_invalidated(grants):
+    async def run():
+        cache = TokenCache(grants.password, grants.refresh)
+        first = await cache.get_token("mario", "secret")
+        again = await cache.get_token("mario", "secret")
+        cache.invalidate_token(first["access_token"])
+        renewed = await cache.get_token("mario", "secret")
+        return first, again, renewed
+
+    first, again, renewed = asyncio.run(run())
+
+    assert again["access_token"] == first["access_token"]
+    assert renewed["access_token"] == "token-2"
+    assert grants.password_grants == 2
+
+
+def test_unknown_token_does_not_invalidate_others(grants):
+    async def run():
+        cache = TokenCache(grants.password, grants.refresh)
+        await cache.get_token("mario", "secret")
+        cache.invalidate_token("other-token")
+        return await cache.get_token("mario", "secret")
+
+    assert asyncio.run(run())["access_token"] == "token-1"
+    assert grants.password_grants == 1
+
+
+@pytest.mark.parametrize("status", [401, 403])
+def test_rejected_token_is_invalidated(grants, monkeypatch, status):
+    cache = TokenCache(grants.password, grants.refresh)
+    monkeypatch.setattr(main, "token_cache", cache)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(status)))
+    monkeypatch.setattr(http_client.async_http_client, "client", client)
+
+    async def run():
+        token = await cache.get_token("mario", "secret")
+        main.certificate_cache.put(token["access_token"], {"id": "cert-1"})
+        result = await main.get_certificates(token["access_token"])
+        assert main.certificate_cache.get(token["access_token"]) is None
+        return result, await cache.get_token("mario", "secret")
+
+    result, renewed = asyncio.run(run())
+
+    assert result["type"] == "error"
+    assert renewed["access_token"] == "token-2"
+
+
+def test_least_recently_used_user_is_evicted(grants):
+    async def run():
+        cache = TokenCache(grants.password, grants.refresh, max_entries=2)
+        await cache.get_token("anna", "secret")
+        await cache.get_token("bruno", "secret")
+        await cache.get_token("anna", "secret")
+        evicted = cache._entries["bruno"]
+        await cache.get_token("carla", "secret")
+        await asyncio.sleep(0)
+        return list(cache._entries), evicted.refresh_task.cancelled()
+
+    users, cancelled = asyncio.run(run())
+
+    assert users == ["anna", "carla"]
+    assert cancelled
+    assert grants.password_grants == 3
+
+
+def test_locks_of_failed_grants_are_swept():
+    async def failing(username, password):
+        raise httpx.HTTPStatusError("401", request=httpx.Request("POST", "http://auth.test"),
+                                    response=httpx.Response(401))
+
+    async def run():
+        cache = TokenCache(failing, failing, max_entries=4)
+        for index in range(20):
+            with pytest.raises(httpx.HTTPStatusError):
+                await cache.get_token(f"user-{index}", "wrong")
+        return len(cache._locks)
+
+    assert asyncio.run(run()) <= 4
+
+
+def test_failed_refresh_does_not_log_the_username(capsys):
+    grants = FakeGrants(expires_in=1)
+
+    async def failing_refresh(refresh_token):
+        raise httpx.ConnectError("connessione rifiutata")
+
+    async def run():
+        cache = TokenCache(grants.password, failing_refresh, refresh_margin=0.9)
+        await cache.get_token("mario.rossi@example.com", "secret")
+        await asyncio.sleep(0.01)
+        await cache.get_token("mario.rossi@example.com", "secret")
+        await asyncio.sleep(0.2)
+        return dict(cache._entries)
+
+    entries = asyncio.run(run())
+
+    output = capsys.readouterr().out
+    assert "rinnovo token fallito" in output
+    assert "mario.rossi" not in output
+    assert entries == {}